@@ -0,0 +1,374 @@
+"""
+Export of the Sums histograms to numpy arrays and array based equivalents of some of the extractors in
+post_data_extractors.py. Once exported (see `sums_to_arrays` and `save_arrays`), the arrays can be processed
+without ROOT: Slicing and summing the arrays replaces the projections and scalings of ROOT histograms.
+
+All arrays include the under- and overflow bins, so that ROOT bin indices (as eg. in `Plotting.nch_edges`)
+can be used directly as array indices.
+"""
+
+import numpy as np
+
+eta_classifier_name = "eta_classifier_{}"
+classifier_pT_PID_name = "classifier_pT_PID_{}"
+corr_prefix = "corr_this_with_"
+
+
+class HistArray(object):
+    """
+    Bin contents, squared errors and axis information of a 1, 2 or 3 dimensional histogram.
+
+    Attributes
+    ----------
+    name : str
+    contents : np.ndarray
+        Bin contents indexed by ROOT bin index (x, y, z)
+    sumw2 : np.ndarray
+        Squared bin errors; same shape as `contents`
+    edges : list
+        One array with the nbins + 1 bin edges for each axis
+    labels : list
+        One list of bin labels for each axis. The list is empty if the axis has no labels.
+    """
+    def __init__(self, name, contents, sumw2, edges, labels=None):
+        self.name = name
+        # not copied if already float64, so that memory-mapped arrays stay shared (see `post_shared`)
+        self.contents = np.asarray(contents, dtype=np.float64)
+        self.sumw2 = np.asarray(sumw2, dtype=np.float64)
+        self.edges = [np.asarray(e, dtype=np.float64) for e in edges]
+        self.labels = labels if labels is not None else [[] for _ in edges]
+
+    @property
+    def errors(self):
+        return np.sqrt(self.sumw2)
+
+    @property
+    def centers(self):
+        """Bin centers of each axis (without under- and overflow)"""
+        return [(e[1:] + e[:-1]) / 2.0 for e in self.edges]
+
+    @property
+    def widths(self):
+        """Bin widths of each axis (without under- and overflow)"""
+        return [np.diff(e) for e in self.edges]
+
+    def find_label(self, axis, label):
+        """Return the bin index of the given label on the given axis (0: x, 1: y, 2: z); 0 if not found"""
+        try:
+            return self.labels[axis].index(label) + 1
+        except ValueError:
+            return 0
+
+
+class EstimatorArrays(object):
+    """
+    Arrays of all histograms of one estimator's Sums list which are needed for the array based extractors.
+
+    Attributes
+    ----------
+    name : str
+        Name of the estimator
+    eta_classifier : HistArray
+        x: eta; y: classifier value
+    classifier_pT_PID : HistArray
+        x: classifier value; y: pT; z: PID
+    correlations : dict
+        Maps the name of the other estimator to the HistArray of `corr_this_with_<other>`
+        (x: this classifier, y: other classifier)
+    """
+    def __init__(self, name, eta_classifier, classifier_pT_PID, correlations):
+        self.name = name
+        self.eta_classifier = eta_classifier
+        self.classifier_pT_PID = classifier_pT_PID
+        self.correlations = correlations
+
+    @property
+    def pids(self):
+        """PDG codes (as strings) on the PID axis of classifier_pT_PID"""
+        return self.classifier_pT_PID.labels[2]
+
+
+def _buffer_to_array(buf, size):
+    buf.SetSize(size)
+    return np.frombuffer(buf, dtype=np.float64, count=size).copy()
+
+
+def axis_edges(axis):
+    nbins = axis.GetNbins()
+    xbins = axis.GetXbins()
+    if xbins.GetSize() == nbins + 1:
+        # variable bin widths
+        return _buffer_to_array(xbins.GetArray(), nbins + 1)
+    return np.linspace(axis.GetXmin(), axis.GetXmax(), nbins + 1)
+
+
+def axis_labels(axis):
+    if not axis.GetLabels():
+        return []
+    return [axis.GetBinLabel(i) for i in range(1, axis.GetNbins() + 1)]
+
+
+def hist_axes(hist):
+    """The x, y and z axis of a histogram, as far as it has them"""
+    return [hist.GetXaxis(), hist.GetYaxis(), hist.GetZaxis()][:hist.GetDimension()]
+
+
+def flat_bin_arrays(hist):
+    """
+    Bin contents and squared errors of a histogram as flat arrays indexed by ROOT's global bin number
+    """
+    # imported here so that this module can be used without ROOT once the arrays are exported
+    from post_utils import get_bin_contents
+    contents = get_bin_contents(hist)
+    sumw2 = hist.GetSumw2()
+    if sumw2.GetSize() == contents.size:
+        sumw2 = _buffer_to_array(sumw2.GetArray(), contents.size)
+    else:
+        # no weights were used; errors are the square root of the contents
+        sumw2 = np.abs(contents)
+    return contents, sumw2
+
+
+def unflatten(flat, edges):
+    """
+    View of a flat array in ROOT's global bin order as an array indexed by [x, y, z] bin numbers
+    """
+    # ROOT's global bin is x + (nx + 2) * (y + (ny + 2) * z); reverse the shape and transpose to get [x, y, z]
+    shape = tuple(len(e) + 1 for e in edges)
+    return flat.reshape(shape[::-1]).T
+
+
+def hist_to_array(hist):
+    """
+    Convert a ROOT histogram (TH1, TH2 or TH3) to a HistArray.
+    """
+    axes = hist_axes(hist)
+    edges = [axis_edges(axis) for axis in axes]
+    contents, sumw2 = flat_bin_arrays(hist)
+    return HistArray(name=hist.GetName(),
+                     contents=unflatten(contents, edges),
+                     sumw2=unflatten(sumw2, edges),
+                     edges=edges,
+                     labels=[axis_labels(axis) for axis in axes])
+
+
+def sums_to_arrays(sums, considered_ests):
+    """
+    Dump the histograms of all considered estimators in the Sums list into arrays.
+
+    Parameters
+    ----------
+    sums : TList
+           Sums directory
+    considered_ests : list
+           Names of the estimators to export
+
+    Returns
+    -------
+    dict :
+        Estimator name to EstimatorArrays
+    """
+    arrays = {}
+    for est_dir in sums:
+        est_name = est_dir.GetName()
+        if est_name not in considered_ests:
+            continue
+        correlations = {}
+        for obj in est_dir:
+            if obj.GetName().startswith(corr_prefix):
+                correlations[obj.GetName()[len(corr_prefix):]] = hist_to_array(obj)
+        arrays[est_name] = EstimatorArrays(
+            name=est_name,
+            eta_classifier=hist_to_array(est_dir.FindObject(eta_classifier_name.format(est_name))),
+            classifier_pT_PID=hist_to_array(est_dir.FindObject(classifier_pT_PID_name.format(est_name))),
+            correlations=correlations)
+    return arrays
+
+
+def _hist_array_to_dict(prefix, harr):
+    d = {prefix + "name": np.array(harr.name),
+         prefix + "contents": harr.contents,
+         prefix + "sumw2": harr.sumw2}
+    for iaxis, (edges, labels) in enumerate(zip(harr.edges, harr.labels)):
+        d[prefix + "edges{}".format(iaxis)] = edges
+        d[prefix + "labels{}".format(iaxis)] = np.array(labels, dtype=str)
+    return d
+
+
+def _hist_array_from_dict(prefix, d):
+    ndim = d[prefix + "contents"].ndim
+    return HistArray(name=str(d[prefix + "name"]),
+                     contents=d[prefix + "contents"],
+                     sumw2=d[prefix + "sumw2"],
+                     edges=[d[prefix + "edges{}".format(i)] for i in range(ndim)],
+                     labels=[list(d[prefix + "labels{}".format(i)]) for i in range(ndim)])
+
+
+def save_arrays(fname, arrays):
+    """
+    Save the output of `sums_to_arrays` to an (uncompressed) .npz file
+    """
+    flat = {}
+    for est_name, est_arrays in arrays.items():
+        flat.update(_hist_array_to_dict("{}/eta_classifier/".format(est_name), est_arrays.eta_classifier))
+        flat.update(_hist_array_to_dict("{}/classifier_pT_PID/".format(est_name), est_arrays.classifier_pT_PID))
+        for other, harr in est_arrays.correlations.items():
+            flat.update(_hist_array_to_dict("{}/{}{}/".format(est_name, corr_prefix, other), harr))
+    np.savez(fname, **flat)
+
+
+def load_arrays(fname):
+    """
+    Load arrays saved with `save_arrays`. Does not need ROOT.
+
+    Returns
+    -------
+    dict :
+        Estimator name to EstimatorArrays
+    """
+    d = np.load(fname)
+    prefixes = set(key.rsplit("/", 1)[0] + "/" for key in d.files)
+    arrays = {}
+    for est_name in set(prefix.split("/")[0] for prefix in prefixes):
+        correlations = {}
+        for prefix in prefixes:
+            est, hist_name = prefix.split("/")[:2]
+            if est == est_name and hist_name.startswith(corr_prefix):
+                correlations[hist_name[len(corr_prefix):]] = _hist_array_from_dict(prefix, d)
+        arrays[est_name] = EstimatorArrays(
+            name=est_name,
+            eta_classifier=_hist_array_from_dict("{}/eta_classifier/".format(est_name), d),
+            classifier_pT_PID=_hist_array_from_dict("{}/classifier_pT_PID/".format(est_name), d),
+            correlations=correlations)
+    return arrays
+
+
+########################################################
+# Array based equivalents of the post_data_extractors #
+########################################################
+
+def get_event_counter(est_arrays, ref_est="EtaLt05"):
+    """
+    Number of events per classifier bin (including under- and overflow); Same as the `event_counter`
+    histogram written by `Plotting.plot_event_counters`.
+    """
+    # ProjectionX sums over all y bins, including under- and overflow
+    return est_arrays.correlations[ref_est].contents.sum(axis=1)
+
+
+def _integral(event_counter, classifier_bin_interval):
+    return event_counter[classifier_bin_interval[0]:classifier_bin_interval[1] + 1].sum()
+
+
+def _pid_bins(est_arrays, pids):
+    pid_bins = [est_arrays.classifier_pT_PID.find_label(2, pid) for pid in pids]
+    for pid, pid_bin in zip(pids, pid_bins):
+        if pid_bin == 0:
+            raise ValueError("given pdg ({}) does not exist in histogram".format(pid))
+    return pid_bins
+
+
+def get_dNdeta_in_classifier_bin_interval(est_arrays, event_counter, classifier_bin_interval):
+    """
+    Get dN/deta for a given interval of classifier bin indices
+    Parameters
+    ----------
+    est_arrays : EstimatorArrays
+        Arrays of a classifier
+    event_counter : np.ndarray
+        Number of events per classifier bin; see `get_event_counter`
+    classifier_bin_interval : list
+        classifier value bin edges given as bin indices
+    Returns
+    -------
+    HistArray :
+        1D; dN/deta
+    """
+    h2d = est_arrays.eta_classifier
+    first, last = classifier_bin_interval
+    nevents = float(_integral(event_counter, classifier_bin_interval))
+    if nevents == 0:
+        raise ZeroDivisionError("Your statistics are terrible! Consider increasing the classifier value interval to avoid this")
+    # scale by the number of events in this mult_interval and bin width
+    widths = np.ones(h2d.contents.shape[0])
+    widths[1:-1] = h2d.widths[0]
+    scale = 1.0 / (nevents * widths)
+    return HistArray(name="dNdeta_{}_{}_{}".format(est_arrays.name, first, last),
+                     contents=h2d.contents[:, first:last + 1].sum(axis=1) * scale,
+                     sumw2=h2d.sumw2[:, first:last + 1].sum(axis=1) * scale ** 2,
+                     edges=h2d.edges[:1])
+
+
+def get_identified_vs_mult(est_arrays, pdg):
+    """
+    Counts of identified particles vs N_ch^est
+    Parameters
+    ----------
+    est_arrays : EstimatorArrays
+    pdg : str
+        pdg code as string
+    Returns
+    -------
+    HistArray :
+        1D; x: Nch_est y: counts
+    """
+    h3d = est_arrays.classifier_pT_PID
+    pid_bin, = _pid_bins(est_arrays, [pdg])
+    return HistArray(name="identified_vs_mult_{}_{}".format(est_arrays.name, pdg),
+                     contents=h3d.contents[:, :, pid_bin].sum(axis=1),
+                     sumw2=h3d.sumw2[:, :, pid_bin].sum(axis=1),
+                     edges=h3d.edges[:1])
+
+
+def get_pT_distribution(est_arrays, event_counter, pids, classifier_bin_interval, normalized=False):
+    """
+    Parameters
+    ----------
+    est_arrays : EstimatorArrays
+    event_counter : np.ndarray
+        Number of events per classifier bin; see `get_event_counter`
+    pids : list
+        List of strings denoting requested pids
+    classifier_bin_interval : tuple
+        Lower and upper limit of classifier value for which the p_T distribution should be made.
+        This value needs to be given as bin indices!
+    normalized : Boolean
+        Should the distribution be normalized to yield P(p_T)?
+    Returns
+    -------
+    HistArray :
+        1D; P(p_T)
+    """
+    h3d = est_arrays.classifier_pT_PID
+    first, last = classifier_bin_interval
+    pid_bins = _pid_bins(est_arrays, pids)
+    contents = h3d.contents[first:last + 1, :, pid_bins].sum(axis=(0, 2))
+    sumw2 = h3d.sumw2[first:last + 1, :, pid_bins].sum(axis=(0, 2))
+    # Scale by the number of events in the interval;
+    scale = 1.0 / _integral(event_counter, classifier_bin_interval)
+    if normalized:
+        scale /= contents[1:-1].sum() * scale
+    return HistArray(name="pT_{}_{}_{}".format(est_arrays.name, first, last),
+                     contents=contents * scale,
+                     sumw2=sumw2 * scale ** 2,
+                     edges=h3d.edges[1:2])
+
+
+def get_mean_nMPI(est_arrays, classifier_bin_interval):
+    """
+    Get the mean nMPI of events in a given classifier bin interval
+    Parameters
+    ----------
+    est_arrays : EstimatorArrays
+    classifier_bin_interval : tuple
+        Lower and upper limit (bin indices) of the classifier for which <nMPI> should be calculated
+    Returns
+    -------
+    Float :
+           <nMPI>
+    """
+    nch_vs_nmpi = est_arrays.correlations["nMPI"]
+    first, last = classifier_bin_interval
+    # like GetMean(2): weighted by the bin content, without under- and overflow in nMPI
+    weights = nch_vs_nmpi.contents[first:last + 1, 1:-1].sum(axis=0)
+    return float((weights * nch_vs_nmpi.centers[1]).sum() / weights.sum())
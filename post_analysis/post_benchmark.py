@@ -0,0 +1,197 @@
+"""
+Benchmarks of the post analysis on synthetic input files. The generator writes a `MultEstimators/Sums<trigger>`
+list with the same objects (and names) as the analysis task, but with configurable binning, number of
+estimators, number of PIDs and number of events. Each stage of the post analysis (see `post_main.sections`)
+is profiled with `post_profiling.Profiler`. The results are appended as one json object per line to the
+output file, so that runs before and after a change can be compared.
+
+Example:
+
+    $ python ./post_benchmark.py --nch-bins 100 400 1600 --output benchmark_results.json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from rootpy import log, ROOT
+
+from post_main import considered_ests, percentile_bins, sections
+from post_profiling import Profiler, step_label
+from post_utils import set_bin_contents
+from post_plotting import \
+    Plotting,\
+    kPROTON, kANTIPROTON, kLAMBDA, kANTILAMBDA, kK0S, kKPLUS, kKMINUS, kPIPLUS, kPIMINUS, kPI0,\
+    kXI, kANTIXI, kOMEGAMINUS, kOMEGAPLUS
+
+log = log["/benchmark"]
+
+# pids which are used by the plots; more can be added with --n-pids
+required_pids = [kPROTON, kANTIPROTON, kLAMBDA, kANTILAMBDA, kK0S, kKPLUS, kKMINUS, kPIPLUS, kPIMINUS, kPI0,
+                 kXI, kANTIXI, kOMEGAMINUS, kOMEGAPLUS]
+# estimators which are always needed: the reference estimator and nMPI for <nMPI>
+required_ests = ['EtaLt05', 'nMPI']
+
+
+def _with_flow_bins(a):
+    """Pad an array of bin contents with empty under- and overflow bins on each axis"""
+    return np.pad(a, 1, mode='constant')
+
+
+def make_synthetic_sums(f_name, trigger="Inel", ests=None, nch_bins=200, eta_bins=40, pt_bins=50, n_pids=None,
+                        nevents=1000000, tuple_events=10000, seed=42):
+    """
+    Write a synthetic Sums<trigger> list to `f_name` (recreated).
+
+    Each event has a random activity. The multiplicity of each estimator is Poisson distributed around a
+    multiple of this activity, so that the estimators are correlated.
+
+    Parameters
+    ----------
+    ests : list
+        Names of the estimators; EtaLt05 and nMPI are always added
+    nch_bins : int
+        Number of bins of each classifier axis (one bin per unit of N_ch)
+    eta_bins, pt_bins : int
+        Number of eta and pT bins
+    n_pids : int
+        Number of bins on the PID axis; at least the pids used by the plots
+    nevents : int
+        Number of events
+    tuple_events : int
+        Number of events in the event tuple of each estimator
+    """
+    rng = np.random.RandomState(seed)
+    ests = list(ests) if ests is not None else list(considered_ests)
+    ests = required_ests + [est for est in ests if est not in required_ests]
+    pids = list(required_pids)
+    pids += [str(1000000 + i) for i in range(max(0, (n_pids or 0) - len(pids)))]
+
+    activity = rng.gamma(shape=1.5, scale=1.0, size=nevents)
+    ev_weight = np.ones(nevents)
+    # multiplicity scale of each estimator relative to the activity
+    scales = dict((est, 5.0 + 10.0 * i / len(ests)) for i, est in enumerate(ests))
+    nch = dict((est, np.minimum(rng.poisson(activity * scales[est]), nch_bins - 1)) for est in ests)
+
+    eta_centers = np.linspace(-5, 5, eta_bins, endpoint=False) + 5.0 / eta_bins
+    eta_shape = np.exp(-eta_centers ** 2 / 18.0)
+    eta_shape /= eta_shape.sum() * (10.0 / eta_bins)
+    pt_centers = np.linspace(0, 20, pt_bins, endpoint=False) + 10.0 / pt_bins
+    pt_shape = pt_centers * np.exp(-pt_centers / 0.5)
+    pt_shape /= pt_shape.sum()
+    pid_fractions = rng.dirichlet(np.ones(len(pids)))
+
+    add_directory = ROOT.TH1.AddDirectoryStatus()
+    ROOT.TH1.AddDirectory(False)
+    sums = ROOT.TList()
+    sums.SetName("Sums" + trigger)
+    try:
+        for est in ests:
+            est_list = ROOT.TList()
+            est_list.SetName(est)
+            # number of events and summed total multiplicity in each classifier bin
+            nevents_in_bin = np.bincount(nch[est], minlength=nch_bins).astype(np.float64)
+            mult_in_bin = np.bincount(nch[est], weights=activity * 20.0, minlength=nch_bins)
+
+            h = ROOT.TH2D("eta_classifier_" + est, "", eta_bins, -5, 5, nch_bins, 0, nch_bins)
+            set_bin_contents(h, _with_flow_bins(rng.poisson(np.outer(eta_shape, mult_in_bin) * 10.0 / eta_bins)))
+            est_list.Add(h)
+
+            h = ROOT.TH3D("classifier_pT_PID_" + est, "", nch_bins, 0, nch_bins, pt_bins, 0, 20,
+                          len(pids), 0, len(pids))
+            for ipid, pid in enumerate(pids):
+                h.GetZaxis().SetBinLabel(ipid + 1, pid)
+            expected = mult_in_bin[:, None, None] * pt_shape[None, :, None] * pid_fractions[None, None, :]
+            set_bin_contents(h, _with_flow_bins(rng.poisson(expected)))
+            est_list.Add(h)
+
+            for other in ests:
+                h = ROOT.TH2D("corr_this_with_" + other, "", nch_bins, 0, nch_bins, nch_bins, 0, nch_bins)
+                counts, _, _ = np.histogram2d(nch[est], nch[other], bins=nch_bins, range=[[0, nch_bins]] * 2)
+                set_bin_contents(h, _with_flow_bins(counts))
+                est_list.Add(h)
+            if nevents_in_bin.sum() != nevents:
+                raise RuntimeError("Lost events while binning estimator {}".format(est))
+
+            nt = ROOT.TNtuple("fEventTuple", "", "nch:ev_weight")
+            for ievent in xrange(min(nevents, tuple_events)):
+                nt.Fill(nch[est][ievent], ev_weight[ievent])
+            est_list.Add(nt)
+            sums.Add(est_list)
+    finally:
+        ROOT.TH1.AddDirectory(add_directory)
+
+    f = ROOT.TFile.Open(f_name, "recreate")
+    f.mkdir("MultEstimators").cd()
+    sums.Write(sums.GetName(), ROOT.TObject.kSingleKey)
+    f.Close()
+    sums.Delete()
+    return ests
+
+
+def run_benchmark(f_name, ests, trigger="Inel"):
+    """
+    Run the post analysis on the given file and profile each stage.
+
+    Returns
+    -------
+    list :
+        The summary of the profiler; one dict for each stage (and estimator) with the wall and cpu time in
+        seconds, the memory in MB and the number of created ROOT objects
+    """
+    profiler = Profiler()
+    with profiler.stage("init"):
+        plotting = Plotting(f_name=f_name, sums_dir_name="Sums" + trigger,
+                            results_dir_name="results_post" + trigger, percentile_bins=percentile_bins,
+                            considered_ests=ests, keep_open=True, profiler=profiler)
+    for _, step, kwargs in sections:
+        plotting.run_step(step, **kwargs)
+    plotting.close()
+    log.info("\n" + profiler.format_summary())
+    return profiler.summary()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the post analysis on synthetic Sums files")
+    parser.add_argument("--nch-bins", type=int, nargs="+", default=[200],
+                        help="Number of bins of the classifier axes; one benchmark per value")
+    parser.add_argument("--eta-bins", type=int, default=40)
+    parser.add_argument("--pt-bins", type=int, default=50)
+    parser.add_argument("--n-ests", type=int, default=len(considered_ests), help="Number of estimators")
+    parser.add_argument("--n-pids", type=int, default=len(required_pids), help="Number of PID bins")
+    parser.add_argument("--events", type=int, default=1000000, help="Number of synthetic events")
+    parser.add_argument("--output", default="benchmark_results.json",
+                        help="File to which the results are appended")
+    parser.add_argument("--keep", action="store_true", help="Keep the synthetic input files")
+    args = parser.parse_args()
+
+    ROOT.gROOT.SetBatch(True)
+    # top level stages; the others are nested in them
+    step_stages = ["init", "close file"] + [step_label(step, kwargs) for _, step, kwargs in sections]
+    tmpdir = tempfile.mkdtemp(prefix="hmtf_benchmark_")
+    try:
+        for nch_bins in args.nch_bins:
+            config = dict(nch_bins=nch_bins, eta_bins=args.eta_bins, pt_bins=args.pt_bins, n_ests=args.n_ests,
+                          n_pids=args.n_pids, events=args.events)
+            log.info("Benchmarking {}".format(config))
+            f_name = os.path.join(tmpdir, "synthetic_{}.root".format(nch_bins))
+            start = time.time()
+            ests = make_synthetic_sums(f_name, ests=considered_ests[:args.n_ests], nch_bins=nch_bins,
+                                       eta_bins=args.eta_bins, pt_bins=args.pt_bins, n_pids=args.n_pids,
+                                       nevents=args.events)
+            log.info("Generated {} in {:.1f} s".format(f_name, time.time() - start))
+            stages = run_benchmark(f_name, ests)
+            total_seconds = sum(s['wall_s'] for s in stages if s['est'] is None and s['stage'] in step_stages)
+            with open(args.output, "a") as f:
+                f.write(json.dumps(dict(time=time.time(), config=config, stages=stages,
+                                        total_seconds=total_seconds)) + "\n")
+    finally:
+        if args.keep:
+            log.info("Synthetic files kept in {}".format(tmpdir))
+        else:
+            shutil.rmtree(tmpdir)
@@ -0,0 +1,143 @@
+"""
+Caches for objects which are derived from the Sums over and over again during a post analysis run. The cached
+objects are detached from any file, so they stay valid if the file is closed between two plot steps.
+"""
+
+from rootpy import asrootpy, log
+
+from post_data_extractors import get_correlation_histogram
+from post_profiling import Profiler
+from post_shared import SharedHist3D
+from post_temporaries import adopt, temp_name
+
+
+class ProjectionCache(object):
+    """
+    Cache of projections of the 3D `classifier_pT_PID_<est>` histograms (x: classifier value, y: pT, z: PID).
+    The first request for a single PID bin of a histogram projects all its PID bins in one pass. The returned
+    histograms are shared between all callers and must not be modified.
+    """
+    def __init__(self, profiler=None):
+        self._projections = {}
+        self._profiler = profiler if profiler is not None else Profiler(enabled=False)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, est_name, h3d, axes, pid_bin_range):
+        """
+        Parameters
+        ----------
+        est_name : str
+            Name of the estimator the histogram belongs to
+        h3d : Hist3D or SharedHist3D
+            x: est_mult; y: pT; z: pids
+        axes : str
+            "yx" for the classifier vs pT projection, "x" for the projection onto the classifier axis
+        pid_bin_range : tuple
+            First and last PID bin (inclusive) which are summed up
+
+        Returns
+        -------
+        Hist2D or Hist1D :
+            The requested projection
+        """
+        key = (est_name, h3d.GetName(), axes, tuple(pid_bin_range))
+        try:
+            proj = self._projections[key]
+            self.hits += 1
+            return proj
+        except KeyError:
+            self.misses += 1
+        with self._profiler.stage("projection"):
+            if pid_bin_range[0] == pid_bin_range[1]:
+                self._fill_all_pid_bins(est_name, h3d)
+            else:
+                self._fill(est_name, h3d, pid_bin_range)
+        return self._projections[key]
+
+    def _fill_all_pid_bins(self, est_name, h3d):
+        if not isinstance(h3d, SharedHist3D):
+            # read the bin contents once and slice them along z, instead of one Project3D pass per PID bin
+            h3d = SharedHist3D.from_hist(h3d)
+        for ibin in range(1, h3d.GetZaxis().GetNbins() + 1):
+            self._fill(est_name, h3d, (ibin, ibin))
+
+    def _fill(self, est_name, h3d, pid_bin_range):
+        if isinstance(h3d, SharedHist3D):
+            # arrays; summed directly, without a Hist3D
+            mult_pt = h3d.project_yx(pid_bin_range)
+        else:
+            h3d.GetZaxis().SetRange(*pid_bin_range)
+            # rename right away; Project3D would otherwise reuse the same object for the next projection
+            mult_pt = adopt(asrootpy(h3d.Project3D("yx")), temp_name())
+            h3d.GetZaxis().SetRange(0, 0)
+        mult = adopt(asrootpy(mult_pt.ProjectionX(temp_name())))
+        self._projections[(est_name, h3d.GetName(), "yx", tuple(pid_bin_range))] = mult_pt
+        self._projections[(est_name, h3d.GetName(), "x", tuple(pid_bin_range))] = mult
+
+    def report(self):
+        """Log how often a projection was served from the cache"""
+        log.info("Projection cache: {} hits, {} misses, {} cached projections"
+                 .format(self.hits, self.misses, len(self._projections)))
+
+
+class CorrelationStore(object):
+    """
+    Store of the `corr_this_with_<other>` histograms of the estimators (x: estimator, y: other) and of the
+    projections and profiles derived from them. Each histogram is copied out of the Sums on its first request
+    and each derived object is computed on its first request; all of them are then shared for the rest of the
+    run. They must not be modified by the callers (eg. scaled or given an axis range); clone them first.
+    """
+    def __init__(self, profiler=None):
+        self._objects = {}
+        self._profiler = profiler if profiler is not None else Profiler(enabled=False)
+        self.hits = 0
+        self.misses = 0
+
+    def hist(self, sums, est_name, other_name):
+        """
+        Returns
+        -------
+        Hist2D :
+            Correlation histogram of est_name (x-axis) and other_name (y-axis)
+        """
+        return self._get("hist", sums, est_name, other_name)
+
+    def projection_x(self, sums, est_name, other_name):
+        """Distribution of the events over est_name; ie. the event counter"""
+        return self._get("px", sums, est_name, other_name)
+
+    def projection_y(self, sums, est_name, other_name):
+        """Distribution of the events over other_name"""
+        return self._get("py", sums, est_name, other_name)
+
+    def profile_x(self, sums, est_name, other_name):
+        """Mean value of other_name in each bin of est_name"""
+        return self._get("profx", sums, est_name, other_name)
+
+    def _get(self, kind, sums, est_name, other_name):
+        key = (kind, est_name, other_name)
+        try:
+            obj = self._objects[key]
+            self.hits += 1
+            return obj
+        except KeyError:
+            self.misses += 1
+        with self._profiler.stage("correlation"):
+            if kind == "hist":
+                obj = asrootpy(get_correlation_histogram(sums, est_name, other_name).Clone(temp_name()))
+            else:
+                corr_hist = self.hist(sums, est_name, other_name)
+                if kind == "px":
+                    obj = asrootpy(corr_hist.ProjectionX(temp_name()))
+                elif kind == "py":
+                    obj = asrootpy(corr_hist.ProjectionY(temp_name()))
+                else:
+                    obj = asrootpy(corr_hist.ProfileX(temp_name()))
+        self._objects[key] = adopt(obj)
+        return obj
+
+    def report(self):
+        """Log how often an object was served from the store"""
+        log.info("Correlation store: {} hits, {} misses, {} stored objects"
+                 .format(self.hits, self.misses, len(self._objects)))
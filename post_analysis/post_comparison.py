@@ -0,0 +1,183 @@
+"""
+Access to the post analysis results of several generators for comparison plots. The result files are kept
+open in a small pool and the results read from them are cached, so that each file is opened and each object
+is read only once, no matter how often it is used. Results are read from the indexed store written by the
+post analysis (see `post_store`); the saved canvases are only deserialized for results without a store.
+"""
+
+from collections import OrderedDict
+
+from rootpy import log
+from rootpy.io import root_open
+
+from roofie.figure import Figure
+
+from post_store import ResultsStore, store_dir_name
+
+log = log["/comparison"]
+
+
+class FilePool(object):
+    """
+    Least recently used pool of files opened read-only. If more than `max_open` files are requested, the
+    least recently used one is closed.
+    """
+    def __init__(self, max_open=8):
+        self.max_open = max_open
+        self._files = OrderedDict()
+        self.opens = 0
+        self.hits = 0
+
+    def get(self, path):
+        try:
+            f = self._files.pop(path)
+            self.hits += 1
+        except KeyError:
+            if len(self._files) >= self.max_open:
+                _, lru = self._files.popitem(last=False)
+                lru.Close()
+            f = root_open(path, 'read')
+            self.opens += 1
+        # most recently used last
+        self._files[path] = f
+        return f
+
+    def close(self):
+        for f in self._files.values():
+            f.Close()
+        self._files.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class GeneratorComparison(object):
+    """
+    Results of the post analysis of several generators
+    """
+    def __init__(self, files, pool=None, results_dir_name="results_post"):
+        """
+        Parameters
+        ----------
+        files : OrderedDict
+            Path of the AnalysisResults.root file of each generator
+        pool : FilePool
+            Pool of open files; a new one large enough for all files if not given
+        results_dir_name : str
+            Name of the results dir without the trigger
+        """
+        self.files = OrderedDict(files)
+        self.pool = pool if pool is not None else FilePool(max_open=max(1, len(self.files)))
+        self.results_dir_name = results_dir_name
+        # (generator, trigger, estimator, object) -> (canvas, plottables)
+        self._plottables = {}
+        # (generator, trigger) -> ResultsStore
+        self._stores = {}
+        # (generator, trigger, object name in the store) -> object
+        self._results = {}
+
+    @property
+    def generators(self):
+        return self.files.keys()
+
+    def results_dir(self, generator, trigger=''):
+        """The results dir of the given generator and trigger; trigger is '' for results without trigger"""
+        f = self.pool.get(self.files[generator])
+        return f.MultEstimators.Get(self.results_dir_name + trigger)
+
+    def get(self, generator, trigger, estimator, name):
+        """
+        Object `name` in the results dir of the estimator, or directly in the results dir if estimator is None.
+        `name` may be a path, eg. "pid_ratios_vs_refmult/3312_div_-211_211".
+        """
+        tdir = self.results_dir(generator, trigger)
+        if estimator is not None:
+            tdir = tdir.Get(estimator)
+        return tdir.Get(name)
+
+    def store(self, generator, trigger=''):
+        """Index of the results store of the given generator and trigger; empty for older result files"""
+        key = (generator, trigger)
+        if key not in self._stores:
+            self._stores[key] = ResultsStore.read(self.results_dir(generator, trigger), trigger)
+        return self._stores[key]
+
+    def _stored_object(self, generator, trigger, entry):
+        key = (generator, trigger, entry['name'])
+        if key not in self._results:
+            obj = self.results_dir(generator, trigger).Get(store_dir_name + "/" + entry['name'])
+            # keep the object alive if the file is closed by the pool
+            if hasattr(obj, "SetDirectory"):
+                obj.SetDirectory(0)
+            self._results[key] = obj
+        return self._results[key]
+
+    def result(self, generator, trigger, observable, estimator=None, label=''):
+        """
+        A single result from the store, eg. result(gen, 'V0AND', 'dNdeta_summary', 'V0M', '0.0%-0.1%').
+        The object is read once and shared.
+
+        Raises
+        ------
+        KeyError :
+            There is no such result in the store
+        """
+        entry = self.store(generator, trigger).find(observable, estimator, label)
+        return self._stored_object(generator, trigger, entry)
+
+    def plottables(self, generator, trigger, estimator, name):
+        """
+        Plottables of the figure `name` (see `get`) in the same format as roofie's `Figure._plottables`. They
+        are read from the store if possible and otherwise imported from the saved canvas. The plottables are
+        read once and cached; each call returns new dicts, which can be modified, but the plotted objects are
+        shared.
+        """
+        key = (generator, trigger, estimator, name)
+        figure_path = name if estimator is None else estimator + "/" + name
+        entries = self.store(generator, trigger).figure_entries(figure_path)
+        if entries:
+            plottables = []
+            for entry in entries:
+                plottable = dict(p=self._stored_object(generator, trigger, entry),
+                                 legend_title=entry['legend_title'])
+                for style in ('color', 'markerstyle'):
+                    if entry[style] is not None:
+                        # json turns rgb tuples into lists
+                        plottable[style] = tuple(entry[style]) if isinstance(entry[style], list) else entry[style]
+                plottables.append(plottable)
+            return plottables
+        try:
+            _, plottables = self._plottables[key]
+        except KeyError:
+            canvas = self.get(generator, trigger, estimator, name)
+            tmp_fig = Figure()
+            tmp_fig.import_plottables_from_canvas(canvas)
+            plottables = tmp_fig._plottables
+            for plottable in plottables:
+                # keep the objects alive if the file is closed by the pool
+                if hasattr(plottable['p'], "SetDirectory"):
+                    plottable['p'].SetDirectory(0)
+            # the canvas owns the plotted objects, so it has to be kept as well
+            self._plottables[key] = (canvas, plottables)
+        return [dict(plottable) for plottable in plottables]
+
+    def find_plottable(self, generator, trigger, estimator, name, legend_title):
+        """
+        The plottable with the given legend title of the canvas `name`; see `plottables`
+
+        Raises
+        ------
+        ValueError :
+            There is no plottable with this legend title
+        """
+        for plottable in self.plottables(generator, trigger, estimator, name):
+            if plottable['legend_title'] == legend_title:
+                return plottable
+        raise ValueError("No plottable '{}' in {} of {}".format(legend_title, name, generator))
+
+    def report(self):
+        log.info("{} files opened, {} reused; {} results read from stores, {} canvases imported"
+                 .format(self.pool.opens, self.pool.hits, len(self._results), len(self._plottables)))
@@ -0,0 +1,375 @@
+"""
+Comparison figures of several generators described by a spec file instead of a script. The spec (json, or
+yaml if PyYAML is installed) lists the generators and their result files and the figures, each made of
+series of plottables taken from the canvases saved by the post analysis. See `comparison_specs/` for
+examples.
+
+The results needed by the requested figures are collected first, so that each of them is read only once
+(see `post_comparison.GeneratorComparison`). Only the requested figures are rendered. With several jobs, the
+figures are split into groups which do not share any object and the groups are rendered in parallel
+processes.
+
+Example:
+
+    $ python ./post_comparison_spec.py comparison_specs/generator_comparison.json --root-file plots.root
+    $ python ./post_comparison_spec.py comparison_specs/presentation_plots.json -j 4 --pdf-dir ./ \\
+          --figure hm_dNdeta_gen_comp hm_pnch_gen_comp
+
+Spec format:
+
+    generators:     list of {name, file, title}; the title (default: name) is used for "{title}" below
+    defaults:       figure properties used for all figures, eg. {"plot": {"palette": "colorblind"}}
+    figures:        list of figures with
+        name:       name of the figure in the output root file or pdf
+        xtitle, ytitle
+        plot:       attributes of `Figure.plot`, eg. xmin, ymax, logy
+        legend:     attributes of `Figure.legend`, eg. title, position
+        series:     list of series with
+            generators: names of the generators; all by default
+            trigger:    trigger of the results dir, eg. "V0AND"; "" by default
+            estimator:  estimator dir or null for objects directly in the results dir
+            object:     name of the canvas, may be a path like "pid_ratios_vs_refmult/3312_div_-211_211"
+            select:     legend title (str) or index (int) of the plottable in the canvas, or a list of them;
+                        all plottables by default. Prefer the legend titles (eg. "0.0%-0.1%", "MB" or
+                        "|#eta|#leq1.5" for the estimators titled by `make_estimator_title`); indices change
+                        with the plotted percentile bins
+            legend_title: format string with the fields {generator}, {title} and {legend_title} (the legend
+                        title in the canvas); the canvas' legend title by default
+            keep_style: keep color and marker of the canvas; false by default
+            each:       lists of values of legend_title or style keys; the n-th plottable of the series gets
+                        the n-th element of each list
+            any other key is passed on to `Figure.add_plottable`, eg. color or markerstyle
+
+    The plottables of a series are taken for each generator in turn and for each selected plottable.
+"""
+
+import argparse
+from collections import OrderedDict
+import json
+from multiprocessing import Pool
+import os
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+from rootpy import log, ROOT
+from rootpy.io import root_open
+
+from roofie.figure import Figure
+
+from post_comparison import GeneratorComparison
+from post_main import considered_ests, percentile_bins
+from post_plotting import figure_labels
+from post_utils import native_strings
+
+log = log["/comparison_spec"]
+
+# keys of a series which are not passed on to `Figure.add_plottable`
+series_keys = ['generators', 'trigger', 'estimator', 'object', 'select', 'legend_title', 'keep_style', 'each']
+
+
+def load_spec(fname):
+    """
+    Read a spec from a json or yaml file
+
+    Raises
+    ------
+    ImportError :
+        A yaml file is given, but PyYAML is not installed
+    """
+    with open(fname) as f:
+        if os.path.splitext(fname)[1] in ('.yaml', '.yml'):
+            if yaml is None:
+                raise ImportError("PyYAML is needed to read {}; use a json spec instead".format(fname))
+            return native_strings(yaml.safe_load(f))
+        return native_strings(json.load(f, object_pairs_hook=OrderedDict))
+
+
+class ComparisonSpec(object):
+    """
+    Parsed spec of comparison figures and the objects each of them needs
+    """
+    def __init__(self, spec):
+        """
+        Parameters
+        ----------
+        spec : dict
+            Spec as read by `load_spec`
+
+        Raises
+        ------
+        ValueError :
+            The spec refers to an unknown generator, two figures have the same name or a series selects a
+            legend title which the post analysis does not write (see `check_selects`)
+        """
+        self.spec = spec
+        self.files = OrderedDict((gen['name'], gen['file']) for gen in spec['generators'])
+        self.titles = dict((gen['name'], gen.get('title', gen['name'])) for gen in spec['generators'])
+        self.defaults = spec.get('defaults', {})
+        self.figures = OrderedDict()
+        for fig_spec in spec['figures']:
+            if fig_spec['name'] in self.figures:
+                raise ValueError("Figure '{}' is defined twice".format(fig_spec['name']))
+            for series in fig_spec['series']:
+                for gen in series.get('generators', []):
+                    if gen not in self.files:
+                        raise ValueError("Unknown generator '{}' in figure '{}'".format(gen, fig_spec['name']))
+            self.figures[fig_spec['name']] = fig_spec
+        self.check_selects()
+
+    def check_selects(self, percentile_bins=percentile_bins, est_names=considered_ests):
+        """
+        Check the legend titles selected by each series against those written by the plot steps (see
+        `post_plotting.figure_labels`), so that a typo fails when the spec is loaded and not in the middle of
+        rendering. Objects whose labels are not known and index selectors are not checked.
+
+        Raises
+        ------
+        ValueError :
+            A selected legend title is not written for the object of the series
+        """
+        for name, fig_spec in self.figures.items():
+            for series in fig_spec['series']:
+                select = series.get('select')
+                if select is None:
+                    continue
+                labels = figure_labels(series['object'], series.get('estimator'), percentile_bins, est_names)
+                if labels is None:
+                    continue
+                for sel in (select if isinstance(select, list) else [select]):
+                    if not isinstance(sel, int) and sel not in labels:
+                        raise ValueError("Figure '{}' selects '{}' from {}, which has only {}"
+                                         .format(name, sel, series['object'], ", ".join(sorted(labels))))
+
+    @classmethod
+    def from_file(cls, fname):
+        return cls(load_spec(fname))
+
+    def series_generators(self, series):
+        return series.get('generators', self.files.keys())
+
+    def series_key(self, series, gen):
+        """Key of the canvas of `series` for the given generator; see `GeneratorComparison.plottables`"""
+        return (gen, series.get('trigger', ''), series.get('estimator'), series['object'])
+
+    def requirements(self, name):
+        """Keys of the canvases needed by the figure `name`, in the order they are used"""
+        keys = []
+        for series in self.figures[name]['series']:
+            for gen in self.series_generators(series):
+                key = self.series_key(series, gen)
+                if key not in keys:
+                    keys.append(key)
+        return keys
+
+    def select_figures(self, names=None):
+        """
+        The given figure names in the order of the spec, or all figures if `names` is None
+
+        Raises
+        ------
+        ValueError :
+            One of the names is not in the spec
+        """
+        if names is None:
+            return self.figures.keys()
+        unknown = [name for name in names if name not in self.figures]
+        if unknown:
+            raise ValueError("Unknown figures: {}".format(", ".join(unknown)))
+        return [name for name in self.figures if name in names]
+
+    def dependency_graph(self, names):
+        """
+        Returns
+        -------
+        OrderedDict :
+            Figures which need each canvas, ordered by generator so that the files are read one after
+            another
+        """
+        graph = OrderedDict()
+        for name in names:
+            for key in self.requirements(name):
+                graph.setdefault(key, []).append(name)
+        gen_order = self.files.keys()
+        return OrderedDict(sorted(graph.items(), key=lambda item: gen_order.index(item[0][0])))
+
+    def independent_groups(self, names):
+        """
+        Split the figures into groups which do not share any canvas, so that each canvas is read by only
+        one of them
+        """
+        group_of = dict((name, name) for name in names)
+
+        def find(name):
+            while group_of[name] != name:
+                name = group_of[name]
+            return name
+
+        for figs in self.dependency_graph(names).values():
+            root = find(figs[0])
+            for name in figs[1:]:
+                group_of[find(name)] = root
+        groups = OrderedDict()
+        for name in names:
+            groups.setdefault(find(name), []).append(name)
+        return groups.values()
+
+    def _plottables_of_series(self, series, fetched):
+        for gen in self.series_generators(series):
+            plottables = fetched[self.series_key(series, gen)]
+            select = series.get('select')
+            if select is None:
+                selected = plottables
+            else:
+                selected = [self._select(plottables, sel, gen, series) for sel in
+                            (select if isinstance(select, list) else [select])]
+            for plottable in selected:
+                yield gen, dict(plottable)
+
+    @staticmethod
+    def _select(plottables, sel, gen, series):
+        if isinstance(sel, int):
+            return plottables[sel]
+        for plottable in plottables:
+            if plottable['legend_title'] == sel:
+                return plottable
+        raise ValueError("No plottable '{}' in {} of {}".format(sel, series['object'], gen))
+
+    def build_figure(self, name, fetched):
+        """
+        Parameters
+        ----------
+        name : str
+            Name of the figure
+        fetched : dict
+            Plottables of each canvas key of `requirements(name)`
+
+        Returns
+        -------
+        Figure
+        """
+        fig_spec = self.figures[name]
+        fig = Figure()
+        for section in ('plot', 'legend'):
+            props = dict(self.defaults.get(section, {}))
+            props.update(fig_spec.get(section, {}))
+            for attr, value in props.items():
+                setattr(getattr(fig, section), attr, value)
+        for attr in ('xtitle', 'ytitle'):
+            value = fig_spec.get(attr, self.defaults.get(attr))
+            if value is not None:
+                setattr(fig, attr, value)
+        for series in fig_spec['series']:
+            style = dict((k, v) for k, v in series.items() if k not in series_keys)
+            style['legend_title'] = series.get('legend_title', "{legend_title}")
+            for n, (gen, plottable) in enumerate(self._plottables_of_series(series, fetched)):
+                item_style = dict(style)
+                item_style.update((k, v[n % len(v)]) for k, v in series.get('each', {}).items())
+                # json turns rgb tuples into lists
+                item_style = dict((k, tuple(v) if isinstance(v, list) else v) for k, v in item_style.items())
+                legend_title = item_style.pop('legend_title').format(generator=gen, title=self.titles[gen],
+                                                   legend_title=plottable['legend_title'])
+                if series.get('keep_style', False):
+                    plottable.update(item_style)
+                    plottable['legend_title'] = legend_title
+                    fig._plottables.append(plottable)
+                else:
+                    fig.add_plottable(plottable['p'], legend_title=legend_title, **item_style)
+        return fig
+
+
+def fetch(spec, comparison, names):
+    """Plottables of all canvases needed by the given figures; each canvas is read once"""
+    return dict((key, comparison.plottables(*key)) for key in spec.dependency_graph(names))
+
+
+def render(spec, names, comparison, root_file=None, pdf_dir=None):
+    """
+    Build the given figures in this process and write them to the (open) root file and/or as pdfs to
+    `pdf_dir`
+    """
+    fetched = fetch(spec, comparison, names)
+    for name in names:
+        fig = spec.build_figure(name, fetched)
+        if root_file is not None:
+            fig.save_to_root_file(root_file, name)
+        if pdf_dir is not None:
+            fig.save_to_file(pdf_dir, name + ".pdf")
+        log.info("Rendered {}".format(name))
+
+
+def _render_worker(args):
+    spec_dict, names, pdf_dir = args
+    ROOT.gROOT.SetBatch(True)
+    spec = ComparisonSpec(spec_dict)
+    comparison = GeneratorComparison(spec.files)
+    try:
+        render(spec, names, comparison, pdf_dir=pdf_dir)
+    finally:
+        comparison.pool.close()
+    return names
+
+
+def render_parallel(spec, names, pdf_dir, jobs):
+    """
+    Render the given figures as pdfs in `jobs` processes. The figures are split into groups which do not
+    share any canvas (see `ComparisonSpec.independent_groups`), so that each canvas is still read only once.
+    """
+    groups = sorted(spec.independent_groups(names),
+                    key=lambda group: -len(spec.dependency_graph(group)))
+    # distribute the groups, the largest first, to the process with the fewest canvases to read
+    batches = [[] for _ in range(min(jobs, len(groups)))]
+    loads = [0] * len(batches)
+    for group in groups:
+        i = loads.index(min(loads))
+        batches[i] += group
+        loads[i] += len(spec.dependency_graph(group))
+    pool = Pool(len(batches))
+    try:
+        for done in pool.imap_unordered(_render_worker, [(spec.spec, batch, pdf_dir) for batch in batches]):
+            log.info("Rendered {}".format(", ".join(done)))
+    finally:
+        pool.close()
+        pool.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render generator comparison figures from a spec file")
+    parser.add_argument("spec", help="Spec file (json, or yaml if PyYAML is installed)")
+    parser.add_argument("--figure", nargs="+", metavar="NAME", help="Only render these figures")
+    parser.add_argument("--root-file", help="Root file to which the figures are written (recreated)")
+    parser.add_argument("--pdf-dir", help="Directory to which each figure is saved as pdf")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of processes rendering pdfs")
+    parser.add_argument("--list", action="store_true", help="List the figures and the canvases they need")
+    args = parser.parse_args()
+
+    spec = ComparisonSpec.from_file(args.spec)
+    names = spec.select_figures(args.figure)
+    if args.list:
+        for name in names:
+            log.info(name)
+            for key in spec.requirements(name):
+                log.info("    {} {} {} {}".format(*key))
+        raise SystemExit(0)
+    root_file_name = args.root_file or spec.spec.get('root_file')
+    pdf_dir = args.pdf_dir or spec.spec.get('pdf_dir')
+    if root_file_name is None and pdf_dir is None:
+        parser.error("No output given; use --root-file and/or --pdf-dir")
+    if args.jobs > 1 and root_file_name is not None:
+        parser.error("Parallel jobs can only write pdfs; use --pdf-dir without --root-file")
+
+    ROOT.gROOT.SetBatch(True)
+    if args.jobs > 1:
+        render_parallel(spec, names, pdf_dir, args.jobs)
+    else:
+        comparison = GeneratorComparison(spec.files)
+        root_file = root_open(root_file_name, 'recreate') if root_file_name is not None else None
+        try:
+            render(spec, names, comparison, root_file=root_file, pdf_dir=pdf_dir)
+        finally:
+            if root_file is not None:
+                root_file.Close()
+            comparison.pool.close()
+        comparison.report()
@@ -0,0 +1,271 @@
+"""
+Correlations of the multiplicities of all estimators from their event tuples (`fEventTuple`). The tuples are
+read once, chunk by chunk, and all pairwise correlation histograms are filled from each chunk with numpy. The
+chunks can be split across several processes.
+
+By default, each estimator gets one bin per unit of its value, with a range that grows with the values seen
+in the tuple (ie. adaptive binning of multiplicities). Estimators whose values are not counts (eg. spherocity)
+need a fixed binning.
+"""
+
+from collections import OrderedDict
+from multiprocessing import Pool
+
+import numpy as np
+
+from rootpy.io import root_open
+from rootpy.plotting import Hist2D
+
+from post_sums import LazySums, load_sums
+from post_temporaries import adopt, temp_name
+from post_utils import set_bin_contents
+
+default_chunk_size = 1000000
+
+
+class Binning(object):
+    """
+    Binning of the values of one estimator. Bin 0 and nbins + 1 are the under- and overflow bins.
+    """
+    def __init__(self, nbins=None, low=None, high=None):
+        """
+        Parameters
+        ----------
+        nbins, low, high :
+            Fixed binning; if not given, the binning is adaptive with one bin per unit
+        """
+        self.adaptive = nbins is None
+        self.nbins = nbins if nbins is not None else 0
+        self.low = low
+        self.high = high
+
+    @property
+    def size(self):
+        return self.nbins + 2
+
+    def extend(self, values):
+        """
+        Extend an adaptive binning so that it covers the given values.
+
+        Returns
+        -------
+        tuple :
+            Number of bins added before and after the current ones
+        """
+        if not self.adaptive or len(values) == 0:
+            return 0, 0
+        vmin, vmax = int(np.floor(values.min())), int(np.floor(values.max()))
+        if self.low is None:
+            self.low, self.nbins = vmin, vmax - vmin + 1
+            return 0, self.nbins
+        before = max(0, self.low - vmin)
+        after = max(0, vmax - (self.low + self.nbins - 1))
+        self.low -= before
+        self.nbins += before + after
+        return before, after
+
+    def indices(self, values):
+        """Bin numbers of the given values"""
+        if self.adaptive:
+            return np.floor(values).astype(np.int64) - self.low + 1
+        width = (self.high - self.low) / float(self.nbins)
+        idx = np.floor((values - self.low) / width).astype(np.int64) + 1
+        return np.clip(idx, 0, self.nbins + 1)
+
+    def axis(self):
+        """(nbins, low, high) of the histogram axis"""
+        if self.adaptive:
+            if self.low is None:
+                return 1, 0, 1
+            return self.nbins, self.low, self.low + self.nbins
+        return self.nbins, self.low, self.high
+
+
+class CorrelationAccumulator(object):
+    """
+    Weighted counts of the events for each pair of estimators, filled chunk by chunk. For each unordered pair
+    only one matrix is stored; the reversed pair is its transposed.
+    """
+    def __init__(self, est_names, binnings=None):
+        """
+        Parameters
+        ----------
+        est_names : list
+            Names of the estimators
+        binnings : dict
+            Fixed `Binning` of some estimators; all others are adaptive
+        """
+        binnings = binnings or {}
+        self.est_names = list(est_names)
+        self.binnings = OrderedDict((est, binnings.get(est, Binning())) for est in self.est_names)
+        self.pairs = [(x, y) for i, x in enumerate(self.est_names) for y in self.est_names[i:]]
+        self.counts = dict((pair, self._zeros(*pair)) for pair in self.pairs)
+        # sum of the squared weights; only kept separately once a weight != 1 was seen
+        self.sumw2 = None
+        self.nevents = 0
+
+    def _zeros(self, x, y):
+        return np.zeros((self.binnings[x].size, self.binnings[y].size))
+
+    def _pad(self, est, before, after):
+        if before == 0 and after == 0:
+            return
+        arrays = [self.counts] + ([self.sumw2] if self.sumw2 is not None else [])
+        for (x, y) in self.pairs:
+            # the flow bins stay in place; new bins are inserted next to them
+            for axis, name in enumerate((x, y)):
+                if name != est:
+                    continue
+                for a in arrays:
+                    m = a[(x, y)]
+                    inner = np.take(m, np.arange(1, m.shape[axis] - 1), axis=axis)
+                    pad_width = [(0, 0), (0, 0)]
+                    pad_width[axis] = (before + 1, after + 1)
+                    a[(x, y)] = np.pad(inner, pad_width, mode='constant')
+
+    def fill(self, values, weights):
+        """
+        Fill the events of one chunk
+
+        Parameters
+        ----------
+        values : dict
+            Array of the values of each estimator; all of the same length
+        weights : np.ndarray
+            Weight of each event
+        """
+        for est in self.est_names:
+            self._pad(est, *self.binnings[est].extend(values[est]))
+        if self.sumw2 is None and np.any(weights != 1):
+            self.sumw2 = dict((pair, counts.copy()) for pair, counts in self.counts.items())
+        indices = dict((est, self.binnings[est].indices(values[est])) for est in self.est_names)
+        for (x, y) in self.pairs:
+            ny = self.binnings[y].size
+            flat = indices[x] * ny + indices[y]
+            shape = self.counts[(x, y)].shape
+            self.counts[(x, y)] += np.bincount(flat, weights=weights, minlength=shape[0] * ny).reshape(shape)
+            if self.sumw2 is not None:
+                self.sumw2[(x, y)] += np.bincount(flat, weights=weights ** 2,
+                                                  minlength=shape[0] * ny).reshape(shape)
+        self.nevents += len(weights)
+
+    def merge(self, other):
+        """Add the counts of another accumulator of the same estimators (eg. from another process)"""
+        if other.nevents == 0:
+            # eg. a process without entries; its adaptive binnings are empty and its matrices only flow bins
+            return
+        for est in self.est_names:
+            mine, theirs = self.binnings[est], other.binnings[est]
+            if not mine.adaptive:
+                continue
+            edges = np.array([theirs.low, theirs.low + theirs.nbins - 1], dtype=np.float64)
+            self._pad(est, *mine.extend(edges))
+            other._pad(est, *theirs.extend(np.array([mine.low, mine.low + mine.nbins - 1], dtype=np.float64)))
+        if other.sumw2 is not None and self.sumw2 is None:
+            self.sumw2 = dict((pair, counts.copy()) for pair, counts in self.counts.items())
+        for pair in self.pairs:
+            self.counts[pair] += other.counts[pair]
+            if self.sumw2 is not None:
+                self.sumw2[pair] += other.sumw2[pair] if other.sumw2 is not None else other.counts[pair]
+        self.nevents += other.nevents
+
+    def hist(self, x_est, y_est, name=None, title=""):
+        """
+        Returns
+        -------
+        Hist2D :
+            Correlation of x_est (x-axis) and y_est (y-axis)
+        """
+        if (x_est, y_est) in self.counts:
+            counts = self.counts[(x_est, y_est)]
+            sumw2 = self.sumw2[(x_est, y_est)] if self.sumw2 is not None else None
+        else:
+            counts = self.counts[(y_est, x_est)].T
+            sumw2 = self.sumw2[(y_est, x_est)].T if self.sumw2 is not None else None
+        xaxis, yaxis = self.binnings[x_est].axis(), self.binnings[y_est].axis()
+        h = adopt(Hist2D(*(xaxis + yaxis), name=name if name is not None else temp_name(), title=title))
+        if self.binnings[x_est].low is not None and self.binnings[y_est].low is not None:
+            set_bin_contents(h, counts, sumw2)
+        return h
+
+
+def read_chunk(tree, var, first, nentries):
+    """Values of the expression `var` of the entries [first, first + nentries) of the tree as an array"""
+    tree.SetEstimate(nentries + 1)
+    n = tree.Draw(var, "", "goff", nentries, first)
+    if n <= 0:
+        return np.zeros(0)
+    buf = tree.GetV1()
+    buf.SetSize(n)
+    return np.frombuffer(buf, dtype=np.float64, count=n).copy()
+
+
+def fill_correlations(trees, binnings=None, chunk_size=default_chunk_size, entry_range=None):
+    """
+    Fill the correlations of all given event tuples in one pass over them.
+
+    Parameters
+    ----------
+    trees : OrderedDict
+        Event tuple (with the `nch` and `ev_weight` branches) of each estimator. The tuples need to have
+        the same entries; the weights are taken from the first one
+    binnings : dict
+        See `CorrelationAccumulator`
+    chunk_size : int
+        Number of entries read at once
+    entry_range : tuple
+        First entry and number of entries to read; all by default
+
+    Returns
+    -------
+    CorrelationAccumulator
+    """
+    acc = CorrelationAccumulator(trees.keys(), binnings)
+    first_tree = trees.values()[0]
+    first, nentries = entry_range if entry_range is not None else (0, first_tree.GetEntries())
+    for chunk_first in xrange(first, first + nentries, chunk_size):
+        chunk_n = min(chunk_size, first + nentries - chunk_first)
+        weights = read_chunk(first_tree, "ev_weight", chunk_first, chunk_n)
+        values = dict((est, read_chunk(tree, "nch", chunk_first, chunk_n)) for est, tree in trees.items())
+        acc.fill(values, weights)
+    return acc
+
+
+def _fill_correlations_worker(args):
+    f_name, sums_dir_name, est_names, binnings, chunk_size, entry_range, lazy_sums = args
+    with root_open(f_name, 'read') as f:
+        sums = load_sums(f, sums_dir_name, lazy=lazy_sums)
+        try:
+            trees = OrderedDict((est, sums.FindObject(est).FindObject("fEventTuple")) for est in est_names)
+            return fill_correlations(trees, binnings, chunk_size, entry_range)
+        finally:
+            if isinstance(sums, LazySums):
+                # closes the cache file; the pool processes are reused for the next ranges
+                sums.Delete()
+
+
+def fill_correlations_parallel(f_name, sums_dir_name, est_names, jobs, binnings=None,
+                               chunk_size=default_chunk_size, lazy_sums=False):
+    """
+    Same as `fill_correlations`, but the entries are split across `jobs` processes. Each process opens the
+    file and reads the Sums itself; only the used parts if `lazy_sums` (see `post_sums`).
+    """
+    with root_open(f_name, 'read') as f:
+        sums = load_sums(f, sums_dir_name, lazy=lazy_sums)
+        nentries = sums.FindObject(est_names[0]).FindObject("fEventTuple").GetEntries()
+        if isinstance(sums, LazySums):
+            sums.Delete()
+    # a few more ranges than processes to balance the load
+    boundaries = np.linspace(0, nentries, 2 * jobs + 1).astype(np.int64)
+    args = [(f_name, sums_dir_name, est_names, binnings, chunk_size, (int(lo), int(hi - lo)), lazy_sums)
+            for lo, hi in zip(boundaries[:-1], boundaries[1:]) if hi > lo]
+    pool = Pool(jobs)
+    try:
+        accs = pool.map(_fill_correlations_worker, args)
+    finally:
+        pool.close()
+        pool.join()
+    acc = CorrelationAccumulator(est_names, binnings)
+    for other in accs:
+        acc.merge(other)
+    return acc
@@ -3,17 +3,19 @@ This file provides functions to extract data from the "Sums" histogram. The func
 plottables.
 """
 
+import numpy as np
+
 from rootpy import asrootpy
 
+from post_arrays import hist_to_array
 from post_utils import \
-    gen_random_name,\
+    get_bin_contents,\
     get_est_dirs,\
     make_estimator_title,\
-    remap_x_values,\
-    remove_zero_value_points,\
-    remove_points_with_equal_x,\
-    remove_points_with_x_err_gt_1NchRef,\
-    remove_non_mutual_points
+    remap_x_values_with_profile,\
+    sanitize_graphs
+from post_sums import LazySums
+from post_temporaries import adopt, temp_name
 
 import ROOT
 
@@ -26,9 +28,10 @@ def get_meanpt_vs_estmult(resutlts_est_dir, pids):
     mult_vs_pts = []
     for pid in pids:
         mult_vs_pts.append(asrootpy(getattr(resutlts_est_dir.mult_pt, pid)))
-    profx = sum(mult_vs_pts).ProfileX()
-    profx.name = gen_random_name()
-    return profx
+    summed = adopt(mult_vs_pts[0].Clone(temp_name()))
+    for h in mult_vs_pts[1:]:
+        summed.Add(h)
+    return adopt(asrootpy(summed.ProfileX(temp_name())))
 
 
 def get_dNdeta_in_classifier_bin_interval(sums_classifier_dir, event_counter, classifier_bin_interval):
@@ -51,7 +54,7 @@ def get_dNdeta_in_classifier_bin_interval(sums_classifier_dir, event_counter, cl
     if not h2d:
         raise ValueError("Could not find histogram {}".format(hist_name))
     h2d.yaxis.set_range(classifier_bin_interval[0], classifier_bin_interval[1])
-    h = asrootpy(h2d.projection_x(gen_random_name()))
+    h = adopt(asrootpy(h2d.projection_x(temp_name())))
     h.title = "{} - {} %".format(100 * classifier_bin_interval[0], 100 * classifier_bin_interval[1])
     # scale by the number of events in this mult_interval and bin width
     try:
@@ -64,15 +67,19 @@ def get_dNdeta_in_classifier_bin_interval(sums_classifier_dir, event_counter, cl
     return h
 
 
-def get_identified_vs_mult(h3d, pdg):
+def get_identified_vs_mult(h3d, pdg, projections=None, est_name=None):
     """
     Return 1D counter histogram of identified particles vs N_ch^est
     Parameters
     ----------
-    h3d: Hist3D
-         x: est_mult; y: pT; z: pids1
+    h3d: Hist3D or SharedHist3D
+         x: est_mult; y: pT; z: pids1. A SharedHist3D (see `post_shared`) can only be used with `projections`
     pdg: str
          pdg code as string
+    projections: ProjectionCache
+         If given, the projection is served from this cache. The returned histogram must not be modified then!
+    est_name: str
+         Name of the estimator of h3d; Needed if `projections` is given
     Return
     ------
     Hist1D:
@@ -81,11 +88,12 @@ def get_identified_vs_mult(h3d, pdg):
     pid_bin = h3d.zaxis.find_bin(pdg)
     if pid_bin == 0:
         raise ValueError("given pdg ({}) does not exist in histogram".format(pdg))
+    if projections is not None:
+        return projections.get(est_name, h3d, "x", (pid_bin, pid_bin))
 
     h3d.zaxis.SetRange(pid_bin, pid_bin)
-    h = asrootpy(h3d.Project3D("yx").ProjectionX())
-    h.SetName(gen_random_name())
-    return h
+    h2d = adopt(asrootpy(h3d.Project3D("yx")), temp_name())
+    return adopt(asrootpy(h2d.ProjectionX(temp_name())))
 
 
 def get_correlation_histogram(sums, classifier1, classifier2):
@@ -111,7 +119,7 @@ def get_correlation_histogram(sums, classifier1, classifier2):
         If either of the classifiers was not found
 
     """
-    if not isinstance(sums, ROOT.TList):
+    if not isinstance(sums, (ROOT.TList, LazySums)):
         raise TypeError("{} is not of type ROOT.TList".format(sums))
     naming_pattern = "corr_this_with_{}"
     try:
@@ -124,7 +132,7 @@ def get_correlation_histogram(sums, classifier1, classifier2):
     return corr_hist
 
 
-def get_PNch_vs_estmult(sums, est):
+def get_PNch_vs_estmult(sums, est, correlations=None):
     """
     Parameters
     ----------
@@ -132,17 +140,22 @@ def get_PNch_vs_estmult(sums, est):
            Sums directory
     est : str
           Estimator name
+    correlations : CorrelationStore
+          Store of the correlation histograms; the projection is then only computed once per run
     Returns
     -------
     Hist1D :
             Counter Histogram for Number of events with Nch in the estimator region
     """
-    if not isinstance(sums, ROOT.TList):
+    if not isinstance(sums, (ROOT.TList, LazySums)):
         raise TypeError("{} is not of type ROOT.TList".format(sums))
     # nasty hardcoded:
     ref_est = "EtaLt05"
+    if correlations is not None:
+        # the stored projection is shared, so return a copy
+        return adopt(asrootpy(correlations.projection_x(sums, est, ref_est).Clone(temp_name())))
     corr_hist = get_correlation_histogram(sums, est, ref_est)
-    return asrootpy(corr_hist.ProjectionX(gen_random_name()))
+    return adopt(asrootpy(corr_hist.ProjectionX(temp_name())))
 
 
 def get_pT_distribution(results_est_dir, pids, classifier_bin_interval, normalized=False):
@@ -166,10 +179,11 @@ def get_pT_distribution(results_est_dir, pids, classifier_bin_interval, normaliz
     mult_pt_hists = []
     for pid in pids:
         mult_pt_hists.append(getattr(results_est_dir.mult_pt, pid))
-    summed_mult_pt = sum(mult_pt_hists)
+    summed_mult_pt = adopt(asrootpy(mult_pt_hists[0].Clone(temp_name())))
+    for h in mult_pt_hists[1:]:
+        summed_mult_pt.Add(h)
     summed_mult_pt.xaxis.SetRange(*classifier_bin_interval)
-    projy = asrootpy(summed_mult_pt.ProjectionY())
-    projy.name = gen_random_name()
+    projy = adopt(asrootpy(summed_mult_pt.ProjectionY(temp_name())))
     event_counter = asrootpy(results_est_dir.event_counter)
     # Scale by the number of events in the interval;
     projy.Scale(1.0 / event_counter.Integral(*classifier_bin_interval))
@@ -178,6 +192,50 @@ def get_pT_distribution(results_est_dir, pids, classifier_bin_interval, normaliz
     return projy
 
 
+def get_pT_distribution_table(results_est_dir, species, classifier_bin_intervals):
+    """
+    Compute the p_T distributions of several species in several classifier bin intervals in one pass. Each
+    `mult_pt` histogram is read only once and all intervals are taken from its cumulative sum over the
+    classifier axis. Each entry is the same as `get_pT_distribution` for that species and interval.
+
+    Parameters
+    ----------
+    results_est_dir : TDirectory
+        Directory of a given estimator
+    species : list
+        List of lists of strings denoting the pids which make up each species
+    classifier_bin_intervals : list
+        List of (lower, upper) classifier bin indices
+
+    Returns
+    -------
+    tuple :
+        (contents, sumw2, edges). contents and sumw2 (squared errors) have the shape
+        (species, interval, p_T bins incl. under- and overflow); edges are the p_T bin edges
+    """
+    firsts = np.array([interval[0] for interval in classifier_bin_intervals])
+    lasts = np.array([interval[1] for interval in classifier_bin_intervals])
+
+    def sum_intervals(a):
+        # sums over the classifier bins (first axis) of each interval
+        cumsum = np.concatenate([np.zeros((1,) + a.shape[1:]), a.cumsum(axis=0)])
+        return cumsum[lasts + 1] - cumsum[firsts]
+
+    nevents = sum_intervals(get_bin_contents(asrootpy(results_est_dir.event_counter)))
+    pid_arrays = {}
+    contents, sumw2 = [], []
+    for pids in species:
+        for pid in pids:
+            if pid not in pid_arrays:
+                pid_arrays[pid] = hist_to_array(getattr(results_est_dir.mult_pt, pid))
+        contents.append(sum_intervals(sum(pid_arrays[pid].contents for pid in pids)))
+        sumw2.append(sum_intervals(sum(pid_arrays[pid].sumw2 for pid in pids)))
+    # Scale by the number of events in the interval;
+    nevents = nevents[np.newaxis, :, np.newaxis]
+    edges = pid_arrays[species[0][0]].edges[1]
+    return np.array(contents) / nevents, np.array(sumw2) / nevents ** 2, edges
+
+
 def get_mean_nMPI(sums_est_dir, classifier_bin_interval):
     """
     Get the mean nMPI of events in a given N_ch interval
@@ -205,21 +263,19 @@ def get_graphs_particle_ratios_vs_refmult(plottingcls, pids1, pids2, scale=None,
     ratios = []
     ref_classifier = 'EtaLt05'
     for est_dir in get_est_dirs(plottingcls.sums, plottingcls.considered_ests):
-        h3d = asrootpy(est_dir.FindObject("classifier_pT_PID_{}".format(est_dir.GetName())))
-        corr_hist = get_correlation_histogram(plottingcls.sums, est_dir.GetName(), ref_classifier)
-        pids1_vs_estmult = sum([get_identified_vs_mult(h3d, pdg) for pdg in pids1])
-        pids2_vs_estmult = sum([get_identified_vs_mult(h3d, pdg) for pdg in pids2])
+        h3d = plottingcls.pid_hist(est_dir)
+        profx = plottingcls.correlations.profile_x(plottingcls.sums, est_dir.GetName(), ref_classifier)
+        pids1_vs_estmult = sum([get_identified_vs_mult(h3d, pdg, plottingcls.projections, est_dir.GetName())
+                                for pdg in pids1])
+        pids2_vs_estmult = sum([get_identified_vs_mult(h3d, pdg, plottingcls.projections, est_dir.GetName())
+                                for pdg in pids2])
 
         # remap histograms using the correlation between the current estimator and the reference one
-        pids1_vs_refmult = remap_x_values(pids1_vs_estmult, corr_hist)
-        pids2_vs_refmult = remap_x_values(pids2_vs_estmult, corr_hist)
+        pids1_vs_refmult, pids2_vs_refmult = remap_x_values_with_profile([pids1_vs_estmult, pids2_vs_estmult],
+                                                                         profx)
 
         # sanitize
-        for g in [pids1_vs_refmult, pids2_vs_refmult]:
-            remove_zero_value_points(g)
-            remove_points_with_x_err_gt_1NchRef(g)
-            remove_points_with_equal_x(g)
-        remove_non_mutual_points(pids1_vs_refmult, pids2_vs_refmult)
+        pids1_vs_refmult, pids2_vs_refmult = sanitize_graphs([pids1_vs_refmult, pids2_vs_refmult], mutual=True)
 
         try:
             ratio = pids1_vs_refmult / pids2_vs_refmult
@@ -0,0 +1,233 @@
+"""
+Export of the post analysis results of several generators into one columnar Parquet file, so that they can be
+studied without PyROOT. All objects of the results stores (see `post_store`) are written as one row per bin
+with the columns
+
+    generator, trigger, estimator, observable, label, bin, x, value, error
+
+where label is eg. the percentile bin ("0.0%-0.1%") and x the bin center (or the x value of a graph point).
+Empty strings stand for no trigger and no estimator. Each row group holds the rows of a single generator and
+trigger (large ones are split into several groups), sorted by observable and estimator, so that the min/max
+statistics of the row groups allow reading only the needed parts (predicate pushdown). The file is read
+memory-mapped by `read_results`.
+
+Needs pyarrow, which is optional for the rest of the post analysis.
+
+Example:
+
+    $ python ./post_export.py results.parquet --spec comparison_specs/presentation_plots.json
+"""
+
+import argparse
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+from rootpy import log, ROOT
+
+from post_comparison import GeneratorComparison
+from post_comparison_spec import ComparisonSpec
+from post_utils import get_bin_values_and_errors, graph_to_arrays
+
+log = log["/export"]
+
+columns = ['generator', 'trigger', 'estimator', 'observable', 'label', 'bin', 'x', 'value', 'error']
+# number of rows after which the collected objects are written as one row group
+default_row_group_size = 100000
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("pyarrow is needed for the Parquet export; install it with `pip install pyarrow`")
+
+
+def object_to_arrays(obj):
+    """
+    Bin numbers, x values, values and errors of a 1D histogram, profile or graph. The errors of graphs are the
+    mean of the lower and upper errors. Returns None for other objects.
+    """
+    if obj.InheritsFrom("TH1") and obj.GetDimension() == 1:
+        values, errors = get_bin_values_and_errors(obj)
+        nbins = obj.GetNbinsX()
+        xaxis = obj.GetXaxis()
+        x = np.array([xaxis.GetBinCenter(i) for i in xrange(1, nbins + 1)])
+        # visible bins only
+        return np.arange(1, nbins + 1), x, values[1:nbins + 1], errors[1:nbins + 1]
+    if obj.InheritsFrom("TGraph"):
+        x, y, errors = graph_points(obj)
+        return np.arange(len(x)), x, y, errors
+    return None
+
+
+def graph_points(g):
+    """x values, y values and y errors of the points of any TGraph"""
+    if g.InheritsFrom("TGraphAsymmErrors"):
+        x, y, _, _, eyl, eyh = graph_to_arrays(g)
+        return x, y, 0.5 * (eyl + eyh)
+    npoints = g.GetN()
+    arrays = []
+    for buf in (g.GetX(), g.GetY()):
+        if npoints == 0:
+            arrays.append(np.zeros(0))
+            continue
+        buf.SetSize(npoints)
+        arrays.append(np.frombuffer(buf, dtype=np.float64, count=npoints).copy())
+    # 0 for graphs without errors
+    errors = np.array([g.GetErrorY(i) for i in xrange(npoints)], dtype=np.float64)
+    return arrays[0], arrays[1], errors
+
+
+def available_triggers(comparison, generator):
+    """Triggers of the results dirs in the file of the generator; '' for the one without trigger"""
+    f = comparison.pool.get(comparison.files[generator])
+    prefix = comparison.results_dir_name
+    return [key.GetName()[len(prefix):] for key in f.MultEstimators.GetListOfKeys()
+            if key.GetName().startswith(prefix)]
+
+
+def collect_results(comparison, triggers=None):
+    """
+    Yield the rows of each stored object as a dict of columns
+
+    Parameters
+    ----------
+    comparison : GeneratorComparison
+    triggers : list
+        Triggers to export; all of each file by default
+    """
+    for gen in comparison.generators:
+        for trigger in (triggers if triggers is not None else available_triggers(comparison, gen)):
+            store = comparison.store(gen, trigger)
+            if len(store) == 0:
+                log.warning("No results store for {} {}; run the post analysis again".format(gen, trigger))
+                continue
+            entries = sorted(store.entries.values(), key=lambda e: (e['observable'], e['estimator'] or ''))
+            for entry in entries:
+                obj = comparison.result(gen, trigger, entry['observable'], entry['estimator'], entry['label'])
+                arrays = object_to_arrays(obj)
+                if arrays is None:
+                    log.debug("Skipping {} ({})".format(entry['name'], obj.ClassName()))
+                    continue
+                bins, x, values, errors = arrays
+                n = len(bins)
+                yield OrderedDict([
+                    ('generator', [gen] * n),
+                    ('trigger', [trigger] * n),
+                    ('estimator', [entry['estimator'] or ''] * n),
+                    ('observable', [entry['observable']] * n),
+                    ('label', [entry['label']] * n),
+                    ('bin', bins.astype(np.int32)),
+                    ('x', x.astype(np.float64)),
+                    ('value', values.astype(np.float64)),
+                    ('error', errors.astype(np.float64)),
+                ])
+
+
+def _table(chunks):
+    merged = OrderedDict((col, []) for col in columns)
+    for chunk in chunks:
+        for col in columns:
+            merged[col].append(chunk[col])
+    arrays = []
+    for col in columns:
+        if col in ('bin', 'x', 'value', 'error'):
+            arrays.append(pa.array(np.concatenate(merged[col])))
+        else:
+            arrays.append(pa.array([v for part in merged[col] for v in part]).dictionary_encode())
+    return pa.Table.from_arrays(arrays, names=columns)
+
+
+def export_parquet(comparison, fname, triggers=None, row_group_size=default_row_group_size):
+    """
+    Write the results of all generators of `comparison` to the Parquet file `fname`
+
+    Returns
+    -------
+    int :
+        Number of written rows
+    """
+    _require_pyarrow()
+    writer = None
+    nrows = 0
+    pending, pending_rows, pending_group = [], 0, None
+    try:
+        for chunk in collect_results(comparison, triggers):
+            group = (chunk['generator'][0], chunk['trigger'][0])
+            # a row group never spans several generators or triggers
+            if pending and (group != pending_group or pending_rows >= row_group_size):
+                writer = _write_row_group(writer, fname, pending)
+                nrows += pending_rows
+                pending, pending_rows = [], 0
+            pending.append(chunk)
+            pending_rows += len(chunk['bin'])
+            pending_group = group
+        if pending:
+            writer = _write_row_group(writer, fname, pending)
+            nrows += pending_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return nrows
+
+
+def _write_row_group(writer, fname, chunks):
+    """Write the chunks as one row group; the writer is created with the first one"""
+    table = _table(chunks)
+    if writer is None:
+        writer = pq.ParquetWriter(fname, table.schema)
+    writer.write_table(table)
+    return writer
+
+
+def read_results(fname, filters=None, columns=None):
+    """
+    Read an exported file memory-mapped. Only the row groups which can match `filters` are read.
+
+    Parameters
+    ----------
+    filters : list
+        pyarrow filters, eg. [('generator', '=', 'Dipsy'), ('observable', '=', 'dNdeta_summary')]
+    columns : list
+        Columns to read; all by default
+
+    Returns
+    -------
+    pyarrow.Table
+    """
+    _require_pyarrow()
+    return pq.read_table(fname, columns=columns, filters=filters, memory_map=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the post analysis results of several generators "
+                                                 "to a Parquet file")
+    parser.add_argument("output", help="Parquet file (recreated)")
+    parser.add_argument("--spec", help="Take the generators and their files from this comparison spec")
+    parser.add_argument("--file", nargs="+", default=[], metavar="NAME=PATH",
+                        help="Generator name and AnalysisResults.root file")
+    parser.add_argument("--triggers", nargs="+", help="Only export these triggers; use '' for no trigger")
+    args = parser.parse_args()
+
+    files = OrderedDict()
+    if args.spec is not None:
+        files.update(ComparisonSpec.from_file(args.spec).files)
+    for name_path in args.file:
+        name, path = name_path.split("=", 1)
+        files[name] = path
+    if not files:
+        parser.error("No generators given; use --spec and/or --file")
+
+    ROOT.gROOT.SetBatch(True)
+    comparison = GeneratorComparison(files)
+    try:
+        nrows = export_parquet(comparison, args.output, args.triggers)
+    finally:
+        comparison.pool.close()
+    log.info("Wrote {} rows to {}".format(nrows, args.output))
+    comparison.report()
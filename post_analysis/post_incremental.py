@@ -0,0 +1,85 @@
+"""
+Helpers for incremental post analysis runs (see `Plotting.run_step`). A manifest in the results dir stores a
+content hash of the inputs of each plot step: the Sums objects it reads, the binning configuration and the
+code version. A step is only recomputed if this hash changed since the last run.
+"""
+
+import glob
+import hashlib
+import json
+import os
+
+from rootpy import ROOT
+from rootpy.io import DoesNotExist
+
+from post_utils import get_bin_contents
+
+manifest_name = "manifest"
+# subdirectory of the results dir with the pickled return values of the plot steps
+step_results_dir_name = "incremental"
+
+
+def code_version():
+    """
+    Hash of the source code of the post analysis modules. post_main.py is left out since it only holds the
+    configuration, which is hashed separately.
+    """
+    md5 = hashlib.md5()
+    here = os.path.dirname(os.path.abspath(__file__))
+    for fname in sorted(glob.glob(os.path.join(here, "post_*.py"))):
+        if os.path.basename(fname) == "post_main.py":
+            continue
+        with open(fname) as f:
+            md5.update(f.read())
+    return md5.hexdigest()
+
+
+def hash_est_dir(est_dir):
+    """
+    Content hash of all histograms in the Sums list of an estimator. Other objects (eg. the event tuple)
+    are not used by the plot steps and are ignored.
+    """
+    md5 = hashlib.md5()
+    for obj in est_dir:
+        if isinstance(obj, ROOT.TH1):
+            md5.update(obj.GetName())
+            md5.update(get_bin_contents(obj).tostring())
+    return md5.hexdigest()
+
+
+def step_key(step, kwargs, est_names):
+    """Unique, human readable key of a plot step run for the given estimators"""
+    return json.dumps([step, sorted(kwargs.items()), list(est_names)])
+
+
+def step_result_name(key):
+    """Name under which the result of the step with the given key is stored"""
+    return hashlib.md5(key).hexdigest()
+
+
+class Manifest(object):
+    """
+    Maps the keys of plot steps (see `step_key`) to the hash of their inputs of the last run.
+    """
+    def __init__(self, hashes=None):
+        self.hashes = hashes if hashes is not None else {}
+
+    def is_up_to_date(self, key, inputs_hash):
+        return self.hashes.get(key) == inputs_hash
+
+    def update(self, key, inputs_hash):
+        self.hashes[key] = inputs_hash
+
+    @classmethod
+    def read(cls, results_dir):
+        """Read the manifest from the given results dir; an empty manifest if there is none yet"""
+        try:
+            obj = results_dir.Get(manifest_name)
+        except DoesNotExist:
+            return cls()
+        if not obj:
+            return cls()
+        return cls(json.loads(obj.GetString().Data()))
+
+    def write(self, results_dir):
+        results_dir.WriteTObject(ROOT.TObjString(json.dumps(self.hashes)), manifest_name, "Overwrite")
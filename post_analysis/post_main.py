@@ -3,12 +3,18 @@ This is the entry point to run the post analysis. The file post_plotting contain
 presentation of the plots. The logic which extracts the data from the primary generated "Sums" but is not concerned with any visual representation can be found in post_data_extractor.py. Lastly, the file post_utils.py contains small helper function for cleaning up data or generating names and titles.
 """
 
-import sys
+import argparse
+import os
+import time
 
 from rootpy import log, ROOT
+from rootpy.io import root_open
 
 from post_plotting import Plotting
-from roofie.beamify import Beamerdoc
+from post_profiling import Profiler
+from post_summary import SummaryDoc
+from post_sums import split_file_name
+from post_temporaries import temporaries
 
 ############
 # Settings #
@@ -37,61 +43,165 @@ percentile_bins = {
     'sphericity': [(1, 0.7), (.7, .4), (.3, .05), (0.001, 0.0)],
 }
 
+# Sections of the summary in the order they are run: (section title, plot step, keyword arguments).
+# Steps without a section title do not produce figures.
+sections = [
+    (r"$dN/d\eta$", 'plot_dNdetas', dict(ratio_to_mb=False)),
+    (r"$dN/d\eta$ over MB result", 'plot_dNdetas', dict(ratio_to_mb=True)),
+    (r"$P(N_{ch})$ summary", 'plot_PNch_summary', dict()),
+    (r"$P(N_{ch})$", 'plot_PNch', dict()),
+    (None, 'plot_mult_vs_pt', dict()),
+    (r"$\left< p_T \right>$ vs. ref multiplicity", 'plot_meanpt_vs_ref_mult_for_pids', dict()),
+    (r"Ratios for various species vs $p_T$", 'plot_pt_distribution_ratios', dict()),
+    (r"Ratios for various species vs ref. multiplicity", 'plot_pid_ratio_vs_refmult', dict()),
+    (r"$dN/dp_T$", 'plot_dNdpT', dict()),
+    (r"$\left[ dN_{HM}/dp_T\right] / \left[ dN_{MB}/dp_T\right]$", 'plot_pT_HM_div_pt_MB', dict(scale_nMPI=False)),
+    (r"$\left[ dN_{HM}/dp_T\right] / \left[ dN_{MB}/dp_T\right] \times \left[ \left<N_{MPI}^{MB}\right> / \left<N_{MPI}^{HM}\right>\right]$",
+     'plot_pT_HM_div_pt_MB', dict(scale_nMPI=True)),
+    (r"$nMPI(N_{ch})$", 'plot_nMPI_vs_Nch', dict()),
+]
+
+
+def run_sections(plotting, latexdoc, jobs=1):
+    """
+    Run all plot steps in `sections` and add their figures to the latex document.
+    If jobs > 1, the per-estimator steps are run in parallel processes.
+    """
+    # figures of each section, by index
+    figs = {}
+    if jobs > 1:
+        # mult_pt is read by the parallel steps, so it has to be written first
+        mult_pt_idx = [step for _, step, _ in sections].index('plot_mult_vs_pt')
+        figs[mult_pt_idx] = plotting.run_step('plot_mult_vs_pt')
+        parallel_idxs = [i for i, (_, step, _) in enumerate(sections) if step in Plotting.per_estimator_steps]
+        parallel_figs = plotting.run_parallel(steps=[sections[i][1:] for i in parallel_idxs], jobs=jobs)
+        figs.update(zip(parallel_idxs, parallel_figs))
+    for i, (title, step, kwargs) in enumerate(sections):
+        if i not in figs:
+            figs[i] = plotting.run_step(step, **kwargs)
+        if title is not None:
+            sec = latexdoc.add_section(title)
+            [sec.add_figure(fig) for fig in figs[i]]
+
+
+def run_trigger(f_name, trigger, summary_name, jobs=1, f=None, incremental=False, profiler=None,
+                lazy_sums=False, data_only=False, output_file=None, shared_dir=None):
+    """
+    Run the post analysis for the given trigger. `f` is an already opened `f_name` which may be shared
+    between several triggers. If `incremental`, only the plots whose inputs changed since the last run are
+    recomputed. The plot steps are recorded by `profiler`, if given. If `lazy_sums`, only the used parts of
+    the Sums are read (see `post_sums`). If `data_only`, only the results store is written (see
+    `Plotting`). The results are written to `output_file` instead of `f_name`, if given. The 3D histograms
+    are memory-mapped from `shared_dir`, if given (see `post_shared`). Returns the latex document which still
+    needs to be finalized.
+    """
+    latexdoc = SummaryDoc(author="Christian Bourjau", title=summary_name)
+    # Open the file only once for all plots; results are written when leaving the with block
+    with Plotting(f_name=f_name, sums_dir_name="Sums" + trigger, results_dir_name="results_post" + trigger,
+                  percentile_bins=percentile_bins, considered_ests=considered_ests, keep_open=True, f=f,
+                  incremental=incremental, profiler=profiler, lazy_sums=lazy_sums,
+                  data_only=data_only, output_file=output_file, shared_dir=shared_dir) as plotting:
+        run_sections(plotting, latexdoc, jobs=jobs)
+    plotting.projections.report()
+    plotting.correlations.report()
+    plotting.writes.report()
+    temporaries.report()
+    return latexdoc
+
+
 if __name__ == "__main__":
-    if len(sys.argv) < 4:
-        print """Usage: python post.py file.root {Inel, InelGt0, V0AND} "<summary name>" """
-        quit()
+    parser = argparse.ArgumentParser(description="Run the post analysis and create a summary pdf")
+    parser.add_argument("input_file", help="AnalysisResults.root file")
+    parser.add_argument("triggers", nargs="+", choices=["Inel", "InelGt0", "V0AND"],
+                        help="One or more triggers; the file is opened only once for all of them")
+    parser.add_argument("summary_name", help="Title of the summary")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of processes for the plots of each estimator")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only recompute the plots whose inputs changed since the last run")
+    parser.add_argument("--profile", metavar="REPORT",
+                        help="Profile each plot step and estimator and write a json report to REPORT")
+    parser.add_argument("--split-sums", action="store_true",
+                        help="Copy each estimator and histogram of the Sums once into its own key of a cache "
+                             "file next to the input (<input>_sums_split.root) and read only the used ones "
+                             "afterwards. The input file is not changed, so this also works with --output. The "
+                             "first run still reads the Sums as a whole to make the copy")
+    parser.add_argument("--data-only", action="store_true",
+                        help="Only write the numeric results store; no canvases and no summary pdf. The "
+                             "figures can be drawn later with post_store.py")
+    parser.add_argument("--output", metavar="FILE",
+                        help="Write the results to FILE instead of the input file, which is then only read. "
+                             "'{trigger}' in FILE is replaced by the trigger")
+    parser.add_argument("--shared-dir", metavar="DIR",
+                        help="Decode the classifier_pT_PID histograms once into memory-mapped arrays in DIR "
+                             "(eg. on /dev/shm), which all processes share instead of reading the histograms "
+                             "themselves. Kept and reused as long as the Sums do not change")
+    args = parser.parse_args()
+    if args.incremental and args.jobs > 1:
+        parser.error("--incremental cannot be combined with parallel jobs")
+    output_files = dict((trigger, args.output.format(trigger=trigger) if args.output is not None else None)
+                        for trigger in args.triggers)
+    if args.output is not None:
+        # the output files are deleted below; never the input
+        if any(os.path.realpath(fname) == os.path.realpath(args.input_file) for fname in output_files.values()):
+            parser.error("--output must not be the input file")
+        if args.split_sums and any(os.path.realpath(fname) == os.path.realpath(split_file_name(args.input_file))
+                                   for fname in output_files.values()):
+            parser.error("--output must not be the cache file of --split-sums")
+        if len(set(output_files.values())) < len(args.triggers):
+            parser.error("Several triggers need '{trigger}' in --output to get a file each")
+
     # go into batch mode
     ROOT.gROOT.SetBatch(True)
 
     log = log["/post"]  # set name of this script in logger
     log.info("IsBatch: {0}".format(ROOT.gROOT.IsBatch()))
 
+    if args.output is not None and not args.incremental:
+        # start with compact files instead of deleting the results of the last run in them
+        for fname in set(output_files.values()):
+            if os.path.exists(fname):
+                os.remove(fname)
+
+    # parallel steps need to reopen the file to see what was written before, so it can only be shared if
+    # everything runs in this process
+    shared_f = None
+    if len(args.triggers) > 1 and args.jobs == 1:
+        shared_f = root_open(args.input_file, 'read' if args.output is not None else 'update')
+
+    profiler = Profiler(enabled=args.profile is not None)
+    latexdocs = []
+    timings = []
     try:
-        global_trigger = sys.argv[2]
-    except IndexError:
-        global_trigger = ""
-    sums_dir_name = "Sums" + global_trigger
-    results_dir_name = "results_post" + global_trigger
-
-    plotting = Plotting(f_name=sys.argv[1], sums_dir_name=sums_dir_name, results_dir_name=results_dir_name,
-                        percentile_bins=percentile_bins, considered_ests=considered_ests)
-    latexdoc = Beamerdoc(author="Christian Bourjau", title=sys.argv[3])
-
-    # run the actual plots:
-    sec = latexdoc.add_section(r"$dN/d\eta$")
-    [sec.add_figure(fig) for fig in plotting.plot_dNdetas(ratio_to_mb=False)]
-
-    sec = latexdoc.add_section(r"$dN/d\eta$ over MB result")
-    [sec.add_figure(fig) for fig in plotting.plot_dNdetas(ratio_to_mb=True)]
-
-    sec = latexdoc.add_section(r"$P(N_{ch})$ summary")
-    [sec.add_figure(fig) for fig in plotting.plot_PNch_summary()]
-
-    sec = latexdoc.add_section(r"$P(N_{ch})$")
-    [sec.add_figure(fig) for fig in plotting.plot_PNch()]
-
-    plotting.plot_mult_vs_pt()
-
-    sec = latexdoc.add_section(r"$\left< p_T \right>$ vs. ref multiplicity")
-    [sec.add_figure(fig) for fig in plotting.plot_meanpt_vs_ref_mult_for_pids()]
-
-    sec = latexdoc.add_section(r"Ratios for various species vs $p_T$")
-    [sec.add_figure(fig) for fig in plotting.plot_pt_distribution_ratios()]
-
-    sec = latexdoc.add_section(r"Ratios for various species vs ref. multiplicity")
-    [sec.add_figure(fig) for fig in plotting.plot_pid_ratio_vs_refmult()]
-
-    sec = latexdoc.add_section(r"$dN/dp_T$")
-    [sec.add_figure(fig) for fig in plotting.plot_dNdpT()]
-
-    sec = latexdoc.add_section(r"$\left[ dN_{HM}/dp_T\right] / \left[ dN_{MB}/dp_T\right]$")
-    [sec.add_figure(fig) for fig in plotting.plot_pT_HM_div_pt_MB(scale_nMPI=False)]
-
-    sec = latexdoc.add_section(r"$\left[ dN_{HM}/dp_T\right] / \left[ dN_{MB}/dp_T\right] \times \left[ \left<N_{MPI}^{MB}\right> / \left<N_{MPI}^{HM}\right>\right]$")
-    [sec.add_figure(fig) for fig in plotting.plot_pT_HM_div_pt_MB(scale_nMPI=True)]
-
-    sec = latexdoc.add_section(r"$nMPI(N_{ch})$")
-    [sec.add_figure(fig) for fig in plotting.plot_nMPI_vs_Nch()]
-
-    latexdoc.finalize_document()
+        # The triggers run one after the other on purpose: the Sums of each trigger are a separate list and the
+        # results go to separate dirs, so interleaving the plot steps of the triggers would share no reads. It
+        # would only keep the deserialized Sums of all triggers (the bulk of the memory) alive at the same time.
+        # The file itself is opened only once (see above); with -j > 1 the estimators already run in parallel.
+        for trigger in args.triggers:
+            summary_name = args.summary_name
+            if len(args.triggers) > 1:
+                summary_name = "{} ({})".format(args.summary_name, trigger)
+            start = time.time()
+            with profiler.stage("post analysis", trigger=trigger):
+                latexdocs.append(run_trigger(args.input_file, trigger, summary_name, jobs=args.jobs,
+                                             f=shared_f, incremental=args.incremental, profiler=profiler,
+                                             lazy_sums=args.split_sums, data_only=args.data_only,
+                                             output_file=output_files[trigger], shared_dir=args.shared_dir))
+            timings.append([trigger, time.time() - start])
+    finally:
+        if shared_f is not None:
+            shared_f.Close()
+
+    for latexdoc, timing in zip(latexdocs, timings):
+        start = time.time()
+        if not args.data_only:
+            with profiler.stage("summary pdf", trigger=timing[0]):
+                latexdoc.finalize_document(jobs=args.jobs)
+        timing.append(time.time() - start)
+
+    for trigger, t_analysis, t_summary in timings:
+        log.info("{}: post analysis {:.1f} s, summary {:.1f} s".format(trigger, t_analysis, t_summary))
+
+    if profiler.enabled:
+        log.info(profiler.format_summary())
+        profiler.write_json(args.profile, input_file=args.input_file, triggers=args.triggers, jobs=args.jobs)
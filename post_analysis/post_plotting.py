@@ -1,27 +1,48 @@
+from collections import OrderedDict
+import cPickle as pickle
+import hashlib
+import json
+from multiprocessing import Pool
 from pprint import pprint
 
-from rootpy import asrootpy, log, collection
-from rootpy.plotting import Hist2D
-from rootpy.io import root_open
+from rootpy import asrootpy, log, collection, ROOT
+from rootpy.io import root_open, DoesNotExist
 
 from post_data_extractors import \
     get_dNdeta_in_classifier_bin_interval,\
     get_identified_vs_mult,\
-    get_correlation_histogram,\
     get_PNch_vs_estmult,\
     get_meanpt_vs_estmult,\
     get_pT_distribution,\
+    get_pT_distribution_table,\
     get_mean_nMPI,\
     get_graphs_particle_ratios_vs_refmult
 from post_utils import \
-    gen_random_name,\
     get_est_dirs,\
     make_estimator_title,\
-    remap_x_values,\
-    remove_zero_value_points,\
-    remove_points_with_equal_x,\
-    remove_points_with_x_err_gt_1NchRef,\
-    percentile_bin_to_binidx_bin
+    divide_with_errors,\
+    hist_from_arrays,\
+    remap_x_values_with_profile,\
+    sanitize_graphs,\
+    percentile_bin_to_binidx_bin,\
+    percentile_bins_to_binidx_bins,\
+    percentile_title,\
+    pnch_percentile_title
+from post_cache import CorrelationStore, ProjectionCache
+from post_correlations import default_chunk_size, fill_correlations, fill_correlations_parallel
+from post_profiling import Profiler, step_label
+from post_shared import attach_pid_hist, pid_hist_name, share_pid_hists, shared_stamp
+from post_store import ResultsStore
+from post_sums import LazySums, load_sums
+from post_temporaries import adopt, temp_name, temporaries
+from post_writes import WriteBuffer
+from post_incremental import \
+    Manifest,\
+    code_version,\
+    hash_est_dir,\
+    step_key,\
+    step_result_name,\
+    step_results_dir_name
 
 from roofie import Figure, Styles
 
@@ -41,8 +62,130 @@ kOMEGAMINUS = str(3334)
 kOMEGAPLUS = str(-3334)
 
 
+# Species for the particle ratios vs pT; each is the sum of the given pids
+pt_ratio_species = {
+    'proton': [kANTIPROTON, kPROTON],
+    'pi_ch': [kPIMINUS, kPIPLUS],
+    'xi': [kANTIXI, kXI],
+    'omega': [kOMEGAMINUS, kOMEGAPLUS],
+    'lambda': [kANTILAMBDA, kLAMBDA],
+    'k0s': [kK0S],
+    'k_ch': [kKPLUS, kKMINUS],
+    'pi0': [kPI0],
+}
+
+# Particle ratios vs pT, one figure per entry and estimator. `num` and `denom` are keys of pt_ratio_species.
+pt_ratios = [
+    dict(name="proton_over_pich__vs__pt", num='proton', denom='pi_ch',
+         ytitle="(p+#bar{p})/#pi^{+-}", ymax=.3),
+    dict(name="Xi_over_pich__vs__pt", num='xi', denom='pi_ch',
+         ytitle="#Xi/#pi^{+-}", ymax=.06, legend_position='tl'),
+    dict(name="OmegaCh_over_pich__vs__pt", num='omega', denom='pi_ch',
+         ytitle="#Omega_{ch}/#pi^{+-} ", ymax=.005, legend_position='tl'),
+    # Ratios to pi0
+    dict(name="pich_over_pi0__vs__pt", num='pi_ch', denom='pi0',
+         ytitle="#pi^{+-}/#pi^{0}", ymax=2.5, legend_position='bl'),
+    dict(name="proton_over_pi0__vs__pt", num='proton', denom='pi0',
+         ytitle="p/#pi^{0}", ymax=1, legend_position='tr'),
+    dict(name="K0S_over_pi0__vs__pt", num='k0s', denom='pi0',
+         ytitle="K^{0}_{S}/#pi^{0}", ymax=1.4, legend_position='tl'),
+    dict(name="Lambda_over_pi0__vs__pt", num='lambda', denom='pi0',
+         ytitle="#Lambda/#pi^{0}", ymax=.9, legend_position='tl'),
+    dict(name="Xi_over_pi0__vs__pt", num='xi', denom='pi0',
+         ytitle="#Xi/#pi^{0}", ymax=.08, legend_position='tl'),
+    dict(name="OmegaCh_over_pi0__vs__pt", num='omega', denom='pi0',
+         ytitle="#Omega_{ch}/#pi^{0}", ymax=.005, legend_position='tl'),
+    # Ratios to K0S
+    dict(name="proton_over_K0S__vs__pt", num='proton', denom='k0s',
+         ytitle="p/K^{0}_{S}", ymax=2.6, legend_position='tr'),
+    dict(name="Lambda_over_K0S__vs__pt", num='lambda', denom='k0s',
+         ytitle="#Lambda/K^{0}_{S}", ymax=1, legend_position='bl'),
+    dict(name="Xi_over_K0S__vs__pt", num='xi', denom='k0s',
+         ytitle="#Xi/K^{0}_{S}", ymax=.2, legend_position='tl'),
+    dict(name="OmegaCh_over_K0S__vs__pt", num='omega', denom='k0s',
+         ytitle="#Omega_{ch}/K^{0}_{S}", ymax=.012, legend_position='tl'),
+    dict(name="Kaon_over_pich__vs__pt", num='k_ch', denom='pi_ch',
+         ytitle="(K^{+} + K^{-}) / (#pi^{+} +#pi^{-})", ymax=1, legend_position='tl'),
+]
+
+
+def figure_labels(observable, estimator, percentile_bins, est_names):
+    """
+    Legend titles which the plot steps give the plottables of a figure; used to check the comparison specs
+    (see `post_comparison_spec`) before anything is read
+
+    Parameters
+    ----------
+    observable : str
+        Name of the figure below its estimator dir (or the results dir), eg. "dNdeta_summary"
+    estimator : str
+        Estimator dir of the figure or None
+    percentile_bins : dict
+        Percentile bins of each estimator, as given to `Plotting`
+    est_names : list
+        Considered estimators
+
+    Returns
+    -------
+    set or None :
+        None if the labels of this figure are not known
+    """
+    perc_bins = percentile_bins.get(estimator, [])
+    if observable == "dNdeta_summary":
+        return set(percentile_title(perc_bin) for perc_bin in perc_bins) | set(["MB"])
+    if observable in ("dNdeta_MB_ratio_summary", "pt_hm_div_pt_mb", "pt_hm_div_pt_mb_scaled_nMPI"):
+        return set(percentile_title(perc_bin) for perc_bin in perc_bins)
+    if observable.startswith("PNchEst_binned_in_Nch"):
+        ref_est = observable[len("PNchEst_binned_in_Nch"):]
+        return set(pnch_percentile_title(perc_bin) for perc_bin in percentile_bins.get(ref_est, []))
+    if observable.startswith("PNch") and observable.endswith("_binned_in_NchEst"):
+        return set(pnch_percentile_title(perc_bin) for perc_bin in perc_bins)
+    if observable.startswith("pid_ratios_vs_refmult/"):
+        return set(make_estimator_title(est_name) for est_name in est_names)
+    return None
+
+
 class Plotting(object):
-    def __init__(self, f_name, sums_dir_name, results_dir_name, percentile_bins, considered_ests):
+    # Plot steps which loop over the estimators and can be run for each estimator independently
+    per_estimator_steps = ['plot_dNdetas', 'plot_PNch', 'plot_meanpt_vs_ref_mult_for_pids',
+                           'plot_pt_distribution_ratios', 'plot_dNdpT', 'plot_pT_HM_div_pt_MB']
+
+    def __init__(self, f_name, sums_dir_name, results_dir_name, percentile_bins, considered_ests, keep_open=False,
+                 read_only=False, nch_edges=None, f=None, incremental=False, profiler=None, lazy_sums=False,
+                 data_only=False, output_file=None, shared_dir=None):
+        """
+        Parameters
+        ----------
+        keep_open : Boolean
+            Open the file only once and keep it (and the deserialized Sums) alive for all plot steps
+            instead of reopening it for each step. The file is written and closed by `close` or when
+            leaving the `with` block. This is a lot faster for large input files.
+        read_only : Boolean
+            Open the file read-only and use the existing results dir. Figures are not written to the file
+            but collected in `pending_writes`.
+        nch_edges : dict
+            Classifier bin edges of the percentile bins; computed from the event counters if not given
+        f : File
+            An already opened `f_name` which is shared with other Plotting objects (eg. for other triggers).
+            Implies `keep_open`; The file is written but not closed by `close`.
+        incremental : Boolean
+            Keep the results of previous runs. `run_step` then only recomputes the plots whose inputs changed.
+        profiler : Profiler
+            Records the time and memory of each plot step, estimator, projection and file operation
+        lazy_sums : Boolean
+            Only read the estimators and histograms of the Sums which are used (see `post_sums`). The Sums are
+            copied once into a cache file next to the input file for this.
+        data_only : Boolean
+            Only write the plotted objects to the results store (see `post_store`) but no canvases. The
+            canvases can be drawn later from the store.
+        output_file : str
+            Write the results dir to this file (created if needed) instead of `f_name`, which is then only
+            read. Several jobs can then read the same input file at the same time.
+        shared_dir : str
+            Directory of the memory-mapped classifier_pT_PID arrays (see `post_shared`). They are decoded into
+            it when the results dir is made; the plot steps and the workers of `run_parallel` then use them
+            instead of reading the 3D histograms from the Sums.
+        """
         self.f_name = f_name
         self.sums_dir_name = sums_dir_name
         self.results_dir_name = results_dir_name
@@ -51,46 +194,382 @@ class Plotting(object):
         self.ref_ests = ['EtaLt05', ]
         self.considered_ests = considered_ests
         self.perc_bins = percentile_bins
-        # figure out the nch edges corresponding to the percentile edges, depends on P(Nch)
-        self.delete_results_dir()
-        self.make_results_dir()
-        self.plot_event_counters()  # needed for calculations of the edges
-        self.nch_edges = self._find_nch_edges_from_percentile_edges()
-        pprint(self.nch_edges)
+        self.profiler = profiler if profiler is not None else Profiler(enabled=False)
+        self.lazy_sums = lazy_sums
+        self.data_only = data_only
+        self.output_file = output_file
+        self.shared_dir = shared_dir
+        # SharedHist3D (or None if not shared) by estimator; attached on first use
+        self._shared_hists = {}
+        # projections of the 3D classifier_pT_PID histograms, shared by all plot steps of this run
+        self.projections = ProjectionCache(profiler=self.profiler)
+        # correlation histograms and their projections and profiles, shared by all plot steps of this run
+        self.correlations = CorrelationStore(profiler=self.profiler)
+        self._read_only = read_only
+        self.incremental = incremental
+        # (figure, name, path) of the figures which still have to be written by the caller in read_only mode
+        self.pending_writes = [] if read_only else None
+        # results of the current step; written at its end (see `_flush_writes`)
+        self.writes = WriteBuffer()
+        # index of the plotted objects written next to the figures; read when the first figure is written
+        self.store = None
+        self._store_dirty = False
+        self._store_est_names = list(considered_ests)
+        self._shared_f = f
+        # True while the file is kept open across several plot steps
+        self._session = False
+        if keep_open or f is not None:
+            self.open()
+        if not read_only:
+            if not incremental:
+                self.delete_results_dir()
+            self.make_results_dir()
+            self.plot_event_counters()  # needed for calculations of the edges
+            self._flush_writes()
+            if shared_dir is not None:
+                self._share_pid_hists()
+        if nch_edges is None:
+            # figure out the nch edges corresponding to the percentile edges, depends on P(Nch)
+            nch_edges = self._find_nch_edges_from_percentile_edges()
+            pprint(nch_edges)
+        self.nch_edges = nch_edges
+        if incremental:
+            self._manifest = self._read_manifest()
+            self._code_version = code_version()
+            self._sums_hashes = self._hash_sums()
         # set the default style for all figures created from her on forward:
         Figure.style = Styles.Presentation_half
 
+    def __enter__(self):
+        if not self._session:
+            self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def _file_mode(self):
+        return 'read' if self._read_only or self.output_file is not None else 'update'
+
+    def _open_files(self):
+        if self._shared_f is not None:
+            self.f = self._shared_f
+        else:
+            self.f = root_open(self.f_name, self._file_mode)
+        # file of the results dir
+        if self.output_file is not None:
+            self.out = root_open(self.output_file, 'read' if self._read_only else 'update')
+        else:
+            self.out = self.f
+        self.sums = load_sums(self.f, self.sums_dir_name, lazy=self.lazy_sums)
+
+    def _close_files(self):
+        if self.out is not self.f:
+            self.out.Close()
+        if self._shared_f is None:
+            self.f.Close()
+
+    def open(self):
+        """
+        Open the file and read the Sums once. All following plot steps reuse them until `close` is called.
+        """
+        with self.profiler.stage("open file"):
+            self._open_files()
+        self._session = True
+
+    def close(self):
+        """
+        Free the Sums and write all results of the session to disk in one go.
+        """
+        if not self._session:
+            return
+        with self.profiler.stage("close file"):
+            if not self._read_only:
+                self._flush_writes()
+                self._write_store_index()
+                self.out.Write()
+            self._delete_sums()
+            self._close_files()
+        self._session = False
+
+    def _reopen(self):
+        # Close and reopen the file of the current session, so that everything written so far is on disk
+        self.close()
+        self.open()
+
+    def _load_results_post(self):
+        try:
+            self.results_post = self.out.MultEstimators.__getattr__(self.results_dir_name)
+        except (AttributeError, DoesNotExist):
+            # results dir does not exists (yet)
+            pass
+
+    def _delete_sums(self):
+        if isinstance(self.sums, LazySums):
+            # only frees what was read; iterating would read the rest
+            self.sums.Delete()
+            return
+        # Delete all TLists in sums since we own them and they would be left in memory otherwise
+        for obj in self.sums:
+            if isinstance(obj, collection.List):
+                obj.Delete()
+        self.sums.Delete()
+
     def _io_decorator(func):
         """
         Open and close the file befor and after the execution of the decorated function.
         The purpose ist to clean up memory in this way and to force an update of the file
         before the next function calls. The wrapper adds the file, sums and results_post to `self`.
+        If a session is open (see `open`), the already loaded file and sums are used instead.
         """
         def wrapper(self, **kwargs):
-            with root_open(self.f_name, 'update') as self.f:
-                self.sums = self.f.MultEstimators.__getattr__(self.sums_dir_name)
-                try:
-                    self.results_post = self.f.MultEstimators.__getattr__(self.results_dir_name)
-                except AttributeError:
-                    # results dir does not exists (yet)
-                    pass
+            if self._session:
+                # the results dir might have been (re)created by a previous step
+                self._load_results_post()
+                return func(self, **kwargs)
+            with self.profiler.stage("open file"):
+                self._open_files()
+                self._load_results_post()
+            try:
                 return_value = func(self, **kwargs)
-                # Delete all TLists in sums since we own them and they would be left in memory otherwise
-                for obj in self.sums:
-                    if isinstance(obj, collection.List):
-                        obj.Delete()
-                self.sums.Delete()
+                if not self._read_only:
+                    self._flush_writes()
+                self._delete_sums()
+            finally:
+                with self.profiler.stage("close file"):
+                    if not self._read_only:
+                        self._write_store_index()
+                    self._close_files()
             return return_value
         return wrapper
 
+    def _save_figure(self, fig, name, path):
+        if self.pending_writes is not None:
+            self.pending_writes.append((fig, name, path))
+        else:
+            self._write_figure(fig, name, path)
+
+    def _write_figure(self, fig, name, path):
+        # drawn and written with the other results of the step
+        self.writes.add_figure(path, name, fig)
+
+    def _flush_writes(self):
+        """Write the buffered results of the current step directory by directory"""
+        if len(self.writes) == 0:
+            return
+        with self.profiler.stage("write results"):
+            self.writes.flush(self.out, self._draw_figure)
+
+    def _draw_figure(self, fig, name, path):
+        if self.incremental:
+            # replace the figure of a previous run instead of adding another cycle
+            self._delete_key(path, name)
+        if not self.data_only:
+            fig.save_to_root_file(self.out, name, path)
+        self._store_figure(fig, name, path)
+
+    def _results_dir(self):
+        return self.out.GetDirectory('MultEstimators/' + self.results_dir_name)
+
+    def _store_figure(self, fig, name, path):
+        # path is absolute in the file, eg. /MultEstimators/results_postV0AND/V0M
+        results_path = 'MultEstimators/' + self.results_dir_name
+        rel_path = path.strip('/')
+        if rel_path.startswith(results_path):
+            rel_path = rel_path[len(results_path):].strip('/')
+        if self.store is None:
+            self.store = ResultsStore.read(self._results_dir(), trigger=self.sums_dir_name[len("Sums"):])
+        figure_path = rel_path + '/' + name if rel_path else name
+        self.store.add_figure(self._results_dir(), figure_path, fig, self._store_est_names)
+        self._store_dirty = True
+
+    def _write_store_index(self):
+        if self.store is not None and self._store_dirty:
+            self.store.write_index(self._results_dir())
+            self._store_dirty = False
+
+    def _delete_key(self, path, name):
+        try:
+            self.out.GetDirectory(path).Delete(name + ";*")
+        except DoesNotExist:
+            pass
+
+    @_io_decorator
+    def _write_figures(self, figures):
+        for fig, name, path in figures:
+            self._write_figure(fig, name, path)
+
+    @_io_decorator
+    def _estimator_names(self):
+        return [est_dir.GetName() for est_dir in get_est_dirs(self.sums, self.considered_ests)]
+
+    @_io_decorator
+    def _share_pid_hists(self):
+        with self.profiler.stage("share pid hists"):
+            share_pid_hists(self.f, self.sums, self.sums_dir_name, self.considered_ests, self.shared_dir)
+
+    def pid_hist(self, est_dir):
+        """
+        The classifier_pT_PID histogram of the estimator; its memory-mapped arrays if they were shared (see
+        `shared_dir`). Use it only through `projections`.
+        """
+        est_name = est_dir.GetName()
+        if self.shared_dir is not None:
+            if est_name not in self._shared_hists:
+                self._shared_hists[est_name] = attach_pid_hist(self.shared_dir, self.sums_dir_name, est_name,
+                                                               shared_stamp(self.f, self.sums_dir_name))
+            if self._shared_hists[est_name] is not None:
+                return self._shared_hists[est_name]
+        return asrootpy(est_dir.FindObject(pid_hist_name.format(est_name)))
+
+    def run_parallel(self, steps, jobs):
+        """
+        Run the given plot steps for each estimator in a separate process. The figures are written to the
+        file by this process once all workers are done.
+
+        Parameters
+        ----------
+        steps : list
+            List of (method name, kwargs) tuples. The methods have to be in `per_estimator_steps`
+        jobs : int
+            Number of worker processes
+
+        Returns
+        -------
+        list :
+            List of figures for each step; the same as calling the steps one after the other
+        """
+        for step, kwargs in steps:
+            if step not in self.per_estimator_steps:
+                raise ValueError("{} cannot be run for each estimator separately".format(step))
+        if self._shared_f is not None:
+            raise ValueError("Parallel plot steps cannot be run on a shared file")
+        if self._session:
+            # the workers need to see the event counters and mult_pt histograms written so far
+            self._reopen()
+        worker_args = [(self.f_name, self.sums_dir_name, self.results_dir_name, self.perc_bins,
+                        self.considered_ests, self.nch_edges, est_name, steps, self.output_file, self.shared_dir,
+                        self.lazy_sums)
+                       for est_name in self._estimator_names()]
+        pool = Pool(jobs)
+        try:
+            with self.profiler.stage("parallel plot steps"):
+                results = pool.map(_plot_estimator, worker_args)
+        finally:
+            pool.close()
+            pool.join()
+        figs = [[] for _ in steps]
+        pending_writes = []
+        for result in results:
+            est_figs, est_pending_writes = pickle.loads(result)
+            for step_figs, est_step_figs in zip(figs, est_figs):
+                step_figs.extend(est_step_figs)
+            pending_writes.extend(est_pending_writes)
+        log.info("Writing results of {} parallel plot steps".format(len(steps)))
+        self._write_figures(figures=pending_writes)
+        if self._session:
+            self._flush_writes()
+        return figs
+
+    def run_step(self, step, **kwargs):
+        """
+        Run the plot step (method) with the given name. In incremental mode, the step is only run if its inputs
+        changed since the last run. Steps which loop over the estimators are only run for the estimators
+        whose inputs changed. The figures of all other estimators are those of the previous run.
+        If profiling is enabled, steps which loop over the estimators are also profiled for each estimator.
+        """
+        label = step_label(step, kwargs)
+        with self.profiler.stage(label), temporaries.scope(label):
+            if step not in self.per_estimator_steps + ['plot_mult_vs_pt']:
+                result = self._run_single_step(step, kwargs, est_names=None)
+            elif not (self.incremental or self.profiler.enabled):
+                result = getattr(self, step)(**kwargs)
+            else:
+                result = self._run_step_per_estimator(step, kwargs, label)
+            if self._session and not self._read_only:
+                self._flush_writes()
+            return result
+
+    def _run_single_step(self, step, kwargs, est_names):
+        if not self.incremental:
+            return getattr(self, step)(**kwargs)
+        if est_names is None:
+            est_names = self._estimator_names()
+        return self._run_step_incrementally(step, kwargs, est_names)
+
+    def _run_step_per_estimator(self, step, kwargs, label):
+        all_ests = self.considered_ests
+        figs = []
+        try:
+            for est_name in self._estimator_names():
+                self.considered_ests = [est_name]
+                with self.profiler.stage(label, est=est_name):
+                    figs.append(self._run_single_step(step, kwargs, [est_name]))
+        finally:
+            self.considered_ests = all_ests
+        if step == 'plot_mult_vs_pt':
+            # does not produce figures
+            return None
+        return [fig for est_figs in figs for fig in est_figs]
+
+    def _run_step_incrementally(self, step, kwargs, est_names):
+        key = step_key(step, kwargs, est_names)
+        inputs_hash = self._inputs_hash(key, est_names)
+        if self._manifest.is_up_to_date(key, inputs_hash):
+            try:
+                result = self._load_step_result(key=key)
+                log.info("Inputs of {} unchanged, skipping it".format(key))
+                return result
+            except DoesNotExist:
+                pass
+        result = getattr(self, step)(**kwargs)
+        self._store_step_result(key=key, inputs_hash=inputs_hash, result=result)
+        return result
+
+    def _inputs_hash(self, key, est_names):
+        md5 = hashlib.md5()
+        md5.update(self._code_version)
+        md5.update(key)
+        # the reference estimators are used for the remapping and the P(Nch) plots
+        for est_name in sorted(set(est_names) | set(self.ref_ests)):
+            md5.update(json.dumps([est_name, self._sums_hashes.get(est_name), self.perc_bins.get(est_name)]))
+        return md5.hexdigest()
+
+    @_io_decorator
+    def _hash_sums(self):
+        return dict((est_dir.GetName(), hash_est_dir(est_dir))
+                    for est_dir in get_est_dirs(self.sums, self.considered_ests + self.ref_ests))
+
+    @_io_decorator
+    def _read_manifest(self):
+        return Manifest.read(self.results_post)
+
+    @_io_decorator
+    def _load_step_result(self, key):
+        obj = self.results_post.Get("{}/{}".format(step_results_dir_name, step_result_name(key)))
+        return pickle.loads(obj.GetString().Data())
+
+    @_io_decorator
+    def _store_step_result(self, key, inputs_hash, result):
+        try:
+            self.results_post.mkdir(step_results_dir_name)
+        except ValueError:
+            pass
+        results_dir = self.results_post.Get(step_results_dir_name)
+        # protocol 0 is plain ascii and can be stored in a TObjString
+        results_dir.WriteTObject(ROOT.TObjString(pickle.dumps(result, 0)), step_result_name(key), "Overwrite")
+        self._manifest.update(key, inputs_hash)
+        self._manifest.write(self.results_post)
+
     @_io_decorator
     def _find_nch_edges_from_percentile_edges(self):
         nch_edges = {}
         for est_dir in get_est_dirs(self.results_post, self.considered_ests):
             event_counter = est_dir.event_counter
             try:
-                nch_edges[est_dir.GetName()] = [percentile_bin_to_binidx_bin(perc_bin, event_counter)
-                                                for perc_bin in self.perc_bins[est_dir.GetName()]]
+                nch_edges[est_dir.GetName()] = percentile_bins_to_binidx_bins(self.perc_bins[est_dir.GetName()],
+                                                                              event_counter)
             except ValueError, e:
                 print "Error occured for classifier " + est_dir.GetName()
                 print "Desired percentile bins: "
@@ -104,15 +583,23 @@ class Plotting(object):
     @_io_decorator
     def delete_results_dir(self):
         # delete old result directory
-        self.f.rm('MultEstimators/' + self.results_dir_name)
-        self.f.Write()
+        try:
+            self.out.rm('MultEstimators/' + self.results_dir_name)
+        except DoesNotExist:
+            # new output file
+            pass
+        self.out.Write()
 
     @_io_decorator
     def make_results_dir(self):
-        self.f.mkdir('MultEstimators/' + self.results_dir_name, recurse=True)
+        try:
+            self.out.mkdir('MultEstimators/' + self.results_dir_name, recurse=True)
+        except ValueError:
+            # kept from a previous run in incremental mode
+            pass
         for est_dir in get_est_dirs(self.sums, self.considered_ests):
             try:
-                resdir = self.f.MultEstimators.__getattr__(self.results_dir_name).mkdir(est_dir.GetName())
+                resdir = self.out.MultEstimators.__getattr__(self.results_dir_name).mkdir(est_dir.GetName())
                 resdir.Write()
             except:
                 pass
@@ -129,8 +616,8 @@ class Plotting(object):
 
         for est_dir in get_est_dirs(self.sums, self.considered_ests):
             h3d = asrootpy(est_dir.FindObject("fNch_pT_pid"))
-            pids1hists = [get_identified_vs_mult(h3d, pdg) for pdg in pids1]
-            pids2hists = [get_identified_vs_mult(h3d, pdg) for pdg in pids2]
+            pids1hists = [get_identified_vs_mult(h3d, pdg, self.projections, est_dir.GetName()) for pdg in pids1]
+            pids2hists = [get_identified_vs_mult(h3d, pdg, self.projections, est_dir.GetName()) for pdg in pids2]
 
             pids1_px = sum(pids1hists)
             pids2_px = sum(pids2hists)
@@ -142,7 +629,7 @@ class Plotting(object):
                 ratio1d.Scale(scale)
                 fig.add_plottable(ratio1d, legend_title=make_estimator_title(est_dir.GetName()))
                 name = "_".join(pids1) + "_div_" + "_".join(pids2)
-                fig.save_to_root_file(self.f, name, ratio_vs_estmult_dir)
+                self._save_figure(fig, name, ratio_vs_estmult_dir)
 
     @_io_decorator
     def plot_event_counters(self):
@@ -150,12 +637,10 @@ class Plotting(object):
         for est_dir in get_est_dirs(self.sums, self.considered_ests):
             results_est_dir = self.results_post.__getattr__(est_dir.GetName())
             # Nasty, but just use a reference estimator here...
-            corr = get_correlation_histogram(self.sums, est_dir.GetName(), "EtaLt05")
-            counter = asrootpy(corr.ProjectionX())
-            counter.name = "event_counter"
+            event_counts = self.correlations.projection_x(self.sums, est_dir.GetName(), "EtaLt05")
+            counter = adopt(asrootpy(event_counts.Clone("event_counter")))
             path = results_est_dir.GetPath().split(":")[1]  # file.root:/internal/root/path
-            self.f.cd(path)
-            results_est_dir.WriteTObject(counter)
+            self.writes.add(path, counter.name, counter)
 
     @_io_decorator
     def plot_dNdetas(self, ratio_to_mb):
@@ -175,7 +660,7 @@ class Plotting(object):
             dNdeta_mb = get_dNdeta_in_classifier_bin_interval(est_dir, event_counter,
                                                               [1, event_counter.GetXaxis().GetNbins()])
             for cls_bin, perc_bin in zip(self.nch_edges[est_dir.GetName()], self.perc_bins[est_dir.GetName()]):
-                title = "{}%-{}%".format(perc_bin[1] * 100, perc_bin[0] * 100)
+                title = percentile_title(perc_bin)
                 dNdeta_in_interval = get_dNdeta_in_classifier_bin_interval(est_dir, event_counter, cls_bin)
                 if ratio_to_mb:
                     fig.add_plottable(dNdeta_in_interval / dNdeta_mb, legend_title=title)
@@ -187,9 +672,9 @@ class Plotting(object):
                 fig.add_plottable(dNdeta_mb, legend_title=title)
             path = results_est_dir.GetPath().split(":")[1]  # file.root:/internal/root/path
             if ratio_to_mb:
-                fig.save_to_root_file(self.f, "dNdeta_MB_ratio_summary", path=path)
+                self._save_figure(fig, "dNdeta_MB_ratio_summary", path)
             else:
-                fig.save_to_root_file(self.f, "dNdeta_summary", path=path)
+                self._save_figure(fig, "dNdeta_summary", path)
             figs.append(fig)
         return figs
 
@@ -200,6 +685,7 @@ class Plotting(object):
         results_path = self.results_post.GetPath().split(":")[1]  # file.root:/internal/root/path
         # Loop over all estimators in the Sums list:
         figs = []
+        species_names = sorted(pt_ratio_species.keys())
 
         def get_new_figure():
             fig = Figure()
@@ -213,225 +699,26 @@ class Plotting(object):
 
         for est_dir in get_est_dirs(self.results_post, self.considered_ests):
             dirname = '{}/{}/pid_ratios/'.format(results_path, est_dir.GetName())
-
-            mult_binned_pt_dists = {}
-            mult_binned_pt_dists['proton'] = [
-                get_pT_distribution(est_dir, [kANTIPROTON, kPROTON], classifier_bin_interval)
-                for classifier_bin_interval in self.nch_edges[est_dir.GetName()]
-            ]
-            mult_binned_pt_dists['pi_ch'] = [
-                get_pT_distribution(est_dir, [kPIMINUS, kPIPLUS], classifier_bin_interval)
-                for classifier_bin_interval in self.nch_edges[est_dir.GetName()]
-            ]
-            mult_binned_pt_dists['xi'] = [
-                get_pT_distribution(est_dir, [kANTIXI, kXI], classifier_bin_interval)
-                for classifier_bin_interval in self.nch_edges[est_dir.GetName()]
-            ]
-            mult_binned_pt_dists['omega'] = [
-                get_pT_distribution(est_dir, [kOMEGAMINUS, kOMEGAPLUS], classifier_bin_interval)
-                for classifier_bin_interval in self.nch_edges[est_dir.GetName()]
-            ]
-            mult_binned_pt_dists['lambda'] = [
-                get_pT_distribution(est_dir, [kANTILAMBDA, kLAMBDA], classifier_bin_interval)
-                for classifier_bin_interval in self.nch_edges[est_dir.GetName()]
-            ]
-            mult_binned_pt_dists['k0s'] = [
-                get_pT_distribution(est_dir, [kK0S], classifier_bin_interval)
-                for classifier_bin_interval in self.nch_edges[est_dir.GetName()]
-            ]
-            mult_binned_pt_dists['k_ch'] = [
-                get_pT_distribution(est_dir, [kKPLUS, kKMINUS], classifier_bin_interval)
-                for classifier_bin_interval in self.nch_edges[est_dir.GetName()]
-            ]
-            mult_binned_pt_dists['pi0'] = [
-                get_pT_distribution(est_dir, [kPI0], classifier_bin_interval)
-                for classifier_bin_interval in self.nch_edges[est_dir.GetName()]
-            ]
+            # all species in all classifier intervals at once; shape (species, interval, pT)
+            pt_dists, pt_dists_sumw2, pt_edges = get_pT_distribution_table(
+                est_dir, [pt_ratio_species[name] for name in species_names], self.nch_edges[est_dir.GetName()])
             perc_titles = ["{}%-{}%".format(perc_bin[0] * 100, perc_bin[1] * 100)
                            for perc_bin in self.perc_bins[est_dir.GetName()]]
 
-            fig = get_new_figure()
-            name = "proton_over_pich__vs__pt"
-            fig.ytitle = "(p+#bar{p})/#pi^{+-}"
-            fig.plot.ymax = .3
-            fig.legend.title = make_estimator_title(est_dir.GetName())
-            [
-                fig.add_plottable(h1 / h2, legend_title=title)
-                for h1, h2, title in zip(mult_binned_pt_dists['proton'], mult_binned_pt_dists['pi_ch'], perc_titles)
-            ]
-            fig.save_to_root_file(self.f, name, dirname)
-            figs.append(fig)
-
-            fig = get_new_figure()
-            name = "Xi_over_pich__vs__pt"
-            fig.plot.ymax = .06
-            fig.legend.position = 'tl'
-            fig.ytitle = "#Xi/#pi^{+-}"
-            fig.legend.title = make_estimator_title(est_dir.GetName())
-            [
-                fig.add_plottable(h1 / h2, legend_title=title)
-                for h1, h2, title in zip(mult_binned_pt_dists['xi'], mult_binned_pt_dists['pi_ch'], perc_titles)
-            ]
-            fig.save_to_root_file(self.f, name, dirname)
-            figs.append(fig)
-
-            fig = get_new_figure()
-            name = "OmegaCh_over_pich__vs__pt"
-            fig.plot.ymax = .005
-            fig.legend.position = 'tl'
-            fig.ytitle = "#Omega_{ch}/#pi^{+-} "
-            fig.legend.title = make_estimator_title(est_dir.GetName())
-            [
-                fig.add_plottable(h1 / h2, legend_title=title)
-                for h1, h2, title in zip(mult_binned_pt_dists['omega'], mult_binned_pt_dists['pi_ch'], perc_titles)
-            ]
-            fig.save_to_root_file(self.f, name, dirname)
-            figs.append(fig)
-
-            # Ratios to pi0
-            fig = get_new_figure()
-            name = "pich_over_pi0__vs__pt"
-            fig.plot.ymax = 2.5
-            fig.legend.position = 'bl'
-            fig.ytitle = "#pi^{+-}/#pi^{0}"
-            fig.legend.title = make_estimator_title(est_dir.GetName())
-            [
-                fig.add_plottable(h1 / h2, legend_title=title)
-                for h1, h2, title in zip(mult_binned_pt_dists['pi_ch'], mult_binned_pt_dists['pi0'], perc_titles)
-            ]
-            fig.save_to_root_file(self.f, name, dirname)
-            figs.append(fig)
-
-            fig = get_new_figure()
-            name = "proton_over_pi0__vs__pt"
-            fig.plot.ymax = 1
-            fig.legend.position = 'tr'
-            fig.ytitle = "p/#pi^{0}"
-            fig.legend.title = make_estimator_title(est_dir.GetName())
-            [
-                fig.add_plottable(h1 / h2, legend_title=title)
-                for h1, h2, title in zip(mult_binned_pt_dists['proton'], mult_binned_pt_dists['pi0'], perc_titles)
-            ]
-            fig.save_to_root_file(self.f, name, dirname)
-            figs.append(fig)
-
-            fig = get_new_figure()
-            name = "K0S_over_pi0__vs__pt"
-            fig.plot.ymax = 1.4
-            fig.legend.position = 'tl'
-            fig.ytitle = "K^{0}_{S}/#pi^{0}"
-            fig.legend.title = make_estimator_title(est_dir.GetName())
-            [
-                fig.add_plottable(h1 / h2, legend_title=title)
-                for h1, h2, title in zip(mult_binned_pt_dists['k0s'], mult_binned_pt_dists['pi0'], perc_titles)
-            ]
-            fig.save_to_root_file(self.f, name, dirname)
-            figs.append(fig)
-
-            fig = get_new_figure()
-            name = "Lambda_over_pi0__vs__pt"
-            fig.plot.ymax = .9
-            fig.legend.position = 'tl'
-            fig.ytitle = "#Lambda/#pi^{0}"
-            fig.legend.title = make_estimator_title(est_dir.GetName())
-            [
-                fig.add_plottable(h1 / h2, legend_title=title)
-                for h1, h2, title in zip(mult_binned_pt_dists['lambda'], mult_binned_pt_dists['pi0'], perc_titles)
-            ]
-            fig.save_to_root_file(self.f, name, dirname)
-            figs.append(fig)
-
-            fig = get_new_figure()
-            name = "Xi_over_pi0__vs__pt"
-            fig.plot.ymax = .08
-            fig.legend.position = 'tl'
-            fig.ytitle = "#Xi/#pi^{0}"
-            fig.legend.title = make_estimator_title(est_dir.GetName())
-            [
-                fig.add_plottable(h1 / h2, legend_title=title)
-                for h1, h2, title in zip(mult_binned_pt_dists['xi'], mult_binned_pt_dists['pi0'], perc_titles)
-            ]
-            fig.save_to_root_file(self.f, name, dirname)
-            figs.append(fig)
-
-            fig = get_new_figure()
-            name = "OmegaCh_over_pi0__vs__pt"
-            fig.plot.ymax = .005
-            fig.legend.position = 'tl'
-            fig.ytitle = "#Omega_{ch}/#pi^{0}"
-            fig.legend.title = make_estimator_title(est_dir.GetName())
-            [
-                fig.add_plottable(h1 / h2, legend_title=title)
-                for h1, h2, title in zip(mult_binned_pt_dists['omega'], mult_binned_pt_dists['pi0'], perc_titles)
-            ]
-            fig.save_to_root_file(self.f, name, dirname)
-            figs.append(fig)
-
-            # Ratios to K0S
-            fig = get_new_figure()
-            name = "proton_over_K0S__vs__pt"
-            fig.plot.ymax = 2.6
-            fig.legend.position = 'tr'
-            fig.ytitle = "p/K^{0}_{S}"
-            fig.legend.title = make_estimator_title(est_dir.GetName())
-            [
-                fig.add_plottable(h1 / h2, legend_title=title)
-                for h1, h2, title in zip(mult_binned_pt_dists['proton'], mult_binned_pt_dists['k0s'], perc_titles)
-            ]
-            fig.save_to_root_file(self.f, name, dirname)
-            figs.append(fig)
-
-            fig = get_new_figure()
-            name = "Lambda_over_K0S__vs__pt"
-            fig.plot.ymax = 1
-            fig.legend.position = 'bl'
-            fig.ytitle = "#Lambda/K^{0}_{S}"
-            fig.legend.title = make_estimator_title(est_dir.GetName())
-            [
-                fig.add_plottable(h1 / h2, legend_title=title)
-                for h1, h2, title in zip(mult_binned_pt_dists['lambda'], mult_binned_pt_dists['k0s'], perc_titles)
-            ]
-            fig.save_to_root_file(self.f, name, dirname)
-            figs.append(fig)
-
-            fig = get_new_figure()
-            name = "Xi_over_K0S__vs__pt"
-            fig.plot.ymax = .2
-            fig.legend.position = 'tl'
-            fig.ytitle = "#Xi/K^{0}_{S}"
-            fig.legend.title = make_estimator_title(est_dir.GetName())
-            [
-                fig.add_plottable(h1 / h2, legend_title=title)
-                for h1, h2, title in zip(mult_binned_pt_dists['xi'], mult_binned_pt_dists['k0s'], perc_titles)
-            ]
-            fig.save_to_root_file(self.f, name, dirname)
-            figs.append(fig)
-
-            fig = get_new_figure()
-            name = "OmegaCh_over_K0S__vs__pt"
-            fig.plot.ymax = .012
-            fig.legend.position = 'tl'
-            fig.ytitle = "#Omega_{ch}/K^{0}_{S}"
-            fig.legend.title = make_estimator_title(est_dir.GetName())
-            [
-                fig.add_plottable(h1 / h2, legend_title=title)
-                for h1, h2, title in zip(mult_binned_pt_dists['omega'], mult_binned_pt_dists['k0s'], perc_titles)
-            ]
-            fig.save_to_root_file(self.f, name, dirname)
-            figs.append(fig)
-
-            fig = get_new_figure()
-            name = "Kaon_over_pich__vs__pt"
-            fig.plot.ymax = 1
-            fig.legend.position = 'tl'
-            fig.ytitle = "(K^{+} + K^{-}) / (#pi^{+} +#pi^{-})"
-            fig.legend.title = make_estimator_title(est_dir.GetName())
-            [
-                fig.add_plottable(h1 / h2, legend_title=title)
-                for h1, h2, title in zip(mult_binned_pt_dists['k_ch'], mult_binned_pt_dists['pi_ch'], perc_titles)
-            ]
-            fig.save_to_root_file(self.f, name, dirname)
-            figs.append(fig)
+            for ratio in pt_ratios:
+                fig = get_new_figure()
+                fig.ytitle = ratio['ytitle']
+                fig.plot.ymax = ratio['ymax']
+                if 'legend_position' in ratio:
+                    fig.legend.position = ratio['legend_position']
+                fig.legend.title = make_estimator_title(est_dir.GetName())
+                inum, idenom = species_names.index(ratio['num']), species_names.index(ratio['denom'])
+                for iinterval, title in zip(range(pt_dists.shape[1]), perc_titles):
+                    values, errors = divide_with_errors(pt_dists[inum, iinterval], pt_dists_sumw2[inum, iinterval],
+                                                        pt_dists[idenom, iinterval], pt_dists_sumw2[idenom, iinterval])
+                    fig.add_plottable(hist_from_arrays(values, errors, pt_edges), legend_title=title)
+                self._save_figure(fig, ratio['name'], dirname)
+                figs.append(fig)
 
         return figs
 
@@ -446,13 +733,13 @@ class Plotting(object):
 
         for est_dir in get_est_dirs(self.sums, self.considered_ests):
             est_name = est_dir.GetName()
-            h_tmp = get_PNch_vs_estmult(self.sums, est_name)
+            h_tmp = get_PNch_vs_estmult(self.sums, est_name, self.correlations)
             if h_tmp.Integral() > 0:
                 h_tmp.Scale(1.0 / h_tmp.Integral())
                 summary_fig.add_plottable(h_tmp, make_estimator_title(est_name))
 
         path = self.results_post.GetPath().split(":")[1]  # file.root:/internal/root/path
-        summary_fig.save_to_root_file(self.f, "PNch_summary", path=path)
+        self._save_figure(summary_fig, "PNch_summary", path)
         # list as return type is expected for making the pdf
         return [summary_fig]
 
@@ -482,7 +769,8 @@ class Plotting(object):
                 fig_vs_estmult.ytitle = "P(N_{{ch}}^{{{}}})".format(est_name)
                 fig_vs_refmult.ytitle = "P(N_{{ch}}^{{{}}})".format(ref_est_name)
 
-                corr_hist = get_correlation_histogram(self.sums, est_name, ref_est_name)
+                # shared with other plot steps, so the axis ranges must not be changed
+                corr_hist = self.correlations.hist(self.sums, est_name, ref_est_name)
 
                 # logic when dealing with fixed bins given in Nch:
                 # ------------------------------------------------
@@ -497,29 +785,24 @@ class Plotting(object):
                 # ----------------------------------------
                 # event_counter_est = asrootpy(getattr(res_est_dir, "event_counter"))
 
-                legend_tmpl = "{}% - {}%"
                 fig_vs_estmult.legend.title = "Selected in {}".format(make_estimator_title(ref_est_name))
                 fig_vs_refmult.legend.title = "Selected in {}".format(make_estimator_title(est_name))
                 # WARNING: the following needs tweeking when going back to fixed N_ch bins!
                 for nch_bin, perc_bin in zip(self.nch_edges[ref_est_name], self.perc_bins[ref_est_name]):
                     # vs est_mult:
-                    corr_hist.xaxis.SetRange(0, 0)  # reset x axis
-                    corr_hist.yaxis.SetRange(nch_bin[0], nch_bin[1])
-                    h_vs_est = asrootpy(corr_hist.ProjectionX(gen_random_name()))
+                    h_vs_est = adopt(asrootpy(corr_hist.ProjectionX(temp_name(), nch_bin[0], nch_bin[1])))
                     if h_vs_est.Integral() > 0:
                         h_vs_est.Scale(1.0 / h_vs_est.Integral())
-                        fig_vs_estmult.add_plottable(h_vs_est, legend_tmpl.format(perc_bin[0] * 100, perc_bin[1] * 100))
+                        fig_vs_estmult.add_plottable(h_vs_est, pnch_percentile_title(perc_bin))
                     else:
                         log.info("No charged particles in {}*100 percentile bin of estimator {}. This should not happen".
                                  format(perc_bin, ref_est_name))
                 for nch_bin, perc_bin in zip(self.nch_edges[est_name], self.perc_bins[est_name]):
                     # vs ref_mult:
-                    corr_hist.yaxis.SetRange(0, 0)  # reset y axis
-                    corr_hist.xaxis.SetRange(*nch_bin)
-                    h_vs_ref = asrootpy(corr_hist.ProjectionY(gen_random_name()))
+                    h_vs_ref = adopt(asrootpy(corr_hist.ProjectionY(temp_name(), nch_bin[0], nch_bin[1])))
                     if h_vs_ref.Integral() > 0:
                         h_vs_ref.Scale(1.0 / h_vs_ref.Integral())
-                        fig_vs_refmult.add_plottable(h_vs_ref, legend_tmpl.format(perc_bin[0] * 100, perc_bin[1] * 100))
+                        fig_vs_refmult.add_plottable(h_vs_ref, pnch_percentile_title(perc_bin))
                     else:
                         log.info(
                             "No charged particles in {}*100 percentile bin of estimator {}. This should not happen".
@@ -527,9 +810,9 @@ class Plotting(object):
 
                 path = res_est_dir.GetPath().split(":")[1]
                 # vs est_mult
-                fig_vs_estmult.save_to_root_file(self.f, "PNchEst_binned_in_Nch{}".format(ref_est_name), path)
+                self._save_figure(fig_vs_estmult, "PNchEst_binned_in_Nch{}".format(ref_est_name), path)
                 # vs est_mult
-                fig_vs_refmult.save_to_root_file(self.f, "PNch{}_binned_in_NchEst".format(ref_est_name), path)
+                self._save_figure(fig_vs_refmult, "PNch{}_binned_in_NchEst".format(ref_est_name), path)
                 figs.append(fig_vs_estmult)
                 figs.append(fig_vs_refmult)
         return figs
@@ -541,53 +824,49 @@ class Plotting(object):
             path = (self.results_post.GetPath().split(":")[1]  # file.root:/internal/root/path
                     + "/" + est_dir.GetName()
                     + "/mult_pt")
-            try:
-                self.f.mkdir(path, recurse=True)
-            except ValueError:
-                pass
-            self.f.cd(path)
 
-            h3d = asrootpy(est_dir.FindObject('classifier_pT_PID_{}'.format(est_dir.GetName())))
+            h3d = self.pid_hist(est_dir)
             # loop through all particle kinds:
             nPIDs = h3d.zaxis.GetNbins()
             for ibin in range(1, nPIDs + 1):
-                h3d.zaxis.SetRange(ibin, ibin)
-                mult_pt = asrootpy(h3d.Project3D("yx"))
-                mult_pt.name = h3d.zaxis.GetBinLabel(ibin)
-                mult_pt.Write()
+                mult_pt = self.projections.get(est_dir.GetName(), h3d, "yx", (ibin, ibin))
+                # the cached projection is shared; write a copy with the proper name
+                label = h3d.zaxis.GetBinLabel(ibin)
+                self.writes.add(path, label, adopt(mult_pt.Clone(label)))
 
     @_io_decorator
-    def plot_correlation(self):
-        # Make correlations between estimators
+    def plot_correlation(self, jobs=1, binnings=None, chunk_size=default_chunk_size):
+        """
+        Correlate N_ch of each considered estimator with each estimator from the event tuples. The tuples are
+        read only once; see `post_correlations`.
+
+        Parameters
+        ----------
+        jobs : int
+            Number of processes reading the tuples
+        binnings : dict
+            Fixed `Binning` of some estimators; all others have one bin per unit of N_ch
+        chunk_size : int
+            Number of events read at once
+        """
         log.info("Correlating N_ch of each estimator")
         corr_dir = self.results_post.GetPath().split(":")[1] + '/correlations'
-        try:
-            self.f.mkdir(corr_dir, recurse=True)
-        except:
-            pass
-        # Take ntuple from the first estimator and then add friends to this one
-        nt0 = self.sums[0].FindObject("fEventTuple")
-        nt0.SetAlias(self.sums[0].GetName(), "fEventTuple")
-
-        # build ntuple
-        for est_dir in self.sums[1:]:
-            nt0.AddFriend(est_dir.FindObject("fEventTuple"), est_dir.GetName())
+        trees = OrderedDict((est_dir.GetName(), est_dir.FindObject("fEventTuple")) for est_dir in self.sums)
+        if jobs > 1:
+            acc = fill_correlations_parallel(self.f_name, self.sums_dir_name, trees.keys(), jobs, binnings,
+                                             chunk_size, lazy_sums=self.lazy_sums)
+        else:
+            acc = fill_correlations(trees, binnings, chunk_size)
         for ref_est in self.considered_ests:
-            for est_dir in self.sums:
-                log.info("Correlating {} with {}".format(ref_est, est_dir.GetName()))
-                corr_hist = Hist2D(400, 0, 400,
-                                   400, 0, 400,
-                                   name="corr_hist_{}_vs_{}".format(ref_est, est_dir.GetName()))
-                # Lables are deliberatly swaped, see Projection below!
-                corr_hist.title = ("Correlation N_{{ch}} in {0} and {1};N_{{ch}} {1};N_{{ch}} {0}"
-                                   .format(ref_est, est_dir.GetName()))
-
-                # this projects onto y:x, to make coding more adventurous
-                nt0.Project(corr_hist.name, "{0}.nch:{1}.nch".format(ref_est, est_dir.GetName()),
-                            "ev_weight")
+            if ref_est not in trees:
+                continue
+            for est_name in trees:
+                # Lables are deliberatly swaped: the estimator is on the x-axis, the reference on the y-axis
+                corr_hist = acc.hist(est_name, ref_est, name="corr_hist_{}_vs_{}".format(ref_est, est_name),
+                                     title=("Correlation N_{{ch}} in {0} and {1};N_{{ch}} {1};N_{{ch}} {0}"
+                                            .format(ref_est, est_name)))
                 corr_hist.drawstyle = 'colz'
-                self.f.cd(corr_dir)
-                corr_hist.write()
+                self.writes.add(corr_dir, corr_hist.name, corr_hist)
 
     @_io_decorator
     def plot_pid_ratio_vs_refmult(self):
@@ -611,7 +890,7 @@ class Plotting(object):
         graphs = get_graphs_particle_ratios_vs_refmult(self, pids1, pids2, )
         [fig.add_plottable(g, legend_title=g.GetTitle()) for g in graphs]
         name = "_".join(pids1) + "_div_" + "_".join(pids2)
-        fig.save_to_root_file(self.f, name, ratios_dir)
+        self._save_figure(fig, name, ratios_dir)
         figs.append(fig)
 
         # K / pi_ch
@@ -622,7 +901,7 @@ class Plotting(object):
         graphs = get_graphs_particle_ratios_vs_refmult(self, pids1, pids2)
         [fig.add_plottable(g, legend_title=g.GetTitle()) for g in graphs]
         name = "_".join(pids1) + "_div_" + "_".join(pids2)
-        fig.save_to_root_file(self.f, name, ratios_dir)
+        self._save_figure(fig, name, ratios_dir)
         figs.append(fig)
 
         # Lambda / pi_ch
@@ -633,7 +912,7 @@ class Plotting(object):
         graphs = get_graphs_particle_ratios_vs_refmult(self, pids1, pids2)
         [fig.add_plottable(g, legend_title=g.GetTitle()) for g in graphs]
         name = "_".join(pids1) + "_div_" + "_".join(pids2)
-        fig.save_to_root_file(self.f, name, ratios_dir)
+        self._save_figure(fig, name, ratios_dir)
         figs.append(fig)
 
         # Xi / pi_ch
@@ -644,7 +923,7 @@ class Plotting(object):
         graphs = get_graphs_particle_ratios_vs_refmult(self, pids1, pids2)
         [fig.add_plottable(g, legend_title=g.GetTitle()) for g in graphs]
         name = "_".join(pids1) + "_div_" + "_".join(pids2)
-        fig.save_to_root_file(self.f, name, ratios_dir)
+        self._save_figure(fig, name, ratios_dir)
         figs.append(fig)
 
         # Omega / pi_ch
@@ -655,7 +934,7 @@ class Plotting(object):
         graphs = get_graphs_particle_ratios_vs_refmult(self, pids1, pids2)
         [fig.add_plottable(g, legend_title=g.GetTitle()) for g in graphs]
         name = "_".join(pids1) + "_div_" + "_".join(pids2)
-        fig.save_to_root_file(self.f, name, ratios_dir)
+        self._save_figure(fig, name, ratios_dir)
         figs.append(fig)
 
         # pi_ch/pi0
@@ -666,7 +945,7 @@ class Plotting(object):
         graphs = get_graphs_particle_ratios_vs_refmult(self, pids1, pids2)
         [fig.add_plottable(g, legend_title=g.GetTitle()) for g in graphs]
         name = "_".join(pids1) + "_div_" + "_".join(pids2)
-        fig.save_to_root_file(self.f, name, ratios_dir)
+        self._save_figure(fig, name, ratios_dir)
         figs.append(fig)
 
         # proton / pi0
@@ -678,7 +957,7 @@ class Plotting(object):
         graphs = get_graphs_particle_ratios_vs_refmult(self, pids1, pids2)
         [fig.add_plottable(g, legend_title=g.GetTitle()) for g in graphs]
         name = "_".join(pids1) + "_div_" + "_".join(pids2)
-        fig.save_to_root_file(self.f, name, ratios_dir)
+        self._save_figure(fig, name, ratios_dir)
         figs.append(fig)
 
         # K / pi0
@@ -690,7 +969,7 @@ class Plotting(object):
         graphs = get_graphs_particle_ratios_vs_refmult(self, pids1, pids2)
         [fig.add_plottable(g, legend_title=g.GetTitle()) for g in graphs]
         name = "_".join(pids1) + "_div_" + "_".join(pids2)
-        fig.save_to_root_file(self.f, name, ratios_dir)
+        self._save_figure(fig, name, ratios_dir)
         figs.append(fig)
 
         # Lambda / pi0
@@ -701,7 +980,7 @@ class Plotting(object):
         graphs = get_graphs_particle_ratios_vs_refmult(self, pids1, pids2)
         [fig.add_plottable(g, legend_title=g.GetTitle()) for g in graphs]
         name = "_".join(pids1) + "_div_" + "_".join(pids2)
-        fig.save_to_root_file(self.f, name, ratios_dir)
+        self._save_figure(fig, name, ratios_dir)
         figs.append(fig)
 
         # Xi / pi0
@@ -713,7 +992,7 @@ class Plotting(object):
         graphs = get_graphs_particle_ratios_vs_refmult(self, pids1, pids2)
         [fig.add_plottable(g, legend_title=g.GetTitle()) for g in graphs]
         name = "_".join(pids1) + "_div_" + "_".join(pids2)
-        fig.save_to_root_file(self.f, name, ratios_dir)
+        self._save_figure(fig, name, ratios_dir)
         figs.append(fig)
 
         # Omega / pi0
@@ -725,7 +1004,7 @@ class Plotting(object):
         graphs = get_graphs_particle_ratios_vs_refmult(self, pids1, pids2)
         [fig.add_plottable(g, legend_title=g.GetTitle()) for g in graphs]
         name = "_".join(pids1) + "_div_" + "_".join(pids2)
-        fig.save_to_root_file(self.f, name, ratios_dir)
+        self._save_figure(fig, name, ratios_dir)
         figs.append(fig)
 
         # K_ch / K0_S
@@ -737,7 +1016,7 @@ class Plotting(object):
         graphs = get_graphs_particle_ratios_vs_refmult(self, pids1, pids2, scale=.5)
         [fig.add_plottable(g, legend_title=g.GetTitle()) for g in graphs]
         name = "_".join(pids1) + "_div_" + "_".join(pids2)
-        fig.save_to_root_file(self.f, name, ratios_dir)
+        self._save_figure(fig, name, ratios_dir)
         figs.append(fig)
 
         # K0_S / Lambda
@@ -748,7 +1027,7 @@ class Plotting(object):
         graphs = get_graphs_particle_ratios_vs_refmult(self, pids1, pids2)
         [fig.add_plottable(g, legend_title=g.GetTitle()) for g in graphs]
         name = "_".join(pids1) + "_div_" + "_".join(pids2)
-        fig.save_to_root_file(self.f, name, ratios_dir)
+        self._save_figure(fig, name, ratios_dir)
         figs.append(fig)
 
         # K0_S / Xi
@@ -759,7 +1038,7 @@ class Plotting(object):
         graphs = get_graphs_particle_ratios_vs_refmult(self, pids1, pids2)
         [fig.add_plottable(g, legend_title=g.GetTitle()) for g in graphs]
         name = "_".join(pids1) + "_div_" + "_".join(pids2)
-        fig.save_to_root_file(self.f, name, ratios_dir)
+        self._save_figure(fig, name, ratios_dir)
         figs.append(fig)
 
         return figs
@@ -778,30 +1057,23 @@ class Plotting(object):
             if sums_est_dir.GetName() != res_est_dir.GetName():
                 raise IndexError("Order of estimator dirs is different in sums and results_post")
             res_dir_str = res_est_dir.GetPath().split(":")[1]
-            corr_hist = get_correlation_histogram(self.sums, sums_est_dir.GetName(), "EtaLt05")
+            profx = self.correlations.profile_x(self.sums, sums_est_dir.GetName(), "EtaLt05")
             # Get the <pT> per classifier bin; then, re-map the classifier value to the reference classifier (eg EtaLt05)
             # This might not make a lot of sense, actually. Maybe it would be much more telling if I were to
             # put the percentile bins on the x-axis? As in the highest 1% of that classifier has a <pT> of ...
-            graphs = []
-            graphs.append(remap_x_values(get_meanpt_vs_estmult(res_est_dir, [kPI0, kPIMINUS, kPIPLUS]), corr_hist))
-            graphs[-1].title = "#pi"
-            graphs.append(remap_x_values(get_meanpt_vs_estmult(res_est_dir, [kKMINUS, kKPLUS]), corr_hist))
-            graphs[-1].title = "K^{#pm}"
-            graphs.append(remap_x_values(get_meanpt_vs_estmult(res_est_dir, [kPROTON, kANTIPROTON]), corr_hist))
-            graphs[-1].title = "p"
-            graphs.append(remap_x_values(get_meanpt_vs_estmult(res_est_dir, [kK0S]), corr_hist))
-            graphs[-1].title = "K^{0}_{S}"
-            graphs.append(remap_x_values(get_meanpt_vs_estmult(res_est_dir, [kLAMBDA, kANTILAMBDA]), corr_hist))
-            graphs[-1].title = "#Lambda"
-            graphs.append(remap_x_values(get_meanpt_vs_estmult(res_est_dir, [kXI, kANTIXI]), corr_hist))
-            graphs[-1].title = "#Xi"
-            graphs.append(remap_x_values(get_meanpt_vs_estmult(res_est_dir, [kOMEGAMINUS, kOMEGAPLUS]), corr_hist))
-            graphs[-1].title = "#Omega"
+            species = [("#pi", [kPI0, kPIMINUS, kPIPLUS]),
+                       ("K^{#pm}", [kKMINUS, kKPLUS]),
+                       ("p", [kPROTON, kANTIPROTON]),
+                       ("K^{0}_{S}", [kK0S]),
+                       ("#Lambda", [kLAMBDA, kANTILAMBDA]),
+                       ("#Xi", [kXI, kANTIXI]),
+                       ("#Omega", [kOMEGAMINUS, kOMEGAPLUS])]
+            graphs = remap_x_values_with_profile([get_meanpt_vs_estmult(res_est_dir, pids) for _, pids in species],
+                                                 profx)
+            for g, (title, _) in zip(graphs, species):
+                g.title = title
             # sanitize graphs:
-            for g in graphs:
-                remove_zero_value_points(g)
-                remove_points_with_x_err_gt_1NchRef(g)
-                remove_points_with_equal_x(g)
+            graphs = sanitize_graphs(graphs)
 
             fig = Figure()
             fig.plot.palette = 'root'
@@ -814,7 +1086,7 @@ class Plotting(object):
             fig.xtitle = "N_{ch}|_{|#eta|<0.5}"
             fig.legend.title = make_estimator_title(sums_est_dir.GetName())
             [fig.add_plottable(g, g.title) for g in graphs]
-            fig.save_to_root_file(self.f, "mean_pt", res_dir_str)
+            self._save_figure(fig, "mean_pt", res_dir_str)
             figs.append(fig)
         return figs
 
@@ -866,7 +1138,7 @@ class Plotting(object):
 
             for perc_bin, classifier_bin in zip(self.perc_bins[sums_est_dir.GetName()], self.nch_edges[sums_est_dir.GetName()]):
                 hists.append(get_pT_distribution(res_est_dir, charged_particles, classifier_bin, normalized=False))
-                hists[-1].title = "{}%-{}%".format(perc_bin[1] * 100, perc_bin[0] * 100)
+                hists[-1].title = percentile_title(perc_bin)
 
             # add MB last to be consistent with colors in other plots; the very first and very last bin we look at
             classifier_bin_mb = (self.nch_edges[sums_est_dir.GetName()][0][0], self.nch_edges[sums_est_dir.GetName()][-1][-1])
@@ -878,7 +1150,7 @@ class Plotting(object):
 
             [fig.add_plottable(p, p.title) for p in hists]
             fig.legend.title = "#pi^{#pm}, K^{#pm}, p, #Lambda, #Xi, #Omega"
-            fig.save_to_root_file(self.f, "dNdpT", res_dir_str)
+            self._save_figure(fig, "dNdpT", res_dir_str)
             figs.append(fig)
         return figs
 
@@ -916,7 +1188,7 @@ class Plotting(object):
                 # get the pt distribution in this Nch interval
                 pt_dist_in_interval = get_pT_distribution(res_est_dir, charged_particles,
                                                           classifier_bin, normalized=False)
-                title = "{}%-{}%".format(perc_bin[1] * 100, perc_bin[0] * 100)
+                title = percentile_title(perc_bin)
                 if scale_nMPI:
                     mean_nmpi_hm = get_mean_nMPI(sums_est_dir, classifier_bin)
                     fig.add_plottable((pt_dist_in_interval / pt_dist_mb) * (mean_nmpi_mb / mean_nmpi_hm), title)
@@ -924,7 +1196,7 @@ class Plotting(object):
                 else:
                     fig.add_plottable((pt_dist_in_interval / pt_dist_mb), title)
                     name = "pt_hm_div_pt_mb"
-            fig.save_to_root_file(self.f, name, res_dir_str)
+            self._save_figure(fig, name, res_dir_str)
             figs.append(fig)
         return figs
 
@@ -940,9 +1212,33 @@ class Plotting(object):
         summary_fig.plot.ymin = 1
 
         for est_dir in get_est_dirs(self.sums, self.considered_ests):
-            h_tmp = asrootpy(get_correlation_histogram(self.sums, est_dir.GetName(), "nMPI").ProfileX())
+            h_tmp = adopt(asrootpy(self.correlations.profile_x(self.sums, est_dir.GetName(), "nMPI")
+                                   .Clone(temp_name())))
             summary_fig.add_plottable(h_tmp, make_estimator_title(est_dir.GetName()))
 
         path = self.results_post.GetPath().split(":")[1]  # file.root:/internal/root/path
-        summary_fig.save_to_root_file(self.f, "nMPI_summary", path=path)
+        self._save_figure(summary_fig, "nMPI_summary", path)
         return [summary_fig]
+
+
+def _plot_estimator(args):
+    """
+    Run plot steps for a single estimator in a worker process; see `Plotting.run_parallel`.
+    Returns the pickled figures of each step and the figures which still have to be written.
+    """
+    (f_name, sums_dir_name, results_dir_name, percentile_bins, considered_ests,
+     nch_edges, est_name, steps, output_file, shared_dir, lazy_sums) = args
+    ROOT.gROOT.SetBatch(True)
+    with Plotting(f_name=f_name, sums_dir_name=sums_dir_name, results_dir_name=results_dir_name,
+                  percentile_bins=percentile_bins, considered_ests=considered_ests,
+                  keep_open=True, read_only=True, nch_edges=nch_edges, output_file=output_file,
+                  shared_dir=shared_dir, lazy_sums=lazy_sums) as plotting:
+        # all considered estimators are needed above (eg. for the reference estimator's edges); but only
+        # this one is plotted
+        plotting.considered_ests = [est_name]
+        figs = []
+        for step, kwargs in steps:
+            with temporaries.scope(step_label(step, kwargs)):
+                figs.append(getattr(plotting, step)(**kwargs))
+        # serialize while the file is still open
+        return pickle.dumps((figs, plotting.pending_writes), pickle.HIGHEST_PROTOCOL)
@@ -0,0 +1,147 @@
+"""
+Profiling of the post analysis. A `Profiler` records the wall time, cpu time, memory and the number of ROOT
+objects created in named stages (plot steps, estimators, file I/O, projections, ...). Stages can be nested;
+a stage inherits the labels (eg. trigger or estimator) of the stages it is nested in.
+"""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import json
+import os
+import resource
+import time
+
+from rootpy import log, ROOT
+
+log = log["/profiling"]
+
+
+def current_rss_mb():
+    """Current resident memory of this process; peak memory if /proc is not available"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 1024.0 ** 2
+    except IOError:
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    # ru_maxrss is given in kB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def cpu_time():
+    """User and system time of this process in seconds"""
+    t = os.times()
+    return t[0] + t[1]
+
+
+def root_object_count():
+    """
+    Number of ROOT objects alive in this process. Only available once object statistics are enabled
+    (see `Profiler`); None otherwise
+    """
+    table = getattr(ROOT, "gObjectTable", None)
+    if not table:
+        return None
+    return table.Instances()
+
+
+def step_label(step, kwargs):
+    """Name of a plot step including its keyword arguments, eg. plot_dNdetas_ratio_to_mb=True"""
+    return step + "".join("_{}={}".format(k, v) for k, v in sorted(kwargs.items()))
+
+
+class Profiler(object):
+    """
+    Collects one record for each stage which was run. A disabled profiler does not record anything and adds
+    no overhead, so that it can always be passed around.
+    """
+    def __init__(self, enabled=True, count_objects=True):
+        """
+        Parameters
+        ----------
+        enabled : Boolean
+            Record the stages
+        count_objects : Boolean
+            Count the ROOT objects created in each stage. This enables ROOT's object statistics, which slows
+            down the creation of every TObject a little.
+        """
+        self.enabled = enabled
+        self.records = []
+        # labels of the currently open stages
+        self._labels = []
+        if enabled and count_objects:
+            ROOT.TObject.SetObjectStat(True)
+
+    @contextmanager
+    def stage(self, name, **labels):
+        """
+        Context manager which records the stage `name`. Additional keyword arguments (eg. est="V0M") label the
+        record and all records of stages nested in this one.
+        """
+        if not self.enabled:
+            yield
+            return
+        outer_labels = self._labels[-1] if self._labels else {}
+        labels = dict(outer_labels, **labels)
+        self._labels.append(labels)
+        wall_start, cpu_start, rss_start = time.time(), cpu_time(), current_rss_mb()
+        objects_start = root_object_count()
+        try:
+            yield
+        finally:
+            self._labels.pop()
+            objects_end = root_object_count()
+            rss = current_rss_mb()
+            record = dict(labels)
+            record.update(stage=name,
+                          wall_s=time.time() - wall_start,
+                          cpu_s=cpu_time() - cpu_start,
+                          rss_mb=rss,
+                          rss_delta_mb=rss - rss_start,
+                          peak_rss_mb=peak_rss_mb(),
+                          root_objects=(objects_end - objects_start
+                                        if objects_start is not None and objects_end is not None else None))
+            self.records.append(record)
+
+    def summary(self):
+        """
+        Records summed up by stage and estimator, in the order in which the stages were first run.
+
+        Returns
+        -------
+        list :
+            List of dicts with the stage, estimator, number of calls and summed times, memory and objects
+        """
+        rows = OrderedDict()
+        for record in self.records:
+            key = (record['stage'], record.get('est'))
+            row = rows.setdefault(key, dict(stage=key[0], est=key[1], calls=0, wall_s=0.0, cpu_s=0.0,
+                                            rss_delta_mb=0.0, peak_rss_mb=0.0, root_objects=None))
+            row['calls'] += 1
+            row['wall_s'] += record['wall_s']
+            row['cpu_s'] += record['cpu_s']
+            row['rss_delta_mb'] += record['rss_delta_mb']
+            row['peak_rss_mb'] = max(row['peak_rss_mb'], record['peak_rss_mb'])
+            if record['root_objects'] is not None:
+                row['root_objects'] = (row['root_objects'] or 0) + record['root_objects']
+        return rows.values()
+
+    def format_summary(self):
+        """Summary as a table, one line per stage and estimator"""
+        fmt = "{:<55} {:<12} {:>6} {:>10} {:>10} {:>10} {:>10} {:>10}"
+        lines = [fmt.format("stage", "estimator", "calls", "wall [s]", "cpu [s]", "dRSS [MB]", "peak [MB]",
+                            "objects")]
+        for row in self.summary():
+            lines.append(fmt.format(row['stage'][:55], row['est'] or "", row['calls'],
+                                    "{:.2f}".format(row['wall_s']), "{:.2f}".format(row['cpu_s']),
+                                    "{:.1f}".format(row['rss_delta_mb']), "{:.1f}".format(row['peak_rss_mb']),
+                                    row['root_objects'] if row['root_objects'] is not None else "-"))
+        return "\n".join(lines)
+
+    def write_json(self, fname, **metadata):
+        """Write all records, the summary and the given metadata to `fname`"""
+        with open(fname, "w") as f:
+            json.dump(dict(metadata, records=self.records, summary=self.summary()), f, indent=1)
+        log.info("Profiling report written to {}".format(fname))
@@ -0,0 +1,212 @@
+"""
+Memory-mapped copies of the `classifier_pT_PID_<est>` histograms (x: classifier value, y: pT, z: PID), the
+largest objects of the Sums. `share_pid_hists` decodes the bin contents and squared errors of each of them once
+into .npy files in a directory
+
+    <shared dir>/<sums dir>/<estimator>/{contents.npy, sumw2.npy, meta.json}
+
+Processes which need the histograms (eg. the workers of `Plotting.run_parallel`) attach to these files with
+`attach_pid_hist` instead of deserializing the histograms from the ROOT file. The files are mapped read-only,
+so all processes share the same pages of the OS page cache and the histograms are in memory only once, no
+matter how many processes use them. Put the directory on a tmpfs (eg. /dev/shm) to keep it off the disk.
+
+The arrays are decoded again if the Sums changed (see `post_sums.sums_stamp`).
+"""
+
+import json
+import os
+
+import numpy as np
+
+from rootpy import log
+from rootpy.plotting import Hist2D
+
+from post_arrays import HistArray, axis_edges, axis_labels, flat_bin_arrays, hist_axes, hist_to_array, unflatten
+from post_sums import sums_stamp
+from post_temporaries import adopt, temp_name
+from post_utils import native_strings, set_bin_contents
+
+log = log["/shared"]
+
+pid_hist_name = "classifier_pT_PID_{}"
+meta_name = "meta.json"
+
+
+def _est_dir(shared_dir, sums_dir_name, est_name):
+    return os.path.join(shared_dir, sums_dir_name, est_name)
+
+
+def _read_meta(est_dir):
+    try:
+        with open(os.path.join(est_dir, meta_name)) as f:
+            return native_strings(json.load(f))
+    except (IOError, ValueError):
+        return None
+
+
+def shared_stamp(f, sums_dir_name):
+    """Stamp of the shared arrays: the input file and the Sums key they were decoded from"""
+    return "{} {}".format(os.path.abspath(f.GetName()), sums_stamp(f, sums_dir_name))
+
+
+def _write_array(fname, flat):
+    # write to a temporary name first, so that processes attached to the old file keep a consistent view
+    tmp_name = fname + ".tmp.npy"
+    arr = np.lib.format.open_memmap(tmp_name, mode='w+', dtype=np.float64, shape=flat.shape)
+    arr[:] = flat
+    arr.flush()
+    del arr
+    os.rename(tmp_name, fname)
+
+
+def share_pid_hist(h3d, est_dir, stamp):
+    """
+    Decode the bin contents and squared errors of a 3D histogram into .npy files in `est_dir`. The meta data
+    is written last, so that an interrupted export is not picked up.
+    """
+    if not os.path.isdir(est_dir):
+        os.makedirs(est_dir)
+    meta_fname = os.path.join(est_dir, meta_name)
+    if os.path.exists(meta_fname):
+        os.remove(meta_fname)
+    axes = hist_axes(h3d)
+    contents, sumw2 = flat_bin_arrays(h3d)
+    _write_array(os.path.join(est_dir, "contents.npy"), contents)
+    _write_array(os.path.join(est_dir, "sumw2.npy"), sumw2)
+    meta = dict(stamp=stamp, name=h3d.GetName(), title=h3d.GetTitle(),
+                axis_titles=[axis.GetTitle() for axis in axes],
+                edges=[e.tolist() for e in (axis_edges(axis) for axis in axes)],
+                labels=[axis_labels(axis) for axis in axes])
+    with open(meta_fname, "w") as f:
+        json.dump(meta, f)
+
+
+def share_pid_hists(f, sums, sums_dir_name, est_names, shared_dir):
+    """
+    Decode the `classifier_pT_PID` histograms of the given estimators into `shared_dir`, unless an up to date
+    copy exists already
+
+    Parameters
+    ----------
+    f : File
+        File of the Sums
+    sums : TList or LazySums
+    est_names : list
+        Estimators whose histograms are shared; estimators missing in the Sums are skipped
+
+    Returns
+    -------
+    list :
+        Names of the estimators whose histograms are available in `shared_dir`
+    """
+    stamp = shared_stamp(f, sums_dir_name)
+    shared = []
+    for est_name in est_names:
+        est_list = sums.FindObject(est_name)
+        if not est_list:
+            continue
+        est_dir = _est_dir(shared_dir, sums_dir_name, est_name)
+        meta = _read_meta(est_dir)
+        if meta is None or meta['stamp'] != stamp:
+            h3d = est_list.FindObject(pid_hist_name.format(est_name))
+            if not h3d:
+                continue
+            log.info("Sharing {} in {}".format(h3d.GetName(), est_dir))
+            share_pid_hist(h3d, est_dir, stamp)
+        shared.append(est_name)
+    return shared
+
+
+def attach_pid_hist(shared_dir, sums_dir_name, est_name, stamp):
+    """
+    Map the shared arrays of the `classifier_pT_PID` histogram of an estimator read-only; No data is copied.
+
+    Parameters
+    ----------
+    stamp : str
+        `shared_stamp` of the current Sums; arrays decoded from other Sums are not used
+
+    Returns
+    -------
+    SharedHist3D or None :
+        None if the histogram was not shared or the arrays are out of date
+    """
+    est_dir = _est_dir(shared_dir, sums_dir_name, est_name)
+    meta = _read_meta(est_dir)
+    if meta is None:
+        return None
+    if meta['stamp'] != stamp:
+        log.warning("Shared arrays in {} are out of date; reading the histogram from the Sums".format(est_dir))
+        return None
+    edges = [np.asarray(e) for e in meta['edges']]
+    harr = HistArray(name=meta['name'],
+                     contents=unflatten(np.load(os.path.join(est_dir, "contents.npy"), mmap_mode='r'), edges),
+                     sumw2=unflatten(np.load(os.path.join(est_dir, "sumw2.npy"), mmap_mode='r'), edges),
+                     edges=edges,
+                     labels=meta['labels'])
+    return SharedHist3D(harr, title=meta['title'], axis_titles=meta['axis_titles'])
+
+
+class _LabelAxis(object):
+    """
+    The parts of the TAxis interface which are used on the PID axis
+    """
+    def __init__(self, labels):
+        self._labels = labels
+
+    def GetNbins(self):
+        return len(self._labels)
+
+    def GetBinLabel(self, ibin):
+        return self._labels[ibin - 1]
+
+    def find_bin(self, label):
+        """Bin of the given label; 0 if it does not exist, like TAxis.FindFixBin"""
+        try:
+            return self._labels.index(label) + 1
+        except ValueError:
+            return 0
+
+
+class SharedHist3D(object):
+    """
+    Read-only stand-in for a `classifier_pT_PID` Hist3D whose arrays are memory-mapped (or decoded once with
+    `from_hist`). It can be given to `ProjectionCache`, which then projects the arrays instead of calling
+    Project3D.
+    """
+    def __init__(self, harr, title="", axis_titles=("", "", "")):
+        self.arrays = harr
+        self.title = title
+        self.axis_titles = axis_titles
+        self.zaxis = _LabelAxis(harr.labels[2])
+
+    @classmethod
+    def from_hist(cls, h3d):
+        """Decode the bin contents of a Hist3D once into (in-memory) arrays"""
+        return cls(hist_to_array(h3d), title=h3d.GetTitle(),
+                   axis_titles=[axis.GetTitle() for axis in hist_axes(h3d)])
+
+    def GetName(self):
+        return self.arrays.name
+
+    def GetZaxis(self):
+        return self.zaxis
+
+    def project_yx(self, pid_bin_range):
+        """
+        Sum of the given PID bins (inclusive), like Project3D("yx") with this range on the z axis
+
+        Returns
+        -------
+        Hist2D :
+            x: classifier value; y: pT
+        """
+        first, last = pid_bin_range
+        harr = self.arrays
+        # TH2D like the result of Project3D
+        h = adopt(Hist2D(list(harr.edges[0]), list(harr.edges[1]), name=temp_name(), title=self.title, type='D'))
+        set_bin_contents(h, harr.contents[:, :, first:last + 1].sum(axis=2),
+                         harr.sumw2[:, :, first:last + 1].sum(axis=2))
+        h.GetXaxis().SetTitle(self.axis_titles[0])
+        h.GetYaxis().SetTitle(self.axis_titles[1])
+        return h
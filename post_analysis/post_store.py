@@ -0,0 +1,216 @@
+"""
+Indexed store of the numeric results of the post analysis. Next to each figure (a canvas), the plotted
+histograms and graphs are written as plain objects to the `store` dir of the results dir. An index maps
+(observable, estimator, label) to these objects, so that comparisons can read single results without
+deserializing whole canvases and searching them by legend title.
+
+The observable is the figure's path below the results dir without the estimator dir, eg.
+"dNdeta_MB_ratio_summary" or "pid_ratios_vs_refmult/3312_div_-211_211". The label is the legend title of
+the plotted object, ie. usually the percentile bin ("0.0%-0.1%") or "MB". Figures which compare estimators
+label their objects with the estimator title (see `make_estimator_title`, eg. "|#eta|#leq1.5"); for those, the
+estimator is taken from the label.
+
+The index also keeps the titles and plot and legend properties of each figure, so that figures of a data-only
+run (see `Plotting`) can be drawn later from the store:
+
+    $ python ./post_store.py path/to/AnalysisResults.root V0AND --canvases --pdf-dir plots/
+"""
+
+import argparse
+from collections import OrderedDict
+import json
+import os
+import re
+
+from rootpy import log, ROOT
+from rootpy.io import DoesNotExist, root_open
+
+from roofie.figure import Figure
+
+from post_utils import make_estimator_title, native_strings
+
+log = log["/store"]
+
+store_dir_name = "store"
+index_name = "index"
+
+
+def split_figure_path(figure_path, est_names):
+    """
+    Split the path of a figure below the results dir (eg. "V0M/dNdeta_summary") into the estimator (or None)
+    and the observable
+    """
+    parts = figure_path.split("/")
+    if len(parts) > 1 and parts[0] in est_names:
+        return parts[0], "/".join(parts[1:])
+    return None, figure_path
+
+
+def _json_value(value):
+    if isinstance(value, (list, tuple)):
+        return all(_json_value(v) for v in value)
+    return value is None or isinstance(value, (basestring, bool, int, long, float))
+
+
+def figure_properties(fig):
+    """Titles and the plot and legend properties of a figure which can be stored as json"""
+    return dict(xtitle=fig.xtitle, ytitle=fig.ytitle,
+                plot=dict((k, v) for k, v in vars(fig.plot).items() if _json_value(v)),
+                legend=dict((k, v) for k, v in vars(fig.legend).items() if _json_value(v)))
+
+
+def object_name(observable, estimator, label):
+    """Name of a stored object; only letters, digits and underscores"""
+    return re.sub(r"[^A-Za-z0-9]+", "_", "__".join([observable, estimator or "", label]))
+
+
+class ResultsStore(object):
+    """
+    Index of the objects in the store dir of one results dir
+    """
+    def __init__(self, trigger='', entries=None, figures=None):
+        """
+        Parameters
+        ----------
+        trigger : str
+            Trigger of the results dir; recorded in the index
+        entries : list
+            Index entries (dicts) of a previous run
+        figures : dict
+            Properties (see `figure_properties`) of each figure path of a previous run
+        """
+        self.trigger = trigger
+        # (observable, estimator, label) -> entry
+        self.entries = OrderedDict()
+        for entry in entries or []:
+            self.entries[(entry['observable'], entry['estimator'], entry['label'])] = entry
+        self.figures = OrderedDict(sorted((figures or {}).items()))
+
+    @classmethod
+    def read(cls, results_dir, trigger=''):
+        """Read the index of the given results dir; an empty store if there is none yet"""
+        try:
+            obj = results_dir.Get(store_dir_name + "/" + index_name)
+        except DoesNotExist:
+            return cls(trigger)
+        if not obj:
+            return cls(trigger)
+        index = native_strings(json.loads(obj.GetString().Data()))
+        return cls(trigger, index['entries'], index['figures'])
+
+    def write_index(self, results_dir):
+        index = dict(entries=self.entries.values(), figures=self.figures)
+        results_dir.Get(store_dir_name).WriteTObject(ROOT.TObjString(json.dumps(index)), index_name, "Overwrite")
+
+    def add_figure(self, results_dir, figure_path, fig, est_names):
+        """
+        Write the plotted objects of a figure to the store dir and add them to the index. Objects of a
+        previous run with the same key are replaced.
+
+        Parameters
+        ----------
+        results_dir : Directory
+        figure_path : str
+            Path of the figure below the results dir
+        fig : Figure
+        est_names : list
+            Names of the estimator dirs
+        """
+        try:
+            store_dir = results_dir.Get(store_dir_name)
+        except DoesNotExist:
+            store_dir = results_dir.mkdir(store_dir_name)
+        # entries of a previous run of this figure are replaced as a whole, including their objects
+        for key in [key for key, entry in self.entries.items() if entry['figure'] == figure_path]:
+            store_dir.Delete(self.entries[key]['name'] + ";*")
+            del self.entries[key]
+        self.figures[figure_path] = figure_properties(fig)
+        dir_est, observable = split_figure_path(figure_path, est_names)
+        est_by_title = dict((make_estimator_title(est_name), est_name) for est_name in est_names)
+        for position, plottable in enumerate(fig._plottables):
+            label = plottable['legend_title'] or ''
+            estimator = dir_est
+            if estimator is None and label in est_by_title:
+                estimator, label = est_by_title[label], ''
+            key = (observable, estimator, label)
+            if key in self.entries:
+                # eg. several objects without legend title
+                label = "{}#{}".format(label, position)
+                key = (observable, estimator, label)
+            name = object_name(observable, estimator, label)
+            store_dir.WriteTObject(plottable['p'], name, "Overwrite")
+            self.entries[key] = dict(observable=observable, estimator=estimator, label=label,
+                                     trigger=self.trigger, name=name, figure=figure_path, position=position,
+                                     legend_title=plottable['legend_title'] or '',
+                                     color=plottable.get('color'), markerstyle=plottable.get('markerstyle'))
+
+    def find(self, observable, estimator=None, label=''):
+        """
+        Index entry of the given result
+
+        Raises
+        ------
+        KeyError :
+            There is no such result in the store
+        """
+        return self.entries[(observable, estimator, label)]
+
+    def figure_entries(self, figure_path):
+        """Index entries of the objects of the figure at `figure_path` in the order they were plotted"""
+        return sorted([entry for entry in self.entries.values() if entry['figure'] == figure_path],
+                      key=lambda entry: entry['position'])
+
+    def build_figure(self, results_dir, figure_path):
+        """
+        Figure at `figure_path` rebuilt from the stored objects and properties
+
+        Raises
+        ------
+        KeyError :
+            There is no such figure in the store
+        """
+        props = self.figures[figure_path]
+        fig = Figure()
+        fig.xtitle, fig.ytitle = props['xtitle'], props['ytitle']
+        for section in ('plot', 'legend'):
+            for attr, value in props[section].items():
+                setattr(getattr(fig, section), attr, value)
+        for entry in self.figure_entries(figure_path):
+            obj = results_dir.Get(store_dir_name + "/" + entry['name'])
+            style = dict((k, tuple(entry[k]) if isinstance(entry[k], list) else entry[k])
+                         for k in ('color', 'markerstyle') if entry[k] is not None)
+            fig.add_plottable(obj, legend_title=entry['legend_title'], **style)
+        return fig
+
+    def __len__(self):
+        return len(self.entries)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Draw the figures of the results store, eg. after a "
+                                                 "data-only run of the post analysis")
+    parser.add_argument("input_file", help="AnalysisResults.root file")
+    parser.add_argument("trigger", choices=["Inel", "InelGt0", "V0AND"])
+    parser.add_argument("--figure", nargs="+", metavar="PATH",
+                        help="Only these figures, eg. V0M/dNdeta_summary; all by default")
+    parser.add_argument("--canvases", action="store_true", help="Write the figures to the results dir")
+    parser.add_argument("--pdf-dir", help="Directory to which each figure is saved as pdf")
+    args = parser.parse_args()
+    if not args.canvases and args.pdf_dir is None:
+        parser.error("No output given; use --canvases and/or --pdf-dir")
+
+    ROOT.gROOT.SetBatch(True)
+    results_path = "/MultEstimators/results_post" + args.trigger
+    with root_open(args.input_file, 'update' if args.canvases else 'read') as f:
+        results_dir = f.Get(results_path)
+        store = ResultsStore.read(results_dir, args.trigger)
+        for figure_path in (args.figure if args.figure is not None else store.figures.keys()):
+            fig = store.build_figure(results_dir, figure_path)
+            dirname, name = os.path.split(figure_path)
+            if args.canvases:
+                fig.save_to_root_file(f, name, results_path + ("/" + dirname if dirname else ""))
+            if args.pdf_dir is not None:
+                fig.save_to_file(args.pdf_dir, figure_path.replace("/", "__") + ".pdf")
+            log.info("Drew {}".format(figure_path))
+        if args.canvases:
+            f.Write()
@@ -0,0 +1,199 @@
+"""
+Summary pdf of a post analysis run. It has the same interface as roofie's `Beamerdoc` (`add_section`,
+`Section.add_figure` and `finalize_document`), but the figures are rendered in a pool of processes and
+each image is cached under a hash of the figure's contents and style. Images of unchanged figures are
+reused from previous runs. The latex document is compiled once at the end.
+"""
+
+from collections import OrderedDict
+import cPickle as pickle
+import hashlib
+from multiprocessing import Pool
+import os
+import re
+import subprocess
+
+import numpy as np
+
+from rootpy import log, ROOT
+
+from roofie.figure import Figure
+
+from post_utils import get_bin_contents, graph_to_arrays
+
+log = log["/summary"]
+
+figures_dir_name = "figures"
+
+latex_header = r"""\documentclass[aspectratio=169]{{beamer}}
+\usepackage{{graphicx}}
+\title{{{title}}}
+\author{{{author}}}
+\begin{{document}}
+\frame{{\titlepage}}
+"""
+
+latex_figure = r"""\begin{{frame}}
+\begin{{center}}
+\includegraphics[width=\textwidth,height=0.9\textheight,keepaspectratio]{{{path}}}
+\end{{center}}
+\end{{frame}}
+"""
+
+
+_latex_special = {
+    "\\": r"\textbackslash{}", "&": r"\&", "%": r"\%", "$": r"\$", "#": r"\#", "_": r"\_",
+    "{": r"\{", "}": r"\}", "~": r"\textasciitilde{}", "^": r"\textasciicircum{}",
+}
+
+
+def latex_escape(text):
+    """Escape the characters of plain text (eg. a summary name like LHC16_pass1) which are special in latex"""
+    return "".join(_latex_special.get(c, c) for c in text)
+
+
+def _update_with_object(md5, obj):
+    """Add the class, titles, binning and contents of a plotted object to the hash"""
+    md5.update(obj.ClassName())
+    md5.update(obj.GetTitle())
+    if obj.InheritsFrom("TH1"):
+        for axis in (obj.GetXaxis(), obj.GetYaxis(), obj.GetZaxis()):
+            md5.update(repr((axis.GetNbins(), axis.GetXmin(), axis.GetXmax(), axis.GetTitle())))
+            for ibin in xrange(1, axis.GetNbins() + 1):
+                md5.update(axis.GetBinLabel(ibin))
+        md5.update(get_bin_contents(obj).tostring())
+        nsumw2 = obj.GetSumw2N()
+        if nsumw2 > 0:
+            buf = obj.GetSumw2().GetArray()
+            buf.SetSize(nsumw2)
+            md5.update(np.frombuffer(buf, dtype=np.float64, count=nsumw2).tostring())
+        return True
+    if obj.InheritsFrom("TGraphAsymmErrors"):
+        for a in graph_to_arrays(obj):
+            md5.update(a.tostring())
+        return True
+    return False
+
+
+def figure_hash(fig):
+    """
+    Hash of the contents and style of a figure, or None if it contains objects which cannot be hashed (these
+    figures are always rendered)
+    """
+    md5 = hashlib.md5()
+    md5.update(repr(Figure.style))
+    md5.update(repr((fig.xtitle, fig.ytitle)))
+    for props in (fig.plot, fig.legend):
+        md5.update(repr(sorted(vars(props).items())))
+    for plottable in fig._plottables:
+        for key, value in sorted(plottable.items()):
+            if key == 'p':
+                if not _update_with_object(md5, value):
+                    return None
+            else:
+                md5.update(repr((key, value)))
+    return md5.hexdigest()
+
+
+def _render_figure(args):
+    pickled_fig, path, fname = args
+    ROOT.gROOT.SetBatch(True)
+    pickle.loads(pickled_fig).save_to_file(path, fname)
+    return fname
+
+
+class Section(object):
+    def __init__(self, title):
+        self.title = title
+        self.figures = []
+
+    def add_figure(self, fig):
+        self.figures.append(fig)
+
+
+class SummaryDoc(object):
+    """
+    Beamer summary of the figures of a post analysis run. The document and the images are written to a folder
+    named after the title.
+    """
+    def __init__(self, author, title, output_dir=None):
+        self.author = author
+        self.title = title
+        self.output_dir = output_dir if output_dir is not None else re.sub(r"[^A-Za-z0-9]+", "_", title)
+        self.sections = []
+        self.rendered = 0
+        self.reused = 0
+
+    def add_section(self, title):
+        section = Section(title)
+        self.sections.append(section)
+        return section
+
+    def _image_names(self):
+        """File name of the image of each figure; figures which cannot be hashed get a unique name"""
+        names = []
+        for nsec, section in enumerate(self.sections):
+            for nfig, fig in enumerate(section.figures):
+                fig_hash = figure_hash(fig)
+                names.append((fig, fig_hash is not None,
+                              "{}.pdf".format(fig_hash) if fig_hash is not None
+                              else "uncached_{}_{}.pdf".format(nsec, nfig)))
+        return names
+
+    def render_figures(self, jobs=1):
+        """Render the images of all figures which are not in the cache yet"""
+        figures_dir = os.path.join(self.output_dir, figures_dir_name)
+        if not os.path.isdir(figures_dir):
+            os.makedirs(figures_dir)
+        names = self._image_names()
+        cached = set(os.listdir(figures_dir))
+        todo = OrderedDict()
+        for fig, cachable, fname in names:
+            if cachable and fname in cached:
+                self.reused += 1
+            elif fname not in todo:
+                todo[fname] = fig
+        args = [(pickle.dumps(fig, pickle.HIGHEST_PROTOCOL), figures_dir, fname) for fname, fig in todo.items()]
+        if jobs > 1 and len(args) > 1:
+            pool = Pool(jobs)
+            try:
+                pool.map(_render_figure, args)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            [_render_figure(arg) for arg in args]
+        self.rendered += len(args)
+        # images of figures which are gone would otherwise pile up
+        used = set(fname for _, _, fname in names)
+        for fname in cached - used:
+            os.remove(os.path.join(figures_dir, fname))
+        return [fname for _, _, fname in names]
+
+    def write_latex(self, image_names):
+        fname = os.path.join(self.output_dir, "summary.tex")
+        images = iter(image_names)
+        with open(fname, "w") as f:
+            # section titles are latex on purpose; title and author are plain text given by the user
+            f.write(latex_header.format(title=latex_escape(self.title), author=latex_escape(self.author)))
+            for section in self.sections:
+                f.write("\\section{{{}}}\n".format(section.title))
+                for _ in section.figures:
+                    f.write(latex_figure.format(path=figures_dir_name + "/" + next(images)))
+            f.write("\\end{document}\n")
+        return fname
+
+    def finalize_document(self, jobs=1):
+        """Render the figures in `jobs` processes, write the latex document and compile it once"""
+        image_names = self.render_figures(jobs=jobs)
+        tex_name = self.write_latex(image_names)
+        log.info("{}: {} figures rendered, {} reused".format(self.title, self.rendered, self.reused))
+        with open(os.devnull, "w") as devnull:
+            try:
+                subprocess.check_call(["pdflatex", "-interaction=nonstopmode", os.path.basename(tex_name)],
+                                      cwd=self.output_dir, stdout=devnull)
+            except subprocess.CalledProcessError:
+                # the results are in the file already; do not lose the rest of the run over the pdf
+                log.error("pdflatex failed on {}; see summary.log in the same folder".format(tex_name))
+                return None
+        return os.path.join(self.output_dir, "summary.pdf")
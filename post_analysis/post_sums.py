@@ -0,0 +1,190 @@
+"""
+Lazy access to the Sums of the analysis task. The Sums are a single TList (one list per estimator), which
+ROOT can only deserialize as a whole, including the estimators which are not considered and large 3D
+histograms which are not used. Therefore, the objects of each estimator list are copied once into their own
+keys in a cache file next to the input file (see `split_file_name`):
+
+    <input>_sums_split.root:/<sums dir>/<estimator>/<object>
+
+`LazySums` then reads only the estimator lists and objects which are actually accessed and keeps them for the
+session. The input file itself is never changed, so the lazy mode also works if it is opened read-only.
+
+Making the copy deserializes the whole Sums once. It is only made on request (`lazy=True` in `load_sums`) and
+redone if the Sums key changed (eg. the file was merged again).
+"""
+
+import json
+import os
+
+from rootpy import collection, log, ROOT
+from rootpy.io import DoesNotExist, root_open
+
+from post_temporaries import adopt
+from post_utils import native_strings
+
+log = log["/sums"]
+
+split_suffix = "_sums_split.root"
+# json with the stamp of the Sums key the copy was made from and the order of the estimators
+split_info_name = "split_info"
+
+
+def split_file_name(f_name):
+    """Cache file of the split Sums of the given input file"""
+    return os.path.splitext(f_name)[0] + split_suffix
+
+
+def sums_stamp(f, sums_dir_name):
+    """Cycle, date and size of the Sums key; changes if the Sums are written again"""
+    key = f.MultEstimators.GetKey(sums_dir_name)
+    if not key:
+        raise DoesNotExist(sums_dir_name)
+    return "{} {} {}".format(key.GetCycle(), key.GetDatime().AsSQLString(), key.GetNbytes())
+
+
+def _split_info(split_f, sums_dir_name):
+    try:
+        obj = split_f.Get(sums_dir_name + "/" + split_info_name)
+    except DoesNotExist:
+        return None
+    if not obj:
+        return None
+    return native_strings(json.loads(obj.GetString().Data()))
+
+
+def split_sums(f, sums_dir_name, split_f):
+    """
+    Copy each object of each estimator list of the Sums into its own key of the cache file, unless an up to
+    date copy exists
+
+    Parameters
+    ----------
+    f : File
+        Input file
+    split_f : File
+        Cache file opened for writing
+    """
+    stamp = sums_stamp(f, sums_dir_name)
+    info = _split_info(split_f, sums_dir_name)
+    if info is not None and info['stamp'] == stamp:
+        return
+    if info is not None:
+        log.info("{} changed since it was split; splitting it again".format(sums_dir_name))
+        split_f.rm(sums_dir_name)
+    log.info("Splitting {} into one key per object in {}".format(sums_dir_name, split_f.GetName()))
+    split_dir = split_f.mkdir(sums_dir_name)
+    sums = f.MultEstimators.Get(sums_dir_name)
+    est_names = []
+    for est_list in sums:
+        est_names.append(est_list.GetName())
+        est_dir = split_dir.mkdir(est_list.GetName())
+        for obj in est_list:
+            est_dir.WriteTObject(obj, obj.GetName())
+        if isinstance(est_list, collection.List):
+            est_list.Delete()
+    sums.Delete()
+    split_dir.WriteTObject(ROOT.TObjString(json.dumps(dict(stamp=stamp, estimators=est_names))),
+                           split_info_name)
+    split_f.Write()
+
+
+class LazyEstimatorList(object):
+    """
+    Objects of one estimator, read on first access. Provides the parts of the TList interface used by the
+    plot steps.
+    """
+    def __init__(self, tdir, name):
+        self._tdir = tdir
+        self._name = name
+        self._objects = {}
+
+    def GetName(self):
+        return self._name
+
+    def FindObject(self, name):
+        """The object with the given name or None, like TList.FindObject"""
+        if name not in self._objects:
+            try:
+                obj = self._tdir.Get(name)
+            except DoesNotExist:
+                return None
+            if isinstance(obj, ROOT.TH1):
+                # owned by python, so that it is freed once the session drops it; trees still read from the file
+                adopt(obj)
+            self._objects[name] = obj
+        return self._objects[name]
+
+    def __iter__(self):
+        for key in self._tdir.GetListOfKeys():
+            yield self.FindObject(key.GetName())
+
+    def Delete(self):
+        self._objects.clear()
+
+
+class LazySums(object):
+    """
+    Lazy replacement of the Sums TList; iterating over it does not read any histograms. It keeps the cache
+    file open until `Delete` is called.
+    """
+    def __init__(self, split_f, name, est_names):
+        self._split_f = split_f
+        self._split_dir = split_f.Get(name)
+        self._name = name
+        self._est_names = est_names
+        self._lists = {}
+
+    def GetName(self):
+        return self._name
+
+    def FindObject(self, name):
+        """The estimator list with the given name or None, like TList.FindObject"""
+        if name not in self._est_names:
+            return None
+        if name not in self._lists:
+            self._lists[name] = LazyEstimatorList(self._split_dir.Get(name), name)
+        return self._lists[name]
+
+    def __iter__(self):
+        for name in self._est_names:
+            yield self.FindObject(name)
+
+    def Delete(self):
+        """Free all objects read so far and close the cache file"""
+        for est_list in self._lists.values():
+            est_list.Delete()
+        self._lists.clear()
+        self._split_f.Close()
+
+
+def _open_split(f, sums_dir_name, split_name):
+    """The cache file opened read-only and its split info, if it has an up to date copy of the Sums"""
+    if not os.path.exists(split_name):
+        return None, None
+    split_f = root_open(split_name, 'read')
+    info = _split_info(split_f, sums_dir_name)
+    if info is not None and info['stamp'] == sums_stamp(f, sums_dir_name):
+        return split_f, info
+    split_f.Close()
+    return None, None
+
+
+def load_sums(f, sums_dir_name, lazy=False):
+    """
+    The Sums of the given file: a `LazySums` if `lazy` and an up to date split copy exists or can be made in
+    the cache file (see `split_file_name`), otherwise the TList read as a whole
+    """
+    if lazy:
+        split_name = split_file_name(f.GetName())
+        # the cache file is only opened for writing if the copy is out of date, so that the processes of a
+        # parallel run, which start after the main process made the copy, only read it
+        split_f, info = _open_split(f, sums_dir_name, split_name)
+        if split_f is None and os.access(os.path.dirname(os.path.abspath(split_name)), os.W_OK):
+            with root_open(split_name, 'update') as update_f:
+                split_sums(f, sums_dir_name, update_f)
+            split_f, info = _open_split(f, sums_dir_name, split_name)
+        if split_f is not None:
+            return LazySums(split_f, sums_dir_name, info['estimators'])
+        log.warning("No up to date split copy of {} can be made next to {}; reading the Sums as a whole"
+                    .format(sums_dir_name, f.GetName()))
+    return f.MultEstimators.__getattr__(sums_dir_name)
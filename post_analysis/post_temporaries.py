@@ -0,0 +1,110 @@
+"""
+Registry of the temporary ROOT objects (projections, profiles, clones, ...) created during a post analysis run.
+Temporaries get short deterministic names and are detached from any directory, so that they are freed by
+python as soon as nobody references them anymore instead of piling up in gDirectory. The registry only keeps
+weak references to them: the objects created in a scope (eg. a plot step) are counted, and those which were
+freed by the end of the scope are reported as released.
+"""
+
+from contextlib import contextmanager
+import itertools
+import weakref
+
+from rootpy import log, ROOT
+
+log = log["/temporaries"]
+
+
+class TempRegistry(object):
+    def __init__(self, prefix="tmp_"):
+        self.prefix = prefix
+        self._counter = itertools.count()
+        # weak references to the objects created in each open scope; the innermost scope is last
+        self._scopes = []
+        # weak references to all registered objects which are still alive, by id; not a WeakSet, since the
+        # histograms define their own (content based) comparisons
+        self._alive = {}
+        self.created = 0
+        # created outside of any scope (eg. in `Plotting.__init__`); they are never released by a scope
+        self.unscoped = 0
+        self.released = 0
+        # objects whose proxies do not support weak references; whether they are freed is not known
+        self.untracked = 0
+
+    def name(self):
+        """Next unique name for a temporary object, eg. tmp_42"""
+        return "{}{}".format(self.prefix, next(self._counter))
+
+    def adopt(self, obj, name=None):
+        """
+        Register a newly created temporary object with the current scope.
+
+        Parameters
+        ----------
+        obj : TObject
+            The object is detached from its directory (if any) and python takes over its ownership
+        name : str
+            New name of the object
+
+        Returns
+        -------
+        TObject :
+            The given object
+        """
+        if name is not None:
+            obj.SetName(name)
+        if hasattr(obj, "SetDirectory"):
+            obj.SetDirectory(0)
+        ROOT.SetOwnership(obj, True)
+        self.created += 1
+        key = id(obj)
+        try:
+            ref = weakref.ref(obj, lambda _: self._alive.pop(key, None))
+            self._alive[key] = ref
+        except TypeError:
+            ref = None
+            self.untracked += 1
+        if not self._scopes:
+            self.unscoped += 1
+        elif ref is not None:
+            self._scopes[-1].append(ref)
+        return obj
+
+    @contextmanager
+    def scope(self, name):
+        """
+        Context manager for a step which creates temporaries. At its end, the objects created in it which
+        are no longer referenced (eg. by a figure or a cache) are counted as released.
+        """
+        refs = []
+        self._scopes.append(refs)
+        try:
+            yield
+        finally:
+            self._scopes.pop()
+            released = sum(1 for ref in refs if ref() is None)
+            log.debug("{}: {} temporaries created, {} released".format(name, len(refs), released))
+            self.released += released
+
+    def report(self):
+        """Log how many temporaries were created, released at the end of their step and are still alive"""
+        log.info("Temporary objects: {} created in steps, {} released at the end of their step; {} created "
+                 "outside of any step; {} still alive".format(self.created - self.unscoped, self.released,
+                                                              self.unscoped, len(self._alive)))
+        if self.untracked:
+            log.info("{} temporaries do not support weak references and are not counted as released or "
+                     "alive".format(self.untracked))
+
+
+# registry of this process
+temporaries = TempRegistry()
+
+
+def temp_name():
+    """Name for a temporary object; see `TempRegistry.name`"""
+    return temporaries.name()
+
+
+def adopt(obj, name=None):
+    """Register a temporary object with the registry of this process; see `TempRegistry.adopt`"""
+    return temporaries.adopt(obj, name)
@@ -1,13 +1,9 @@
-import string
-import random
+import numpy as np
 
-from rootpy import asrootpy
-from rootpy.plotting import Graph
+from rootpy import asrootpy, ROOT
+from rootpy.plotting import Hist
 
-
-def gen_random_name():
-    """Generate a random name for temp hists"""
-    return ''.join(random.choice(string.ascii_letters + string.digits) for _ in range(25))
+from post_temporaries import adopt, temp_name
 
 
 def get_est_dirs(sums, considered_ests):
@@ -27,6 +23,27 @@ def make_estimator_title(name):
         return name
 
 
+def percentile_title(perc_bin):
+    """Legend title of a percentile bin in the dN/deta and p_T figures, eg. "0.0%-0.1%" """
+    return "{}%-{}%".format(perc_bin[1] * 100, perc_bin[0] * 100)
+
+
+def pnch_percentile_title(perc_bin):
+    """Legend title of a percentile bin in the P(N_ch) figures, eg. "0.1% - 0.0%" """
+    return "{}% - {}%".format(perc_bin[0] * 100, perc_bin[1] * 100)
+
+
+def native_strings(obj):
+    """Convert the unicode strings returned by json (recursively) to str, which all ROOT functions accept"""
+    if isinstance(obj, dict):
+        return obj.__class__((native_strings(k), native_strings(v)) for k, v in obj.items())
+    if isinstance(obj, list):
+        return [native_strings(v) for v in obj]
+    if isinstance(obj, unicode):
+        return obj.encode('utf-8')
+    return obj
+
+
 def remap_x_values(hist, corr_hist):
     """
     Map the x values of hist to the y values of map_hist.
@@ -44,68 +61,315 @@ def remap_x_values(hist, corr_hist):
     Graph
             Graph of the remapped hist. Errors are ??? TODO
     """
-    hist = asrootpy(hist)
-    corr_hist = asrootpy(corr_hist)
-    profx = asrootpy(corr_hist.ProfileX(gen_random_name()))
-
-    rt_graph = Graph()
-    for i, (nch_ref_bin, counter_bin) in enumerate(zip(profx.bins(), hist.bins())):
-        rt_graph.SetPoint(i, nch_ref_bin.value, counter_bin.value)
-        xerr, yerr = nch_ref_bin.error / 2.0, counter_bin.error / 2.0
-        rt_graph.SetPointError(i, xerr, xerr, yerr, yerr)
-    return rt_graph
-
-
-def remove_zero_value_points(g):
-    # Remove the points backwards, since the index would change if we do it forwards
-    # The first point has index 0!
-    points_to_remove = []
-    for i, (x, y) in enumerate(g):
-        if not y > 0.0:
-            points_to_remove.append(i)
-    for p in points_to_remove[::-1]:
-        g.RemovePoint(p)
-
-
-def remove_points_with_equal_x(g):
-    """Remove all points which are on already occupied x values. Ie. The first point is kept, all later ones removed"""
-    points_to_remove = []
-    seen_x = []
-    for i, (x, y) in enumerate(g):
-        if x in seen_x:
-            points_to_remove.append(i)
-        else:
-            seen_x.append(x)
-    for p in points_to_remove[::-1]:
-        g.RemovePoint(p)
-
-
-def remove_points_with_x_err_gt_1NchRef(g):
+    return remap_x_values_stack([hist], corr_hist)[0]
+
+
+def remap_x_values_stack(hists, corr_hist):
+    """
+    Map the x values of several histograms with the same binning to the y values of corr_hist. The profile of
+    corr_hist is computed only once and all points are read and written as arrays. See `remap_x_values`.
+
+    Parameters
+    ----------
+    hists : list
+        List of Hist1D or Profile1D
+    corr_hist : Hist2D
+        See `remap_x_values`
+
+    Returns
+    -------
+    list :
+        One Graph for each given histogram
+    """
+    profx = adopt(corr_hist.ProfileX(temp_name()))
+    return remap_x_values_with_profile(hists, profx)
+
+
+def remap_x_values_with_profile(hists, profx):
+    """
+    Same as `remap_x_values_stack`, but with an already computed ProfileX of the correlation histogram
+    (eg. from `post_cache.CorrelationStore`).
+    """
+    xs, xerrs = get_bin_values_and_errors(profx)
+    graphs = []
+    for hist in hists:
+        ys, yerrs = get_bin_values_and_errors(hist)
+        # visible bins only
+        points = slice(1, min(profx.GetNbinsX(), hist.GetNbinsX()) + 1)
+        xerr, yerr = xerrs[points] / 2.0, yerrs[points] / 2.0
+        graphs.append(graph_from_arrays(xs[points], ys[points], xerr, xerr, yerr, yerr))
+    return graphs
+
+
+def graph_to_arrays(g):
+    """
+    Read the points of a graph into numpy arrays in one go.
+
+    Parameters
+    ----------
+    g : TGraphAsymmErrors
+
+    Returns
+    -------
+    tuple :
+        Arrays of x, y, x error low, x error high, y error low and y error high
+    """
     npoints = g.GetN()
-    points_to_remove = []
-    for idx in xrange(0, npoints):
-        if g.GetErrorX(idx) > 1:
-            points_to_remove.append(idx)
-    for p in points_to_remove[::-1]:
-        g.RemovePoint(p)
-
-
-def remove_non_mutual_points(g1, g2):
-    """Remove all points with do no have a corresponding point at the same x-value in the other hist"""
-    points_to_remove1 = []
-    points_to_remove2 = []
-    xs1 = [p[0] for p in g1]
-    xs2 = [p[0] for p in g2]
-    for i, x in enumerate(xs1):
-        if x not in xs2:
-            points_to_remove1.append(i)
-    for i, x in enumerate(xs2):
-        if x not in xs1:
-            points_to_remove2.append(i)
-    for p in points_to_remove1[::-1]:
-        g1.RemovePoint(p)
-    for p in points_to_remove2[::-1]:
-        g2.RemovePoint(p)
+    if npoints == 0:
+        return tuple(np.zeros(0) for _ in range(6))
+    arrays = []
+    for buf in (g.GetX(), g.GetY(), g.GetEXlow(), g.GetEXhigh(), g.GetEYlow(), g.GetEYhigh()):
+        buf.SetSize(npoints)
+        arrays.append(np.frombuffer(buf, dtype=np.float64, count=npoints).copy())
+    return tuple(arrays)
+
+
+def graph_from_arrays(x, y, exl, exh, eyl, eyh, title=""):
+    """
+    Create a Graph (TGraphAsymmErrors) with the given points in one allocation
+
+    Returns
+    -------
+    Graph
+    """
+    arrays = [np.ascontiguousarray(a, dtype=np.float64) for a in (x, y, exl, exh, eyl, eyh)]
+    g = adopt(asrootpy(ROOT.TGraphAsymmErrors(len(arrays[0]), *arrays)), temp_name())
+    g.SetTitle(title)
+    return g
+
+
+def _sanitize_mask(x, y, exl, exh, max_x_err):
+    # same definition as TGraphAsymmErrors::GetErrorX
+    x_err = np.sqrt(0.5 * (exl ** 2 + exh ** 2))
+    # `y > 0` is also False for nan
+    mask = (y > 0.0) & (x_err <= max_x_err)
+    # of the remaining points, only keep the first one on each x value
+    _, first_indices = np.unique(x[mask], return_index=True)
+    keep = np.zeros(mask.sum(), dtype=bool)
+    keep[first_indices] = True
+    mask[mask] = keep
+    return mask
+
+
+def sanitize_graphs(graphs, max_x_err=1.0, mutual=False):
+    """
+    Remove the points of the given graphs which should not be plotted: Points with y <= 0, points with an
+    x-error greater than `max_x_err` (ie. 1 N_ch of the reference estimator) and all but the first point on
+    the same x value. The points of each graph are read once and the cleaned graph is created in one go.
+
+    Parameters
+    ----------
+    graphs : list
+        List of Graphs
+    max_x_err : float
+        Largest x-error of a point which is kept
+    mutual : Boolean
+        Also remove all points without a point at the same x-value in each of the other graphs
+
+    Returns
+    -------
+    list :
+        New Graphs with the remaining points, with the titles of the given graphs
+    """
+    points = [graph_to_arrays(g) for g in graphs]
+    masks = [_sanitize_mask(x, y, exl, exh, max_x_err) for x, y, exl, exh, _, _ in points]
+    if mutual:
+        kept_xs = [p[0][mask] for p, mask in zip(points, masks)]
+        for i, (p, mask) in enumerate(zip(points, masks)):
+            for j, other_xs in enumerate(kept_xs):
+                if i != j:
+                    mask &= np.in1d(p[0], other_xs)
+    return [graph_from_arrays(*[a[mask] for a in p], title=g.GetTitle())
+            for g, p, mask in zip(graphs, points, masks)]
+
+
+# numpy types of the bin contents of the TH* classes, derived from the last letter of the class name
+_hist_content_dtypes = {'C': np.int8, 'S': np.int16, 'I': np.int32, 'F': np.float32, 'D': np.float64}
+
+
+def get_bin_contents(hist):
+    """
+    Read all bin contents of a histogram into a numpy array in one go.
+
+    Parameters
+    ----------
+    hist : TH1, TH2 or TH3
+        Histogram to read. Under- and overflow bins are included.
+
+    Returns
+    -------
+    np.ndarray :
+        Flat float64 array indexed by ROOT's global bin number
+    """
+    ncells = hist.GetSize()
+    class_name = hist.ClassName()
+    dtype = _hist_content_dtypes.get(class_name[-1])
+    if not class_name.startswith('TH') or dtype is None:
+        # Profiles and the like do not store their bin contents in the array; go the slow way
+        return np.array([hist.GetBinContent(i) for i in xrange(ncells)], dtype=np.float64)
+    buf = hist.GetArray()
+    buf.SetSize(ncells)
+    # copy, so that the array stays valid after the histogram is deleted
+    return np.frombuffer(buf, dtype=dtype, count=ncells).astype(np.float64)
+
+
+def _write_buffer(buf, values, dtype):
+    # returns False if the buffer is read-only
+    buf.SetSize(values.size)
+    try:
+        np.frombuffer(buf, dtype=dtype, count=values.size)[:] = values
+    except ValueError:
+        return False
+    return True
+
+
+def set_bin_contents(hist, contents, sumw2=None):
+    """
+    Set all bin contents of a histogram from an array in one go; the inverse of `get_bin_contents`.
+
+    Parameters
+    ----------
+    hist : TH1, TH2 or TH3
+        Histogram to fill
+    contents : np.ndarray
+        Bin contents indexed by [x, y, z] bin numbers (including under- and overflow bins)
+    sumw2 : np.ndarray
+        Squared errors of the same shape; if not given, the errors are the square root of the contents
+    """
+    flat = np.ascontiguousarray(np.asarray(contents, dtype=np.float64).T).ravel()
+    dtype = _hist_content_dtypes[hist.ClassName()[-1]]
+    if not _write_buffer(hist.GetArray(), flat.astype(dtype), dtype):
+        for binidx, content in enumerate(flat):
+            hist.SetBinContent(binidx, content)
+    if sumw2 is not None:
+        flat_sumw2 = np.ascontiguousarray(np.asarray(sumw2, dtype=np.float64).T).ravel()
+        hist.Sumw2()
+        if not _write_buffer(hist.GetSumw2().GetArray(), flat_sumw2, np.float64):
+            for binidx, err2 in enumerate(flat_sumw2):
+                hist.SetBinError(binidx, np.sqrt(err2))
+    hist.SetEntries(flat.sum())
+
+
+def get_bin_values_and_errors(hist):
+    """
+    Read the bin values and errors of a 1D histogram or profile into numpy arrays in one go.
+
+    Parameters
+    ----------
+    hist : Hist1D or Profile1D
+        Under- and overflow bins are included. The values of a profile are the mean of each bin.
+
+    Returns
+    -------
+    tuple :
+        Arrays of the values and errors, indexed by bin number
+    """
+    if hist.InheritsFrom("TProfile"):
+        # the arrays of a profile hold the sums; the projection has the means and their errors
+        proj = adopt(hist.ProjectionX(temp_name()))
+        return get_bin_values_and_errors(proj)
+    values = get_bin_contents(hist)
+    nsumw2 = hist.GetSumw2N()
+    if nsumw2 == 0:
+        # same as TH1::GetBinError without Sumw2
+        return values, np.sqrt(np.abs(values))
+    buf = hist.GetSumw2().GetArray()
+    buf.SetSize(nsumw2)
+    return values, np.sqrt(np.frombuffer(buf, dtype=np.float64, count=nsumw2))
+
+
+def hist_from_arrays(contents, errors, edges, name=None):
+    """
+    Create a Hist1D from arrays
+
+    Parameters
+    ----------
+    contents, errors : np.ndarray
+        Bin contents and errors, including under- and overflow bins
+    edges : np.ndarray
+        Bin edges
+    name : str
+        Name of the histogram; random if not given
+
+    Returns
+    -------
+    Hist1D
+    """
+    h = adopt(Hist(list(edges), name=name if name is not None else temp_name()))
+    for binidx, (content, error) in enumerate(zip(contents, errors)):
+        h.SetBinContent(binidx, content)
+        h.SetBinError(binidx, error)
+    return h
+
+
+def divide_with_errors(num, num_sumw2, denom, denom_sumw2):
+    """
+    Bin-wise ratio of two histograms given as arrays of contents and squared errors. The errors are propagated
+    like in TH1.Divide, ie. the two are assumed to be uncorrelated. Bins with an empty denominator are 0.
+
+    Returns
+    -------
+    tuple :
+        Arrays of the ratio and its errors
+    """
+    nonzero = denom != 0
+    safe_denom = np.where(nonzero, denom, 1.0)
+    ratio = np.where(nonzero, num / safe_denom, 0.0)
+    err2 = np.where(nonzero, (num_sumw2 * denom ** 2 + denom_sumw2 * num ** 2) / safe_denom ** 4, 0.0)
+    return ratio, np.sqrt(err2)
+
+
+def percentile_bins_to_binidx_bins(percentile_bins, event_counter):
+    """
+    Converts all given percentile intervals to intervals of bin numbers of the given event_counter histogram.
+    The bin contents are read only once, so this is much faster than calling `percentile_bin_to_binidx_bin`
+    for each interval.
+
+    Parameters
+    ----------
+    percentile_bins : list
+        List of percentile intervals. See `percentile_bin_to_binidx_bin`
+    event_counter : Hist1D
+        Distribution of events over a classifier value
+
+    Returns
+    -------
+    list :
+        List of tuples of two bin numbers, one for each given percentile interval. See
+        `percentile_bin_to_binidx_bin`
+
+    Raises
+    ------
+    ValueError :
+        One of the percentile intervals specifies a range which is not found in the given event_counter
+        histogram. It might be too narrow.
+    """
+    nbins = event_counter.GetXaxis().GetNbins()
+    counts = get_bin_contents(event_counter)[1:nbins + 1]  # skip under- and overflow
+    # number of events with greater or equal classifier values; hence decreasing values
+    nevents_with_geq_classifier_value = counts[::-1].cumsum()[::-1]
+    ntotal_events = float(nevents_with_geq_classifier_value[0])
+    if ntotal_events == 0:
+        raise ZeroDivisionError("The given event_counter histogram is empty")
+    frac_events_with_geq_classifier_value = nevents_with_geq_classifier_value / ntotal_events
+
+    # searchsorted needs increasing values; the first bin in an interval is the first one with a fraction
+    # smaller or equal the upper percentile, the last bin is the last one with a fraction greater or equal
+    # the lower percentile
+    upper_percentiles = np.array([perc_bin[0] for perc_bin in percentile_bins], dtype=np.float64)
+    lower_percentiles = np.array([perc_bin[1] for perc_bin in percentile_bins], dtype=np.float64)
+    first_indices = np.searchsorted(-frac_events_with_geq_classifier_value, -upper_percentiles, side='left')
+    last_indices = np.searchsorted(-frac_events_with_geq_classifier_value, -lower_percentiles, side='right') - 1
+
+    binidx_bins = []
+    for first_idx, last_idx in zip(first_indices, last_indices):
+        if first_idx > last_idx:
+            print "percentiles: "
+            print list(frac_events_with_geq_classifier_value)
+            raise ValueError("The given percentile interval did not match any bins in the given event_counter histogram")
+        # +1 for root binidx shit
+        binidx_bins.append((int(first_idx) + 1, int(last_idx) + 1))
+    return binidx_bins
 
 
 def percentile_bin_to_binidx_bin(percentile_bin, event_counter):
@@ -132,29 +396,7 @@ def percentile_bin_to_binidx_bin(percentile_bin, event_counter):
         The percentile specifies a range which is not found in the given event_counter histogram. It might be too
         narrow.
     """
-    nbins = event_counter.GetXaxis().GetNbins()
-    ntotal_events = event_counter.Integral(1, nbins)  # .Integral is a closed interval, as far as I can tell...
-    # fraction of events with greater or equal classifier values; hence decreasing values
-    frac_events_with_geq_classifier_value = [event_counter.Integral(binidx, nbins) / float(ntotal_events)
-                                             for binidx in range(1, nbins + 1)]
-    # small checks:
-    if frac_events_with_geq_classifier_value[0] != 1:
-        assert(0)
-    if len(frac_events_with_geq_classifier_value) != nbins:
-        assert(0)
-
-    # produce a list of bools, the first and last True are the first and last bin index
-    fraction_is_in_percentile_interval = lambda fraction: percentile_bin[0] >= fraction >= percentile_bin[1]
-    bin_is_in_percentile_interval = map(fraction_is_in_percentile_interval, frac_events_with_geq_classifier_value)
-    # get the indices of the elements that are True, sorry, this is a bit ugly
-    indices_of_bins_in_percentile_interval = [i for i, b in enumerate(bin_is_in_percentile_interval) if b]
-    # return the first and last binidx of the bins in the percentile interval; +1 for root binidx shit
-    try:
-        return (indices_of_bins_in_percentile_interval[0] + 1, indices_of_bins_in_percentile_interval[-1] + 1)
-    except IndexError:
-        print "percentiles: "
-        print frac_events_with_geq_classifier_value
-        raise ValueError("The given percentile interval did not match any bins in the given event_counter histogram")
+    return percentile_bins_to_binidx_bins([percentile_bin], event_counter)[0]
 
 
 # def create_graph_pided_refest_vs_pidcount(h3d, corr_hist, pids):
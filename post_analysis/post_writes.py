@@ -0,0 +1,73 @@
+"""
+Write-behind buffer for the results of the plot steps. Instead of changing into a directory and writing each
+object (or figure) as soon as it is created, the objects are collected per directory and written directory by
+directory at the end of each plot step or session. The keys of one directory then end up next to each other
+in the file and each directory is visited only once.
+"""
+
+from collections import OrderedDict
+
+from rootpy import log
+
+log = log["/writes"]
+
+
+def normalize_path(path):
+    """Absolute path in the file without a trailing slash, eg. /MultEstimators/results_postV0AND/V0M"""
+    return "/" + path.strip("/")
+
+
+class WriteBuffer(object):
+    def __init__(self):
+        # path -> name -> object or figure; written in the order of the paths
+        self._objects = OrderedDict()
+        self._figures = OrderedDict()
+        self.flushes = 0
+        self.written = 0
+
+    def add(self, path, name, obj):
+        """Queue an object; an object with the same name queued before is replaced"""
+        self._objects.setdefault(normalize_path(path), OrderedDict())[name] = obj
+
+    def add_figure(self, path, name, fig):
+        """Queue a figure; see `flush`"""
+        self._figures.setdefault(normalize_path(path), OrderedDict())[name] = fig
+
+    def __len__(self):
+        return (sum(len(objs) for objs in self._objects.values())
+                + sum(len(figs) for figs in self._figures.values()))
+
+    def flush(self, f, write_figure):
+        """
+        Write all queued objects to the file, one directory after the other
+
+        Parameters
+        ----------
+        f : File
+        write_figure : function
+            Called as write_figure(fig, name, path) for each queued figure
+        """
+        if len(self) == 0:
+            return
+        n = len(self)
+        for path in sorted(set(self._objects) | set(self._figures)):
+            objects = self._objects.get(path, {})
+            if objects:
+                try:
+                    f.mkdir(path, recurse=True)
+                except ValueError:
+                    # exists already
+                    pass
+                tdir = f.GetDirectory(path)
+                for name, obj in objects.items():
+                    tdir.WriteTObject(obj, name, "Overwrite")
+            for name, fig in self._figures.get(path, {}).items():
+                write_figure(fig, name, path)
+        self._objects.clear()
+        self._figures.clear()
+        self.flushes += 1
+        self.written += n
+        log.debug("Wrote {} objects".format(n))
+
+    def report(self):
+        log.info("{} results written in {} batches".format(self.written, self.flushes))